@@ -0,0 +1,254 @@
+#!/usr/bin/python
+"""cgroupstats - Munin Plugin to monitor resource usage of Control Groups
+(containers, systemd services, etc.) in the cgroup v2 hierarchy.
+
+Requirements
+  - Linux with cgroup v2 (unified) hierarchy mounted on /sys/fs/cgroup or
+    /sys/fs/cgroup/unified.
+
+Wild Card Plugin - No
+
+
+Multigraph Plugin - Graph Structure
+   - cgroup_cpu
+   - cgroup_memory
+   - cgroup_io
+
+
+Environment Variables
+
+  include_graphs: Comma separated list of enabled graphs.
+                  (All graphs enabled by default.)
+  exclude_graphs: Comma separated list of disabled graphs.
+  top_cgroups:    Number of cgroups with highest usage in the last interval
+                  to graph individually. The usage of the rest is aggregated
+                  in the other field. (Default: 10)
+  cgroup_depth:   Monitor only cgroups up to this depth in the hierarchy.
+                  (All levels by default.)
+  cgroup_leaves:  Monitor only cgroups without child cgroups to avoid
+                  counting usage both in parent and child. (Default: yes)
+  cgroup_root:    Mount point of cgroup v2 hierarchy.
+                  (Default: /sys/fs/cgroup or /sys/fs/cgroup/unified)
+
+  Example:
+    [cgroupstats]
+        env.top_cgroups 20
+        env.cgroup_depth 2
+
+"""
+# Munin  - Magic Markers
+#%# family=auto
+#%# capabilities=noautoconf nosuggest
+
+import re
+import sys
+import time
+from pymunin import MuninGraph, MuninPlugin, muninMain
+from pysysinfo.cgroup import CgroupInfo
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.9"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+class MuninCgroupPlugin(MuninPlugin):
+    """Multigraph Munin Plugin for monitoring resource usage of Control
+    Groups.
+
+    """
+    plugin_name = 'cgroupstats'
+    isMultigraph = True
+
+    def __init__(self, argv=(), env={}, debug=False):
+        """Populate Munin Plugin with MuninGraph instances.
+
+        @param argv:  List of command line arguments.
+        @param env:   Dictionary of environment variables.
+        @param debug: Print debugging messages if True. (Default: False)
+
+        """
+        MuninPlugin.__init__(self, argv, env, debug)
+
+        self._topCgroups = int(self.envGet('top_cgroups', 10))
+        depth = self.envGet('cgroup_depth')
+        if depth is not None:
+            depth = int(depth)
+
+        self._state = self.restoreState() or {}
+        self._cginfo = CgroupInfo(self.envGet('cgroup_root'), 
+                                  self._state.get('topology'))
+        self._cgroups = self._cginfo.getCgroups(depth,
+            self.envCheckFlag('cgroup_leaves', True))
+        self._stats = self._cginfo.getCgroupStats(self._cgroups)
+        prev_top = self._state.get('top', {})
+
+        if self.graphEnabled('cgroup_cpu'):
+            graph = MuninGraph('Control Groups - CPU Utilization (%)',
+                'System',
+                info='CPU Utilization of the %d Control Groups with highest '
+                     'usage in the last interval.' % self._topCgroups,
+                args='--base 1000 --lower-limit 0')
+            self._addCgroupFields(graph,
+                self._graphCgroups(prev_top.get('cpu'), 'cpu_usage'))
+            self.appendGraph('cgroup_cpu', graph)
+
+        if self.graphEnabled('cgroup_memory'):
+            graph = MuninGraph('Control Groups - Memory Usage (bytes)',
+                'System',
+                info='Memory Usage of the %d Control Groups with highest '
+                     'usage in bytes.' % self._topCgroups,
+                args='--base 1024 --lower-limit 0')
+            self._addCgroupFields(graph,
+                self._graphCgroups(prev_top.get('memory'), 'memory_current'))
+            self.appendGraph('cgroup_memory', graph)
+
+        if self.graphEnabled('cgroup_io'):
+            graph = MuninGraph('Control Groups - I/O Throughput (bytes/sec)',
+                'System',
+                info='Read and Write I/O Throughput of the %d Control Groups '
+                     'with highest throughput in the last interval.'
+                     % self._topCgroups,
+                args='--base 1024 --lower-limit 0')
+            self._addCgroupFields(graph,
+                self._graphCgroups(prev_top.get('io'), 'io_bytes'))
+            self.appendGraph('cgroup_io', graph)
+
+    def _cgroupVal(self, cgroup, key):
+        """Return stat for cgroup or None if unavailable.
+
+        @param cgroup: Path of cgroup.
+        @param key:    Name of stat; io_bytes is the sum of read and write
+                       bytes.
+        @return:       Value of stat.
+
+        """
+        stats = self._stats.get(cgroup)
+        if stats is None:
+            return None
+        if key == 'io_bytes':
+            if stats.has_key('io_rbytes'):
+                return stats['io_rbytes'] + stats['io_wbytes']
+            return None
+        return stats.get(key)
+
+    def _graphCgroups(self, prev_top, key):
+        """Return list of cgroups to graph individually.
+
+        The cgroups selected in the last run are used; on the first run the
+        cgroups are ranked by the current value of stat.
+
+        @param prev_top: List of cgroups selected in last run or None.
+        @param key:      Name of stat for ranking on first run.
+        @return:         List of cgroups.
+
+        """
+        if prev_top is not None:
+            return [cgroup for cgroup in prev_top if cgroup in self._stats]
+        return self._selectTop(dict([(cgroup, self._cgroupVal(cgroup, key))
+                                     for cgroup in self._stats]))
+
+    def _selectTop(self, vals):
+        """Return top N cgroups ranked by value.
+
+        @param vals: Dictionary mapping cgroup to value.
+        @return:     List of selected cgroups.
+
+        """
+        ranked = sorted([(val, cgroup) for (cgroup, val) in vals.iteritems()
+                         if val], reverse=True)
+        return [cgroup for (val, cgroup) in ranked[:self._topCgroups]]
+
+    def _addCgroupFields(self, graph, cgroups):
+        """Add fields for cgroups and the aggregate of the rest to graph.
+
+        @param graph:   MuninGraph instance.
+        @param cgroups: List of cgroups.
+
+        """
+        for cgroup in cgroups:
+            graph.addField(self._fieldName(cgroup), cgroup, type='GAUGE',
+                           draw='LINE2', min=0)
+        graph.addField('other', 'other', type='GAUGE', draw='LINE2', min=0,
+                       info='Aggregate of the rest of the Control Groups.')
+
+    def _fieldName(self, cgroup):
+        """Return field name for cgroup.
+
+        @param cgroup: Path of cgroup.
+        @return:       Field name.
+
+        """
+        return 'cg_' + re.sub('\W', '_', cgroup)
+
+    def retrieveVals(self):
+        """Retrieve values for graphs."""
+        now = time.time()
+        counters = {}
+        for cgroup in self._stats:
+            counters[cgroup] = (self._cgroupVal(cgroup, 'cpu_usage'),
+                                self._cgroupVal(cgroup, 'io_bytes'))
+        interval = None
+        if self._state.has_key('time') and now > self._state['time']:
+            interval = now - self._state['time']
+        prev_counters = self._state.get('counters', {})
+        cpu_rates = {}
+        io_rates = {}
+        if interval is not None:
+            for (cgroup, (cpu, io)) in counters.iteritems():
+                prev = prev_counters.get(cgroup)
+                if prev is None:
+                    continue
+                if cpu is not None and prev[0] is not None and cpu >= prev[0]:
+                    cpu_rates[cgroup] = (cpu - prev[0]) / interval / 10000.0
+                if io is not None and prev[1] is not None and io >= prev[1]:
+                    io_rates[cgroup] = (io - prev[1]) / interval
+        mem_vals = dict([(cgroup, self._cgroupVal(cgroup, 'memory_current'))
+                         for cgroup in self._stats])
+        top = self._state.get('top', {})
+        for (graph_name, key, vals) in (('cgroup_cpu', 'cpu', cpu_rates),
+                                        ('cgroup_memory', 'memory', mem_vals),
+                                        ('cgroup_io', 'io', io_rates)):
+            if self.hasGraph(graph_name):
+                if interval is not None or key == 'memory':
+                    self._setCgroupVals(graph_name, vals)
+                    top[key] = self._selectTop(vals)
+                else:
+                    for field in self.getGraphFieldList(graph_name):
+                        self.setGraphVal(graph_name, field, None)
+        self.saveState({'time': now,
+                        'counters': counters,
+                        'top': top,
+                        'topology': self._cginfo.getTopology()})
+
+    def _setCgroupVals(self, graph_name, vals):
+        """Set values for cgroup fields of graph and the aggregate of the
+        rest of the cgroups.
+
+        @param graph_name: Graph name.
+        @param vals:       Dictionary mapping cgroup to value.
+
+        """
+        fields = set(self.getGraphFieldList(graph_name))
+        other = 0
+        for (cgroup, val) in vals.iteritems():
+            if val is None:
+                continue
+            field = self._fieldName(cgroup)
+            if field in fields:
+                self.setGraphVal(graph_name, field, val)
+                fields.discard(field)
+            else:
+                other += val
+        fields.discard('other')
+        for field in fields:
+            self.setGraphVal(graph_name, field, None)
+        self.setGraphVal(graph_name, 'other', other)
+
+
+if __name__ == "__main__":
+    sys.exit(muninMain(MuninCgroupPlugin))
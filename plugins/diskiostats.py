@@ -11,24 +11,57 @@ Multigraph Plugin - Graph Structure
     - diskio_disk_requests
     - diskio_disk_bytes
     - diskio_disk_active
+    - diskio_disk_await
+    - diskio_disk_svctm
+    - diskio_disk_util
+    - diskio_disk_queue
+    - diskio_disk_iosize
+    - diskio_disk_merges
     - diskio_part_requests
     - diskio_part_bytes
     - diskio_part_active
+    - diskio_part_await
+    - diskio_part_svctm
+    - diskio_part_util
+    - diskio_part_queue
+    - diskio_part_iosize
+    - diskio_part_merges
     - diskio_md_requests
     - diskio_md_bytes
     - diskio_md_active
+    - diskio_md_await
+    - diskio_md_svctm
+    - diskio_md_util
+    - diskio_md_queue
+    - diskio_md_iosize
+    - diskio_md_merges
     - diskio_lv_requests
     - diskio_lv_bytes
     - diskio_lv_active
+    - diskio_lv_await
+    - diskio_lv_svctm
+    - diskio_lv_util
+    - diskio_lv_queue
+    - diskio_lv_iosize
+    - diskio_lv_merges
     - diskio_fs_requests
     - diskio_fs_bytes
     - diskio_fs_active
+    - diskio_fs_await
+    - diskio_fs_svctm
+    - diskio_fs_util
+    - diskio_fs_queue
+    - diskio_fs_iosize
+    - diskio_fs_merges
 
    
 Environment Variables
   include_graphs:  Comma separated list of enabled graphs. 
                    (All graphs enabled by default.)
   exclude_graphs:  Comma separated list of disabled graphs.
+  top_devices:     Number of devices with highest request rate in the last
+                   interval to include in the request size and merge ratio
+                   graphs for each device type. (Default: 10)
 
 
   Example:
@@ -44,7 +77,8 @@ Environment Variables
 import sys
 from pymunin import (MuninGraph, MuninPlugin, muninMain, 
                      fixLabel, maxLabelLenGraphSimple, maxLabelLenGraphDual)
-from pysysinfo.diskio import DiskIOinfo
+from pysysinfo.diskio import DiskIOinfo, diskstats_deltas, sectorSize
+from pysysinfo.system import SystemInfo
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -74,7 +108,10 @@ class MuninDiskIOplugin(MuninPlugin):
         """
         MuninPlugin.__init__(self, argv, env, debug)
 
-        self._info = DiskIOinfo()
+        self._state = self.restoreState() or {}
+        self._topDevices = int(self.envGet('top_devices', 10))
+        self._sizeDevs = {}
+        self._info = DiskIOinfo(self._state.get('topology'))
         
         self._labelDelim = { 'fs': '/', 'lv': '-'}
         
@@ -84,6 +121,9 @@ class MuninDiskIOplugin(MuninPlugin):
             self._configDevRequests('disk', 'Disk', self._diskList)
             self._configDevBytes('disk', 'Disk', self._diskList)
             self._configDevActive('disk', 'Disk', self._diskList)
+            self._configDevDerived('disk', 'Disk', self._diskList)
+            self._configDevSize('disk', 'Disk', self._diskList,
+                               self._info.getDiskStats)
             
         self._mdList = self._info.getMDlist()
         if self._mdList:
@@ -91,6 +131,8 @@ class MuninDiskIOplugin(MuninPlugin):
             self._configDevRequests('md', 'MD', self._mdList)
             self._configDevBytes('md', 'MD', self._mdList)
             self._configDevActive('md', 'MD', self._mdList)
+            self._configDevDerived('md', 'MD', self._mdList)
+            self._configDevSize('md', 'MD', self._mdList, self._info.getMDstats)
             
         devlist = self._info.getPartitionList()
         if devlist:
@@ -99,6 +141,9 @@ class MuninDiskIOplugin(MuninPlugin):
             self._configDevRequests('part', 'Partition', self._partList)
             self._configDevBytes('part', 'Partition', self._partList)
             self._configDevActive('part', 'Partition', self._partList)
+            self._configDevDerived('part', 'Partition', self._partList)
+            self._configDevSize('part', 'Partition', self._partList,
+                               self._info.getPartitionStats)
         else:
             self._partList = None
             
@@ -109,6 +154,8 @@ class MuninDiskIOplugin(MuninPlugin):
             self._configDevRequests('lv', 'LV', self._lvList)
             self._configDevBytes('lv', 'LV', self._lvList)
             self._configDevActive('lv', 'LV', self._lvList)
+            self._configDevDerived('lv', 'LV', self._lvList)
+            self._configDevSize('lv', 'LV', self._lvList, self._info.getLVstats)
         else:
             self._lvList = None
         
@@ -117,10 +164,14 @@ class MuninDiskIOplugin(MuninPlugin):
         self._configDevRequests('fs', 'Filesystem', self._fsList)
         self._configDevBytes('fs', 'Filesystem', self._fsList)
         self._configDevActive('fs', 'Filesystem', self._fsList)
+        self._configDevDerived('fs', 'Filesystem', self._fsList)
+        self._configDevSize('fs', 'Filesystem', self._fsList,
+                           self._info.getFilesystemStats)
         
                 
     def retrieveVals(self):
         """Retrieve values for graphs."""
+        self._initDeltas()
         if self._diskList:
             self._fetchDevAll('disk', self._diskList, 
                               self._info.getDiskStats)
@@ -135,6 +186,8 @@ class MuninDiskIOplugin(MuninPlugin):
                               self._info.getLVstats)
         self._fetchDevAll('fs', self._fsList, 
                           self._info.getFilesystemStats)
+        self._state['topology'] = self._info.getTopology()
+        self.saveState(self._state)
                 
     def _configDevRequests(self, namestr, titlestr, devlist):
         """Generate configuration for I/O Request stats.
@@ -220,6 +273,223 @@ class MuninDiskIOplugin(MuninPlugin):
                                draw='AREASTACK', type='GAUGE', info=dev)
             self.appendGraph(name, graph)
 
+    def _configDevDerived(self, namestr, titlestr, devlist):
+        """Generate configuration for latency, service time, utilization and 
+        average queue size graphs derived from the I/O time counters.
+        
+        @param namestr:  Field name component indicating device type.
+        @param titlestr: Title component indicating device type.
+        @param devlist:  List of devices.
+        
+        """
+        name = 'diskio_%s_await' % namestr
+        if self.graphEnabled(name):
+            graph = MuninGraph('Disk I/O - %s - Await' % titlestr, 'Disk I/O',
+                info='Disk I/O - %s Average time in ms for read / write '
+                     'requests including queue time.' % titlestr,
+                args='--base 1000 --lower-limit 0', printf='%6.1lf',
+                vlabel='ms read (-) / write (+)',
+                autoFixNames = True)
+            for dev in devlist:
+                graph.addField(dev + '_read', 
+                               fixLabel(dev, maxLabelLenGraphDual, 
+                                        repl = '..', truncend=False,
+                                        delim = self._labelDelim.get(namestr)),
+                               draw='LINE2', type='GAUGE', min=0, graph=False)
+                graph.addField(dev + '_write', 
+                               fixLabel(dev, maxLabelLenGraphDual, 
+                                        repl = '..', truncend=False,
+                                        delim = self._labelDelim.get(namestr)),
+                               draw='LINE2', type='GAUGE', min=0, 
+                               negative=(dev + '_read'), info=dev)
+            self.appendGraph(name, graph)
+        for (suffix, title, info, vlabel) in (
+            ('svctm', 'Service Time', 
+             'Average service time in ms for requests', 'ms'),
+            ('util', 'Utilization', 
+             'Percentage of time with I/O requests in progress', '%'),
+            ('queue', 'Average Queue Size', 
+             'Average number of requests queued or in progress', 'requests')):
+            name = 'diskio_%s_%s' % (namestr, suffix)
+            if self.graphEnabled(name):
+                graph = MuninGraph('Disk I/O - %s - %s' % (titlestr, title), 
+                    'Disk I/O',
+                    info='Disk I/O - %s for every %s.' % (info, titlestr),
+                    args='--base 1000 --lower-limit 0', printf='%6.1lf',
+                    vlabel=vlabel, autoFixNames = True)
+                for dev in devlist:
+                    graph.addField(dev, 
+                                   fixLabel(dev, maxLabelLenGraphSimple, 
+                                            repl = '..', truncend=False,
+                                            delim = self._labelDelim.get(namestr)), 
+                                   draw='LINE2', type='GAUGE', min=0, info=dev)
+                self.appendGraph(name, graph)
+    
+    def _configDevSize(self, namestr, titlestr, devlist, statsfunc):
+        """Generate configuration for average request size and merge ratio 
+        graphs for the top N devices by request rate.
+        
+        @param namestr:   Field name component indicating device type.
+        @param titlestr:  Title component indicating device type.
+        @param devlist:   List of devices.
+        @param statsfunc: Function for retrieving stats for device.
+        
+        """
+        names = ['diskio_%s_iosize' % namestr, 'diskio_%s_merges' % namestr]
+        if not [name for name in names if self.graphEnabled(name)]:
+            return
+        prev_top = self._state.get('iotop', {}).get(namestr)
+        if prev_top is not None:
+            toplist = [dev for dev in prev_top if dev in devlist]
+        else:
+            # No history on first run; rank by requests since boot.
+            ranking = {}
+            for dev in devlist:
+                stats = statsfunc(dev)
+                if stats is not None:
+                    ranking[dev] = stats['rios'] + stats['wios']
+            toplist = self._selectTopDevs(ranking)
+        self._sizeDevs[namestr] = set(toplist)
+        for (name, title, info, vlabel) in (
+            (names[0], 'Request Size', 
+             'Average size of read / write requests in bytes', 
+             'bytes read (-) / write (+)'),
+            (names[1], 'Merge Ratio', 
+             'Percentage of read / write requests merged with adjacent '
+             'requests', '% read (-) / write (+)')):
+            if self.graphEnabled(name):
+                graph = MuninGraph('Disk I/O - %s - %s' % (titlestr, title), 
+                    'Disk I/O',
+                    info='Disk I/O - %s for the %d %s devices with highest '
+                         'request rate.' % (info, self._topDevices, titlestr),
+                    args='--base 1000 --lower-limit 0', printf='%6.1lf',
+                    vlabel=vlabel, autoFixNames = True)
+                for dev in toplist:
+                    graph.addField(dev + '_read', 
+                                   fixLabel(dev, maxLabelLenGraphDual, 
+                                            repl = '..', truncend=False,
+                                            delim = self._labelDelim.get(namestr)),
+                                   draw='LINE2', type='GAUGE', min=0, 
+                                   graph=False)
+                    graph.addField(dev + '_write', 
+                                   fixLabel(dev, maxLabelLenGraphDual, 
+                                            repl = '..', truncend=False,
+                                            delim = self._labelDelim.get(namestr)),
+                                   draw='LINE2', type='GAUGE', min=0, 
+                                   negative=(dev + '_read'), info=dev)
+                self.appendGraph(name, graph)
+    
+    def _selectTopDevs(self, ranking):
+        """Return top N devices ranked by value.
+        
+        @param ranking: Dictionary mapping device to ranking value.
+        @return:        List of selected devices.
+        
+        """
+        ranked = sorted([(val, dev) for (dev, val) in ranking.iteritems()
+                         if val], reverse=True)
+        return [dev for (val, dev) in ranked[:self._topDevices]]
+    
+    def _initDeltas(self):
+        """Compute deltas of I/O time counters since the last run from the 
+        snapshot saved in plugin state. The system uptime is used as 
+        monotonic timestamp for the interval.
+        
+        """
+        self._deltas = None
+        self._interval = None
+        uptime = SystemInfo().getUptime()
+        snapshot = self._info.getSnapshot()
+        prev = self._state.get('snapshot')
+        prev_uptime = self._state.get('uptime')
+        if prev is not None and prev_uptime is not None and uptime > prev_uptime:
+            self._interval = uptime - prev_uptime
+            self._deltas = diskstats_deltas(prev, snapshot, 
+                ('rios', 'wios', 'rticks', 'wticks', 'totticks', 'rqticks',
+                 'rsect', 'wsect', 'rmerges', 'wmerges'))
+        self._state['snapshot'] = snapshot
+        self._state['uptime'] = uptime
+    
+    def _devDelta(self, stats):
+        """Return deltas of counters since the last run for device.
+        
+        @param stats: Stats for device.
+        @return:      Dictionary of deltas or None if unavailable.
+        
+        """
+        if self._deltas is None or stats is None:
+            return None
+        idx = stats.getIndex()
+        if self._deltas['rios'][idx] is None:
+            return None
+        return dict([(field, self._deltas[field][idx]) 
+                     for field in self._deltas])
+    
+    def _fetchDevDerived(self, namestr, dev, delta):
+        """Set values for graphs derived from the I/O time counters.
+        
+        @param namestr: Field name component indicating device type.
+        @param dev:     Device.
+        @param delta:   Deltas of counters for device.
+        
+        """
+        vals = {}
+        if delta is not None:
+            if delta['rios'] > 0:
+                vals['read'] = delta['rticks'] / delta['rios']
+            else:
+                vals['read'] = 0
+            if delta['wios'] > 0:
+                vals['write'] = delta['wticks'] / delta['wios']
+            else:
+                vals['write'] = 0
+            ios = delta['rios'] + delta['wios']
+            if ios > 0:
+                vals['svctm'] = delta['totticks'] / ios
+            else:
+                vals['svctm'] = 0
+            vals['util'] = min(100.0, delta['totticks'] 
+                                      / (self._interval * 10.0))
+            vals['queue'] = delta['rqticks'] / (self._interval * 1000.0)
+        name = 'diskio_%s_await' % namestr
+        if self.hasGraph(name):
+            self.setGraphVal(name, dev + '_read', vals.get('read'))
+            self.setGraphVal(name, dev + '_write', vals.get('write'))
+        for suffix in ('svctm', 'util', 'queue'):
+            name = 'diskio_%s_%s' % (namestr, suffix)
+            if self.hasGraph(name):
+                self.setGraphVal(name, dev, vals.get(suffix))
+    
+    def _fetchDevSize(self, namestr, dev, delta):
+        """Set values for average request size and merge ratio graphs.
+        
+        @param namestr: Field name component indicating device type.
+        @param dev:     Device.
+        @param delta:   Deltas of counters for device.
+        
+        """
+        vals = {}
+        if delta is not None:
+            for (op, ios, sect, merges) in (('read', 'rios', 'rsect', 'rmerges'),
+                                            ('write', 'wios', 'wsect', 'wmerges')):
+                if delta[ios] > 0:
+                    vals['size_' + op] = delta[sect] * sectorSize / delta[ios]
+                else:
+                    vals['size_' + op] = 0
+                if delta[ios] + delta[merges] > 0:
+                    vals['merges_' + op] = (100.0 * delta[merges] 
+                                            / (delta[ios] + delta[merges]))
+                else:
+                    vals['merges_' + op] = 0
+        if dev not in self._sizeDevs.get(namestr, ()):
+            return
+        for (prefix, name) in (('size_', 'diskio_%s_iosize' % namestr),
+                               ('merges_', 'diskio_%s_merges' % namestr)):
+            if self.hasGraph(name):
+                for op in ('read', 'write'):
+                    self.setGraphVal(name, '%s_%s' % (dev, op), 
+                                     vals.get(prefix + op))
+    
     def _fetchDevAll(self, namestr, devlist, statsfunc):
         """Initialize I/O stats for devices.
         
@@ -228,6 +498,7 @@ class MuninDiskIOplugin(MuninPlugin):
         @param statsfunc: Function for retrieving stats for device.
         
         """
+        ranking = {}
         for dev in devlist:
             stats = statsfunc(dev)
             name = 'diskio_%s_requests' % namestr
@@ -241,6 +512,18 @@ class MuninDiskIOplugin(MuninPlugin):
             name = 'diskio_%s_active' % namestr
             if self.hasGraph(name):
                 self.setGraphVal(name, dev, stats['ios_active'])
+            delta = self._devDelta(stats)
+            self._fetchDevDerived(namestr, dev, delta)
+            self._fetchDevSize(namestr, dev, delta)
+            if delta is not None:
+                ranking[dev] = delta['rios'] + delta['wios']
+        if (self.hasGraph('diskio_%s_iosize' % namestr) 
+            or self.hasGraph('diskio_%s_merges' % namestr)):
+            if not self._state.has_key('iotop'):
+                self._state['iotop'] = {}
+            toplist = self._selectTopDevs(ranking)
+            if toplist:
+                self._state['iotop'][namestr] = toplist
         
         
 if __name__ == "__main__":
@@ -13,6 +13,8 @@ Wild Card Plugin - No
 Multigraph Plugin - Graph Structure
    - diskspace
    - diskinode
+   - diskgrowth
+   - disktimetofull
 
    
 Environment Variables
@@ -26,6 +28,17 @@ Environment Variables
                    monitoring. (All enabled by default.)
   exclude_fstypes: Comma separated list of filesystem types to exclude from 
                    monitoring.
+  statvfs_timeout: Timeout in seconds for querying each filesystem. Values 
+                   for filesystems that time out are reported as unknown. 
+                   (Default: 2)
+  statvfs_backoff: Period in seconds for skipping filesystems that timed out.
+                   (Default: 1800)
+  forecast_samples: Number of samples of used space kept per filesystem for
+                   estimating the growth rate by linear regression. 
+                   (Default: 288, 24 hours with 5 minute intervals; 
+                   at most 2016, 7 days.)
+  forecast_warning: Time to full in hours for triggering warnings.
+                   (Default: 24)
 
 
   Example:
@@ -39,9 +52,12 @@ Environment Variables
 #%# capabilities=noautoconf nosuggest
 
 import sys
+import time
 from pymunin import (MuninGraph, MuninPlugin, muninMain, 
                      fixLabel, maxLabelLenGraphSimple)
-from pysysinfo.filesystem import FilesystemInfo
+from pysysinfo.filesystem import (FilesystemInfo, usage_history_add, 
+                                  usage_growth_rate, forecastMinSamples,
+                                  forecastMaxSamples)
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -75,16 +91,27 @@ class MuninDiskUsagePlugin(MuninPlugin):
         
         self._statsSpace = None
         self._statsInode = None
-        self._info = FilesystemInfo()
+        self._state = self.restoreState() or {}
+        self._info = FilesystemInfo(self._state.get('hung'),
+            timeout=float(self.envGet('statvfs_timeout', 2)),
+            backoff=int(self.envGet('statvfs_backoff', 1800)),
+            mounttable=self._state.get('mounts'))
         
         self._fslist = [fs for fs in self._info.getFSlist()
                         if (self.fsPathEnabled(fs) 
                             and self.fsTypeEnabled(self._info.getFStype(fs)))]
         self._fslist.sort()
         
+        self._forecastSamples = min(max(int(self.envGet('forecast_samples', 
+                                                        288)), 
+                                        forecastMinSamples), 
+                                    forecastMaxSamples)
+        if (self.graphEnabled('diskspace') or self.graphEnabled('diskgrowth')
+            or self.graphEnabled('disktimetofull')):
+            self._statsSpace = self._info.getSpaceUse(self._fslist)
+        
         name = 'diskspace'
         if self.graphEnabled(name):
-            self._statsSpace = self._info.getSpaceUse()
             graph = MuninGraph('Disk Space Usage (%)', 'Disk Usage',
                 info='Disk space usage of filesystems.',
                 args='--base 1000 --lower-limit 0', printf='%6.1lf',
@@ -100,7 +127,7 @@ class MuninDiskUsagePlugin(MuninPlugin):
         
         name = 'diskinode'
         if self.graphEnabled(name):
-            self._statsInode = self._info.getInodeUse()
+            self._statsInode = self._info.getInodeUse(self._fslist)
             graph = MuninGraph('Inode Usage (%)', 'Disk Usage',
                 info='Inode usage of filesystems.',
                 args='--base 1000 --lower-limit 0', printf='%6.1lf',
@@ -114,6 +141,42 @@ class MuninDiskUsagePlugin(MuninPlugin):
                         info="Inode usage for: %s" % fspath)
             self.appendGraph(name, graph)
         
+        name = 'diskgrowth'
+        if self.graphEnabled(name):
+            graph = MuninGraph('Disk Space Growth Rate (bytes/hour)', 
+                'Disk Usage',
+                info='Growth rate of used disk space of filesystems estimated '
+                     'by linear regression over the last %d samples.'
+                     % self._forecastSamples,
+                args='--base 1024', autoFixNames=True)
+            for fspath in self._fslist:
+                if self._statsSpace.has_key(fspath):
+                    graph.addField(fspath, 
+                        fixLabel(fspath, maxLabelLenGraphSimple, 
+                                 delim='/', repl='..', truncend=False), 
+                        draw='LINE2', type='GAUGE',
+                        info="Disk space growth rate for: %s" % fspath)
+            self.appendGraph(name, graph)
+        
+        name = 'disktimetofull'
+        if self.graphEnabled(name):
+            warning = '%s:' % self.envGet('forecast_warning', 24)
+            graph = MuninGraph('Disk Space Time to Full (hours)', 
+                'Disk Usage',
+                info='Estimated time until filesystems run out of available '
+                     'space at the current growth rate. The value is unknown '
+                     'for filesystems that are not growing.',
+                args='--base 1000 --lower-limit 0', printf='%6.1lf',
+                autoFixNames=True)
+            for fspath in self._fslist:
+                if self._statsSpace.has_key(fspath):
+                    graph.addField(fspath, 
+                        fixLabel(fspath, maxLabelLenGraphSimple, 
+                                 delim='/', repl='..', truncend=False), 
+                        draw='LINE2', type='GAUGE', min=0, warning=warning,
+                        info="Time to full for: %s" % fspath)
+            self.appendGraph(name, graph)
+        
     def retrieveVals(self):
         """Retrieve values for graphs."""
         name = 'diskspace'
@@ -121,13 +184,61 @@ class MuninDiskUsagePlugin(MuninPlugin):
             for fspath in self._fslist:
                 if self._statsSpace.has_key(fspath):
                     self.setGraphVal(name, fspath, 
-                                     self._statsSpace[fspath]['inuse_pcent'])
+                                     self._fsVal(self._statsSpace[fspath]))
         name = 'diskinode'
         if self.hasGraph(name):
             for fspath in self._fslist:
                 if self._statsInode.has_key(fspath):
                     self.setGraphVal(name, fspath, 
-                                     self._statsInode[fspath]['inuse_pcent'])
+                                     self._fsVal(self._statsInode[fspath]))
+        if self.hasGraph('diskgrowth') or self.hasGraph('disktimetofull'):
+            self._updateForecast()
+        else:
+            self._state.pop('history', None)
+        self._state['hung'] = self._info.getHungMounts()
+        self._state['mounts'] = self._info.getMountTable()
+        self.saveState(self._state)
+    
+    def _updateForecast(self):
+        """Add used space samples to the history of filesystems and set the 
+        values for the growth rate and time to full graphs."""
+        now = time.time()
+        prev_history = self._state.get('history', {})
+        history = {}
+        for fspath in self._fslist:
+            fsstats = self._statsSpace.get(fspath)
+            ring = prev_history.get(fspath)
+            if fsstats is not None:
+                ring = usage_history_add(ring, now, fsstats['inuse'], 
+                                         self._forecastSamples)
+            if ring is not None:
+                history[fspath] = ring
+            if fsstats is None:
+                continue
+            rate = usage_growth_rate(ring)
+            if self.hasGraph('diskgrowth'):
+                if rate is not None:
+                    self.setGraphVal('diskgrowth', fspath, rate * 3600)
+                else:
+                    self.setGraphVal('diskgrowth', fspath, None)
+            if self.hasGraph('disktimetofull'):
+                if rate is not None and rate > 0:
+                    self.setGraphVal('disktimetofull', fspath, 
+                                     fsstats['avail'] / rate / 3600)
+                else:
+                    self.setGraphVal('disktimetofull', fspath, None)
+        self._state['history'] = history
+    
+    def _fsVal(self, fsstats):
+        """Return usage percentage or None for filesystems that timed out.
+        
+        @param fsstats: Dictionary of filesystem stats or None.
+        @return:        Usage percentage.
+        
+        """
+        if fsstats is None:
+            return None
+        return fsstats['inuse_pcent']
 
     def fsPathEnabled(self, fspath):
         """Utility method to check if a filesystem path is included in monitoring.
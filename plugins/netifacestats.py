@@ -10,30 +10,58 @@ Wild Card Plugin - No
 Multigraph Plugin - Graph Structure
    - netiface_traffic
    - netiface_errors
+   - netiface_traffic_other
 
 
 Environment Variables
-  include_graphs: Comma separated list of enabled graphs. 
-                  (All graphs enabled by default.)
-  exclude_graphs: Comma separated list of disabled graphs.
-  include_ifaces: Comma separated list of network interfaces to include in 
-                  graphs. (All Network Interfaces are monitored by default.)
-  exclude_ifaces: Comma separated list of network interfaces to exclude from 
-                  graphs.
+  include_graphs:   Comma separated list of enabled graphs. 
+                    (All graphs enabled by default.)
+  exclude_graphs:   Comma separated list of disabled graphs.
+  include_ifaces:   Comma separated list of network interfaces to include in 
+                    graphs. (All Network Interfaces are monitored by default.)
+  exclude_ifaces:   Comma separated list of network interfaces to exclude from 
+                    graphs.
+  list_iface_globs: Comma separated list of shell style wildcard patterns 
+                    for selecting network interfaces.
+  iface_regex:      Regular expression for selecting network interfaces.
+  list_iface_types: Comma separated list of interface types to select.
+                    (physical, virtual, vlan, bond, bridge, etc.)
+  top_ifaces:       Graph only the N interfaces with highest traffic in the 
+                    last interval and aggregate the traffic of the rest in 
+                    the netiface_traffic_other graph. (Disabled by default.)
+  burst_interval:   Sample the counters of graphed interfaces at this 
+                    interval in seconds (0.1 - 1) in a background process to
+                    add peak and 99th percentile rates and peak drop rates 
+                    to the graphs. (Disabled by default.)
+  burst_period:     Period in seconds for reducing the samples. 
+                    (Default: 300)
                   
   Example:
     [netifacestats]
        env.include_ifaces eth0,eth1
        env.exclude_graphs netiface_errors
+       
+    [netifacestats]
+       env.list_iface_types physical,bond,virtual
+       env.top_ifaces 10
+       
+    [netifacestats]
+       env.include_ifaces eth0
+       env.burst_interval 0.1
 
 """
 # Munin  - Magic Markers
 #%# family=auto
 #%# capabilities=noautoconf nosuggest
 
+import os
+import re
 import sys
+import time
 from pymunin import MuninGraph, MuninPlugin, muninMain
-from pysysinfo.netiface import NetIfaceInfo
+from pysysinfo.netiface import (NetIfaceInfo, read_burst_summary, 
+                                write_burst_config, burst_sampler_running,
+                                start_burst_sampler)
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -62,17 +90,58 @@ class MuninNetIfacePlugin(MuninPlugin):
         """
         MuninPlugin.__init__(self, argv, env, debug)
 
-        self.envRegisterFilter('ifaces', '^[\w\d:]+$')
+        self.envRegisterFilter('ifaces', '^[\w\d:\.\-@]+$')
+        self._topIfaces = int(self.envGet('top_ifaces', 0))
+        self._burstInterval = float(self.envGet('burst_interval', 0))
+        if self._burstInterval:
+            self._burstInterval = min(max(self._burstInterval, 0.1), 1.0)
+        self._burstPeriod = int(self.envGet('burst_period', 300))
         
         self._ifaceInfo = NetIfaceInfo()
-        self._ifaceStats = self._ifaceInfo.getIfStats()
-        self._ifaceList = []
-        for iface in list(self._ifaceStats):
-            if iface not in ['lo',] and self.ifaceIncluded(iface):
-                if max(self._ifaceStats[iface].values()) > 0:
-                    self._ifaceList.append(iface)
+        if self.envHasKey('include_ifaces') and not self._topIfaces:
+            include_list = [iface.strip() 
+                            for iface in self.envGet('include_ifaces').split(',')]
+            self._ifaceStats = self._ifaceInfo.getIfStats(include_list)
+        else:
+            self._ifaceStats = self._ifaceInfo.getIfStats()
+        candidates = [iface for iface in self._ifaceStats
+                      if iface not in ['lo',] and self.ifaceIncluded(iface)]
+        candidates = self._ifaceInfo.filterIfaces(candidates,
+            globs=self.envGetList('iface_globs', None),
+            regex=self.envGet('iface_regex'),
+            types=self.envGetList('iface_types'))
+        self._ifaceCandidates = [iface for iface in candidates
+                                 if max(self._ifaceStats[iface].values()) > 0]
+        if self._topIfaces:
+            self._state = self.restoreState()
+            if self._state is not None:
+                self._ifaceList = [iface for iface in self._state['selected']
+                                   if iface in self._ifaceStats]
+            else:
+                # No traffic history on first run; use total traffic.
+                self._ifaceList = self._selectTop(self._ifaceCandidates, 
+                    lambda iface: (self._ifaceStats[iface]['rxbytes'] 
+                                   + self._ifaceStats[iface]['txbytes']))
+        else:
+            self._ifaceList = self._ifaceCandidates
         self._ifaceList.sort()
         
+        if self._topIfaces and self.graphEnabled('netiface_traffic_other'):
+            graph = MuninGraph('Network Interface - Traffic - Other', 
+                'Network',
+                info='Traffic Stats in bps for Network Interfaces that are '
+                     'not in the top %d by traffic.' % self._topIfaces,
+                args='--base 1000 --lower-limit 0',
+                vlabel='bps in (-) / out (+) per second')
+            graph.addField('rx', 'bps', draw='LINE2', type='GAUGE', 
+                           min=0, graph=False)
+            graph.addField('tx', 'bps', draw='LINE2', type='GAUGE', 
+                           min=0, negative='rx')
+            graph.addField('ifaces', 'ifaces', draw='LINE1', type='GAUGE',
+                           graph=False, 
+                           info='Number of interfaces aggregated.')
+            self.appendGraph('netiface_traffic_other', graph)
+        
         for iface in self._ifaceList:
             if self.graphEnabled('netiface_traffic'):
                 graph = MuninGraph('Network Interface - Traffic - %s' % iface, 
@@ -84,7 +153,21 @@ class MuninNetIfacePlugin(MuninPlugin):
                                min=0, graph=False)
                 graph.addField('tx', 'bps', draw='LINE2', type='DERIVE', 
                                min=0, negative='rx')
-                self.appendGraph('netiface_traffic_%s' % iface, graph)
+                if self._burstInterval:
+                    graph.addField('rxmax', 'peak', draw='LINE1', 
+                                   type='GAUGE', min=0, graph=False)
+                    graph.addField('txmax', 'peak', draw='LINE1', 
+                                   type='GAUGE', min=0, negative='rxmax',
+                                   info='Peak rate in %s sec samples.' 
+                                        % self._burstInterval)
+                    graph.addField('rxp99', 'p99', draw='LINE1', 
+                                   type='GAUGE', min=0, graph=False)
+                    graph.addField('txp99', 'p99', draw='LINE1', 
+                                   type='GAUGE', min=0, negative='rxp99',
+                                   info='99th percentile rate in %s sec '
+                                        'samples.' % self._burstInterval)
+                self.appendGraph(self._graphName('netiface_traffic', iface), 
+                                 graph)
 
             if self.graphEnabled('netiface_errors'):
                 graph = MuninGraph('Network Interface - Errors - %s' % iface, 
@@ -112,22 +195,145 @@ class MuninNetIfacePlugin(MuninPlugin):
                 graph.addField('txfifo', 'fifo', draw='LINE2', type='DERIVE', 
                                min=0, negative='rxfifo', 
                                info='Rx(-)/Tx(+) FIFO Errors per second.')
-                self.appendGraph('netiface_errors_%s' % iface, graph)
+                if self._burstInterval:
+                    graph.addField('rxdropmax', 'drop peak', draw='LINE1', 
+                                   type='GAUGE', min=0, graph=False)
+                    graph.addField('txdropmax', 'drop peak', draw='LINE1', 
+                                   type='GAUGE', min=0, negative='rxdropmax',
+                                   info='Rx(-)/Tx(+) Peak Dropped Packets '
+                                        'per second in %s sec samples.' 
+                                        % self._burstInterval)
+                self.appendGraph(self._graphName('netiface_errors', iface), 
+                                 graph)
 
         
     def retrieveVals(self):
         """Retrieve values for graphs."""
         for iface in self._ifaceList:
             stats = self._ifaceStats.get(iface)
-            graph_name = 'netiface_traffic_%s' % iface
+            graph_name = self._graphName('netiface_traffic', iface)
             if self.hasGraph(graph_name):
                 self.setGraphVal(graph_name, 'rx', stats.get('rxbytes') * 8)
                 self.setGraphVal(graph_name, 'tx', stats.get('txbytes') * 8)
-            graph_name = 'netiface_errors_%s' % iface
+            graph_name = self._graphName('netiface_errors', iface)
             if self.hasGraph(graph_name):
                 for field in ('rxerrs', 'txerrs', 'rxframe', 'txcarrier',
                     'rxdrop', 'txdrop', 'rxfifo', 'txfifo'):
                     self.setGraphVal(graph_name, field, stats.get(field))
+        if self._topIfaces:
+            self._updateTopIfaces()
+        if self._burstInterval:
+            self._updateBurstStats()
+    
+    def _selectTop(self, ifaces, keyfunc):
+        """Return top N interfaces ranked by keyfunc.
+        
+        @param ifaces:  List of interfaces.
+        @param keyfunc: Function returning ranking value for interface.
+        @return:        List of selected interfaces.
+        
+        """
+        ranked = sorted(ifaces, key=keyfunc, reverse=True)
+        return ranked[:self._topIfaces]
+    
+    def _updateTopIfaces(self):
+        """Compute traffic rates since the last run, set values for the 
+        aggregate graph of the interfaces that are not graphed individually, 
+        and save the top N interfaces for the next run in plugin state.
+        
+        """
+        now = time.time()
+        counters = dict([(iface, (self._ifaceStats[iface]['rxbytes'], 
+                                  self._ifaceStats[iface]['txbytes']))
+                         for iface in self._ifaceCandidates])
+        deltas = {}
+        if self._state is not None:
+            interval = now - self._state['time']
+            prev_counters = self._state['counters']
+            for (iface, (rx, tx)) in counters.iteritems():
+                prev = prev_counters.get(iface)
+                if prev is not None and rx >= prev[0] and tx >= prev[1]:
+                    deltas[iface] = (rx - prev[0], tx - prev[1])
+        else:
+            interval = 0
+        if self.hasGraph('netiface_traffic_other'):
+            others = [iface for iface in self._ifaceCandidates
+                      if iface not in self._ifaceList]
+            self.setGraphVal('netiface_traffic_other', 'ifaces', len(others))
+            if interval > 0:
+                rx = sum([deltas[iface][0] for iface in others 
+                          if deltas.has_key(iface)])
+                tx = sum([deltas[iface][1] for iface in others 
+                          if deltas.has_key(iface)])
+                self.setGraphVal('netiface_traffic_other', 'rx', 
+                                 rx * 8.0 / interval)
+                self.setGraphVal('netiface_traffic_other', 'tx', 
+                                 tx * 8.0 / interval)
+            else:
+                self.setGraphVal('netiface_traffic_other', 'rx', None)
+                self.setGraphVal('netiface_traffic_other', 'tx', None)
+        if deltas:
+            selected = self._selectTop(deltas.keys(), 
+                                       lambda iface: sum(deltas[iface]))
+        else:
+            selected = self._ifaceList
+        self.saveState({'time': now, 'counters': counters, 
+                        'selected': selected})
+    
+    def _updateBurstStats(self):
+        """Set values for peak rates from the last summary of the background 
+        sampler, pass the current set of interfaces to the sampler and start
+        the sampler if it is not running.
+        
+        """
+        summary_file = self._stateFile + '.burst'
+        lock_file = self._stateFile + '.pid'
+        config_file = self._stateFile + '.lease'
+        # Rewriting the config renews the lease of the sampler.
+        write_burst_config(config_file, self._ifaceList, 
+                           self._burstInterval, self._burstPeriod)
+        summary = read_burst_summary(summary_file)
+        if (summary is not None 
+            and summary['interval'] == self._burstInterval
+            and summary['period'] == self._burstPeriod
+            and time.time() - summary['time'] < 2 * self._burstPeriod):
+            burst_stats = summary['stats']
+        else:
+            burst_stats = {}
+        if not burst_sampler_running(lock_file):
+            start_burst_sampler(config_file, summary_file, lock_file)
+        for iface in self._ifaceList:
+            stats = burst_stats.get(iface, {})
+            graph_name = self._graphName('netiface_traffic', iface)
+            if self.hasGraph(graph_name):
+                for (field, key) in (('rxmax', 'rxbytes_max'), 
+                                     ('txmax', 'txbytes_max'),
+                                     ('rxp99', 'rxbytes_p99'),
+                                     ('txp99', 'txbytes_p99')):
+                    val = stats.get(key)
+                    if val is not None:
+                        val *= 8
+                    self.setGraphVal(graph_name, field, val)
+            graph_name = self._graphName('netiface_errors', iface)
+            if self.hasGraph(graph_name):
+                self.setGraphVal(graph_name, 'rxdropmax', 
+                                 stats.get('rxdrop_max'))
+                self.setGraphVal(graph_name, 'txdropmax', 
+                                 stats.get('txdrop_max'))
+    
+    def _graphName(self, prefix, iface):
+        """Return name of graph for interface.
+        
+        VLAN and virtual interface names may include characters that are not
+        valid in graph names (e.g. eth0.100, veth0@if3); the raw interface 
+        name is used only in the graph title.
+        
+        @param prefix: Graph name prefix.
+        @param iface:  Interface name.
+        @return:       Graph name.
+        
+        """
+        return '%s_%s' % (prefix, re.sub('\W', '_', iface))
     
     def ifaceIncluded(self, iface):
         """Utility method to check if interface is included in monitoring.
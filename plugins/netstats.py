@@ -4,6 +4,8 @@
 
 Requirements
   - netstat command
+  - Access to /proc/net/snmp, /proc/net/snmp6 and /proc/net/netstat for the 
+    protocol counter graphs.
 
 Wild Card Plugin - No
 
@@ -11,6 +13,12 @@ Wild Card Plugin - No
 Multigraph Plugin - Graph Structure
    - netstat_conn_status
    - netstat_conn_server
+   - netstat_tcp_conn
+   - netstat_tcp_retrans
+   - netstat_tcp_listen
+   - netstat_tcp_syncookies
+   - netstat_udp_errors
+   - netstat_conn_prog
 
 
 Environment Variables
@@ -22,6 +30,12 @@ Environment Variables
                      that are to be monitored in the netstat_server_conn graph.
                      A service can be associated to multiple port numbers
                      separated by colon.
+  prog_graph:        Enable (on) / disable (off) graph of established TCP
+                     connections per program. Requires root privileges for 
+                     identifying the sockets of other users. 
+                     (Disabled by default.)
+  top_progs:         Number of programs with most connections to graph 
+                     individually in netstat_conn_prog graph. (Default: 10)
 
   Example:
     [netstats]
@@ -33,9 +47,11 @@ Environment Variables
 #%# family=auto
 #%# capabilities=noautoconf nosuggest
 
+import re
 import sys
 from pymunin import MuninGraph, MuninPlugin, muninMain
 from pysysinfo.netstat import NetstatInfo
+from pysysinfo.process import SockProcMap
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -63,6 +79,12 @@ class MuninNetstatsPlugin(MuninPlugin):
         
         """     
         MuninPlugin.__init__(self, argv, env, debug)
+        
+        self._netinfo = NetstatInfo()
+        self._protostats = None
+        self._protoFields = {}
+        self._progStats = None
+        self._state = None
          
         if self.graphEnabled('netstat_conn_status'):
             graph = MuninGraph('Network - Connection Status', 'Network', 
@@ -114,10 +136,125 @@ class MuninNetstatsPlugin(MuninPlugin):
                         info=('Number of connections for service %s on ports: %s' 
                               % (srv, ','.join(self._srv_dict[srv]))))
                 self.appendGraph('netstat_conn_server', graph)
+        
+        for (graph_name, title, info, vlabel, fields) in (
+            ('netstat_tcp_conn', 'Network - TCP Connection Openings',
+             'TCP connection openings and failures per second.',
+             'connections per second',
+             (('active', ('Tcp', 'ActiveOpens'), 
+               'Connections opened actively (outgoing).'),
+              ('passive', ('Tcp', 'PassiveOpens'), 
+               'Connections opened passively (incoming).'),
+              ('failed', ('Tcp', 'AttemptFails'), 
+               'Failed connection attempts.'),
+              ('resets', ('Tcp', 'EstabResets'), 
+               'Resets of established connections.'),)),
+            ('netstat_tcp_retrans', 'Network - TCP Retransmissions',
+             'TCP segment retransmissions and retransmission timeouts '
+             'per second.',
+             'events per second',
+             (('retrans', ('Tcp', 'RetransSegs'), 
+               'Segments retransmitted.'),
+              ('fast', ('TcpExt', 'TCPFastRetrans'), 
+               'Fast retransmissions.'),
+              ('timeouts', ('TcpExt', 'TCPTimeouts'), 
+               'Retransmission timeouts.'),
+              ('lost', ('TcpExt', 'TCPLostRetransmit'), 
+               'Retransmitted segments that were lost again.'),)),
+            ('netstat_tcp_listen', 'Network - TCP Listen Queue Overflows',
+             'Connections dropped by listening sockets per second.',
+             'connections per second',
+             (('overflows', ('TcpExt', 'ListenOverflows'), 
+               'Accept queue of listening socket overflowed.'),
+              ('drops', ('TcpExt', 'ListenDrops'), 
+               'SYNs to listening sockets dropped.'),)),
+            ('netstat_tcp_syncookies', 'Network - TCP SYN Cookies',
+             'SYN cookies sent and received per second.',
+             'cookies per second',
+             (('sent', ('TcpExt', 'SyncookiesSent'), 
+               'SYN cookies sent on SYN queue overflow.'),
+              ('recv', ('TcpExt', 'SyncookiesRecv'), 
+               'Valid SYN cookies received.'),
+              ('failed', ('TcpExt', 'SyncookiesFailed'), 
+               'Invalid SYN cookies received.'),)),
+            ('netstat_udp_errors', 'Network - UDP Errors',
+             'UDP receive and send errors per second (IPv4 and IPv6).',
+             'errors per second',
+             (('inerrors', ('Udp', 'InErrors'), 
+               'Datagrams that could not be delivered.'),
+              ('rcvbuf', ('Udp', 'RcvbufErrors'), 
+               'Datagrams dropped on receive buffer overflow.'),
+              ('sndbuf', ('Udp', 'SndbufErrors'), 
+               'Datagrams dropped on send buffer overflow.'),
+              ('noports', ('Udp', 'NoPorts'), 
+               'Datagrams received for ports without listener.'),)),
+            ):
+            if self.graphEnabled(graph_name):
+                if self._protostats is None:
+                    self._protostats = self._netinfo.getProtoStats()
+                graph = MuninGraph(title, 'Network', info=info, vlabel=vlabel,
+                                   args='--base 1000 --lower-limit 0')
+                self._protoFields[graph_name] = []
+                for (fname, (proto, key), fdesc) in fields:
+                    if self._protostats.get(proto, {}).has_key(key):
+                        graph.addField(fname, fname, type='DERIVE', min=0, 
+                                       draw='LINE2', info=fdesc)
+                        self._protoFields[graph_name].append((fname, 
+                                                              proto, key))
+                if self._protoFields[graph_name]:
+                    self.appendGraph(graph_name, graph)
+
+        if (self.envCheckFlag('prog_graph', False) 
+            and self.graphEnabled('netstat_conn_prog')):
+            self._state = self.restoreState() or {}
+            procmap = self._state.get('procmap')
+            if procmap is None:
+                procmap = SockProcMap()
+            procmap.refresh()
+            self._state['procmap'] = procmap
+            self._progStats = dict([(prog or 'unknown', agg['count'])
+                for (prog, agg) in self._netinfo.getAggregateStats('prog',
+                    tcp=True, udp=False, include_listen=False, 
+                    procmap=procmap, state='ESTABLISHED').iteritems()])
+            progs = self._state.get('top')
+            if progs is None:
+                progs = self._selectTopProgs()
+            graph = MuninGraph('Network - Connections per Program', 
+                'Network',
+                info='Established TCP connections of the programs with most '
+                     'connections.',
+                args='--base 1000 --lower-limit 0')
+            for prog in progs:
+                graph.addField(self._progFieldName(prog), prog, 
+                               type='GAUGE', draw='AREASTACK')
+            graph.addField('other', 'other', type='GAUGE', draw='AREASTACK',
+                           info='Connections of the rest of the programs.')
+            self.appendGraph('netstat_conn_prog', graph)
+
+    def _selectTopProgs(self):
+        """Return list of programs with most connections.
+        
+        @return: List of program names.
+        
+        """
+        ranked = sorted([(count, prog) 
+                         for (prog, count) in self._progStats.iteritems()],
+                        reverse=True)
+        return [prog for (count, prog) 
+                in ranked[:int(self.envGet('top_progs', 10))]]
+
+    def _progFieldName(self, prog):
+        """Return field name for program.
+        
+        @param prog: Program name.
+        @return:     Field name.
+        
+        """
+        return 'prog_' + re.sub('\W', '_', prog)
 
     def retrieveVals(self):
         """Retrieve values for graphs."""
-        net_info = NetstatInfo()
+        net_info = self._netinfo
         if self.hasGraph('netstat_conn_status'):
             stats = net_info.getTCPportConnStatus(include_listen=True)
             for fname in ('listen', 'established', 'syn_sent', 'syn_recv',
@@ -133,6 +270,32 @@ class MuninNetstatsPlugin(MuninPlugin):
                 for port in self._srv_dict[srv]:
                     numconn += stats.get(port, 0)
                 self.setGraphVal('netstat_conn_server', srv, numconn)
+        if self._protostats is not None:
+            for (graph_name, fields) in self._protoFields.iteritems():
+                if self.hasGraph(graph_name):
+                    for (fname, proto, key) in fields:
+                        val = self._protostats[proto][key]
+                        if proto == 'Udp':
+                            val += self._protostats.get('Udp6', 
+                                                        {}).get(key, 0)
+                        self.setGraphVal(graph_name, fname, val)
+        if self.hasGraph('netstat_conn_prog'):
+            fields = set(self.getGraphFieldList('netstat_conn_prog'))
+            fields.discard('other')
+            other = 0
+            for (prog, count) in self._progStats.iteritems():
+                field = self._progFieldName(prog)
+                if field in fields:
+                    self.setGraphVal('netstat_conn_prog', field, count)
+                    fields.discard(field)
+                else:
+                    other += count
+            for field in fields:
+                self.setGraphVal('netstat_conn_prog', field, 0)
+            self.setGraphVal('netstat_conn_prog', 'other', other)
+            if self._progStats:
+                self._state['top'] = self._selectTopProgs()
+            self.saveState(self._state)
 
 
 if __name__ == "__main__":
@@ -25,6 +25,12 @@ Multigraph Plugin - Graph Structure
    - pg_tup_delete_detail
    - pg_tup_update_detail
    - pg_tup_insert_detail
+   - pg_table_activity
+   - pg_table_dead_tup
+   - pg_index_scans
+   - pg_stmt_time
+   - pg_stmt_calls
+   - pg_stmt_latency
    
 
 Environment Variables
@@ -42,6 +48,16 @@ Environment Variables
   exclude_db:     Comma separated list of databases to exclude from detail graphs.
   detail_graphs:  Enable (on) / disable (off) detail graphs. 
                   (Disabled by default.)
+  dbsize_ttl:     Time in seconds for caching disk usage of databases. 
+                  (Default: 3600)
+  dbsize_max:     Maximum number of databases whose disk usage is measured
+                  in each run. (Default: 10)
+  top_tables:     Number of tables and indexes of the monitored database with
+                  highest activity in the last interval to graph 
+                  individually. (Default: 10)
+  top_statements: Number of normalized statements from pg_stat_statements with
+                  highest execution time, calls and mean latency in the last
+                  interval to graph individually. (Default: 10)
 
   Example:
     [pgstats]
@@ -54,9 +70,11 @@ Environment Variables
 #%# family=manual
 #%# capabilities=noautoconf nosuggest
 
+import re
 import sys
+import time
 from pymunin import MuninGraph, MuninPlugin, muninMain
-from pysysinfo.postgresql import PgInfo
+from pysysinfo.postgresql import PgInfo, statement_label
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -92,6 +110,11 @@ class MuninPgPlugin(MuninPlugin):
         self._user = self.envGet('user')
         self._password = self.envGet('password')
         self._detailGraphs = self.envCheckFlag('detail_graphs', False)
+        self._dbsizeTTL = int(self.envGet('dbsize_ttl', 3600))
+        self._dbsizeMax = int(self.envGet('dbsize_max', 10))
+        self._topTables = int(self.envGet('top_tables', 10))
+        self._topStatements = int(self.envGet('top_statements', 10))
+        self._state = self.restoreState() or {}
         
         self._dbconn = PgInfo(self._host, self._port, self._database, 
                               self._user, self._password)
@@ -293,25 +316,128 @@ class MuninPgPlugin(MuninPlugin):
                         info="Tuples inserted per second into database %s." % db)
                 self.appendGraph('pg_tup_insert_detail', graph)
             
+        self._relStats = {}
+        for (kind, graphs) in (('tables', ('pg_table_activity', 
+                                           'pg_table_dead_tup')),
+                               ('indexes', ('pg_index_scans',))):
+            graphs = [name for name in graphs if self.graphEnabled(name)]
+            if not graphs or not self._dbconn.checkVersion('9.1'):
+                continue
+            # The fields are the top relations selected in the previous run;
+            # the ranking query runs on config only without previous state.
+            rels = self._state.get(kind, {}).get('top')
+            if rels is None:
+                stats = self._getRelStats(kind)
+                rels = [relstats['name'] 
+                        for relstats in stats['top'][:self._topTables]]
+            else:
+                self._relStats[kind] = None
+            for name in graphs:
+                if name == 'pg_table_activity':
+                    graph = MuninGraph('PostgreSQL - Table Activity', 
+                        'PostgreSQL DB',
+                        info='Tuples read and written per second for the %d '
+                             'tables with highest activity in the monitored '
+                             'database.' % self._topTables,
+                        args='--base 1000 --lower-limit 0')
+                elif name == 'pg_table_dead_tup':
+                    graph = MuninGraph('PostgreSQL - Table Dead Tuples', 
+                        'PostgreSQL DB',
+                        info='Dead tuples of the %d tables with highest '
+                             'activity in the monitored database.' 
+                             % self._topTables,
+                        args='--base 1000 --lower-limit 0')
+                else:
+                    graph = MuninGraph('PostgreSQL - Index Scans', 
+                        'PostgreSQL DB',
+                        info='Index scans per second for the %d indexes with '
+                             'highest activity in the monitored database.' 
+                             % self._topTables,
+                        args='--base 1000 --lower-limit 0')
+                for rel in rels:
+                    graph.addField(self._relFieldName(rel), rel, 
+                                   draw='LINE2', type='GAUGE', min=0)
+                if name == 'pg_table_dead_tup':
+                    graph.addField('total', 'total', draw='LINE2', 
+                        type='GAUGE', min=0, colour='000000',
+                        info='Dead tuples of all tables.')
+                else:
+                    graph.addField('other', 'other', draw='LINE2', 
+                        type='GAUGE', min=0, colour='000000',
+                        info='Aggregate of the rest of the relations.')
+                self.appendGraph(name, graph)
+            
+        self._stmtStats = None
+        stmtgraphs = [name for name in ('pg_stmt_time', 'pg_stmt_calls', 
+                                        'pg_stmt_latency')
+                      if self.graphEnabled(name)]
+        prev = self._state.get('statements', {})
+        prev_top = prev.get('top')
+        if stmtgraphs and prev_top is None:
+            self._stmtStats = self._getStmtStats()
+            if self._stmtStats is not None:
+                prev_top = dict([(key, [stmt['queryid'] for stmt in stmts])
+                                 for (key, stmts) 
+                                 in self._stmtStats['top'].iteritems()])
+        if stmtgraphs and prev_top is not None:
+            texts = prev.get('text', {})
+            for name in stmtgraphs:
+                if name == 'pg_stmt_time':
+                    key = 'total_time'
+                    graph = MuninGraph('PostgreSQL - Statement Execution Time '
+                        '(ms/sec)', 'PostgreSQL DB',
+                        info='Execution time per second for the %d '
+                             'normalized statements with highest total '
+                             'execution time in the last interval.' 
+                             % self._topStatements,
+                        args='--base 1000 --lower-limit 0')
+                elif name == 'pg_stmt_calls':
+                    key = 'calls'
+                    graph = MuninGraph('PostgreSQL - Statement Calls', 
+                        'PostgreSQL DB',
+                        info='Calls per second for the %d normalized '
+                             'statements with most calls in the last '
+                             'interval.' % self._topStatements,
+                        args='--base 1000 --lower-limit 0')
+                else:
+                    key = 'mean_time'
+                    graph = MuninGraph('PostgreSQL - Statement Latency (ms)', 
+                        'PostgreSQL DB',
+                        info='Mean execution time per call for the %d '
+                             'normalized statements with highest latency in '
+                             'the last interval.' % self._topStatements,
+                        args='--base 1000 --lower-limit 0')
+                for queryid in prev_top.get(key, []):
+                    label = statement_label(queryid)
+                    graph.addField('stmt_' + label, label, draw='LINE2', 
+                                   type='GAUGE', min=0, 
+                                   info=texts.get(queryid))
+                if key == 'mean_time':
+                    graph.addField('all', 'all', draw='LINE2', type='GAUGE', 
+                        min=0, colour='000000',
+                        info='Mean execution time of all statements.')
+                else:
+                    graph.addField('other', 'other', draw='LINE2', 
+                        type='GAUGE', min=0, colour='000000',
+                        info='Aggregate of the rest of the statements.')
+                self.appendGraph(name, graph)
+            
     def retrieveVals(self):
         """Retrieve values for graphs."""                
-        stats = self._dbconn.getDatabaseStats()
+        stats = self._dbconn.getStatsSnapshot(dbsize=False)
         databases = stats.get('databases')
         totals = stats.get('totals')
         if databases and len(databases) > 0:
             if self.hasGraph('pg_connections'):
-                limit = self._dbconn.getParam('max_connections')
-                self.setGraphVal('pg_connections', 'max_conn', limit)
+                self.setGraphVal('pg_connections', 'max_conn', 
+                                 stats['max_connections'])
                 for (db, dbstats) in databases.iteritems():
                     if self.dbIncluded(db):
                         self.setGraphVal('pg_connections', db, 
                                          dbstats['numbackends'])
                 self.setGraphVal('pg_connections', 'total', totals['numbackends'])
             if self.hasGraph('pg_diskspace'):
-                for (db, dbstats) in databases.iteritems():
-                    if self.dbIncluded(db):
-                        self.setGraphVal('pg_diskspace', db, dbstats['disk_size'])
-                self.setGraphVal('pg_diskspace', 'total', totals['disk_size'])
+                self._setDiskspaceVals(databases.keys())
         if self.hasGraph('pg_blockreads'):
             self.setGraphVal('pg_blockreads', 'blk_hit', totals['blks_hit'])
             self.setGraphVal('pg_blockreads', 'blk_read', totals['blks_read'])
@@ -344,25 +470,218 @@ class MuninPgPlugin(MuninPlugin):
                         if self.hasGraph(graph_name):
                             self.setGraphVal(graph_name, db, dbstats[attr_name])
         
-        stats = None               
+        bgstats = stats['bgwriter']
         if self.hasGraph('pg_checkpoints'):
-            if stats is None:
-                stats = self._dbconn.getBgWriterStats()
             self.setGraphVal('pg_checkpoints', 'req', 
-                             stats.get('checkpoints_req'))
+                             bgstats.get('checkpoints_req'))
             self.setGraphVal('pg_checkpoints', 'timed', 
-                             stats.get('checkpoints_timed'))
+                             bgstats.get('checkpoints_timed'))
         if self.hasGraph('pg_bgwriter'):
-            if stats is None:
-                stats = self._dbconn.getBgWriterStats()
             self.setGraphVal('pg_bgwriter', 'backend', 
-                             stats.get('buffers_backend'))
+                             bgstats.get('buffers_backend'))
             self.setGraphVal('pg_bgwriter', 'clean', 
-                             stats.get('buffers_clean'))
+                             bgstats.get('buffers_clean'))
             self.setGraphVal('pg_bgwriter', 'chkpoint', 
-                             stats.get('buffers_checkpoint'))
+                             bgstats.get('buffers_checkpoint'))
+        self._setRelVals()
+        self._setStmtVals()
+        self.saveState(self._state)
             
     
+    def _setDiskspaceVals(self, databases):
+        """Set values for disk usage graph using the database sizes cached in
+        plugin state.
+        
+        @param databases: List of database names.
+        
+        """
+        sizes = self._dbconn.getDatabaseSizes(databases, 
+                                              self._state.get('dbsize'),
+                                              self._dbsizeTTL, 
+                                              self._dbsizeMax)
+        for db in databases:
+            if self.dbIncluded(db) and sizes.has_key(db):
+                self.setGraphVal('pg_diskspace', db, sizes[db][0])
+        if len(sizes) == len(databases):
+            self.setGraphVal('pg_diskspace', 'total', 
+                             sum([size for (size, ts) in sizes.values()]))
+        else:
+            self.setGraphVal('pg_diskspace', 'total', None)
+        self._state['dbsize'] = sizes
+    
+    def _getRelStats(self, kind):
+        """Query the top relations of kind and the relations graphed in the 
+        previous run, and cache the result for setting the values.
+        
+        @param kind: tables or indexes.
+        @return:     Dictionary with the keys top, totals and snapshot.
+        
+        """
+        prev = self._state.get(kind, {})
+        if kind == 'tables':
+            stats = self._dbconn.getTableStats(prev.get('snapshot'), 
+                                               self._topTables,
+                                               prev.get('top'))
+        else:
+            stats = self._dbconn.getIndexStats(prev.get('snapshot'), 
+                                               self._topTables,
+                                               prev.get('top'))
+        self._relStats[kind] = stats
+        return stats
+    
+    def _getStmtStats(self):
+        """Query the top statements and the statements graphed in the 
+        previous run, and cache the result for setting the values.
+        
+        @return: Dictionary with the keys top, selected, totals and snapshot
+                 or None if pg_stat_statements is not available.
+        
+        """
+        prev = self._state.get('statements', {})
+        queryids = set()
+        for ids in prev.get('top', {}).values():
+            queryids.update(ids)
+        self._stmtStats = self._dbconn.getStatementStats(
+            prev.get('snapshot'), self._topStatements, queryids)
+        return self._stmtStats
+    
+    def _relFieldName(self, rel):
+        """Return field name for table or index.
+        
+        @param rel: Name of table or index qualified with schema name.
+        @return:    Field name.
+        
+        """
+        return 'rel_' + re.sub('\W', '_', rel)
+    
+    def _setRelVals(self):
+        """Set values for per-table and per-index graphs and store the 
+        snapshots of the activity counters in plugin state."""
+        now = time.time()
+        for (kind, stats) in self._relStats.items():
+            if stats is None:
+                stats = self._getRelStats(kind)
+            prev = self._state.get(kind, {})
+            interval = None
+            if prev.has_key('time') and now > prev['time']:
+                interval = now - prev['time']
+            if kind == 'tables':
+                graphs = (('pg_table_activity', 'delta'), 
+                          ('pg_table_dead_tup', 'n_dead_tup'))
+            else:
+                graphs = (('pg_index_scans', 'delta'),)
+            for (graph_name, key) in graphs:
+                if not self.hasGraph(graph_name):
+                    continue
+                fields = set(self.getGraphFieldList(graph_name))
+                if key == 'delta':
+                    fields.discard('other')
+                    other = stats['totals'].get('delta')
+                else:
+                    fields.discard('total')
+                for relstats in stats['top']:
+                    field = self._relFieldName(relstats['name'])
+                    if field not in fields:
+                        continue
+                    fields.discard(field)
+                    val = relstats[key]
+                    if key == 'delta':
+                        if other is not None:
+                            other -= val
+                        if interval is not None:
+                            val = val / interval
+                        else:
+                            val = None
+                    self.setGraphVal(graph_name, field, val)
+                for field in fields:
+                    self.setGraphVal(graph_name, field, None)
+                if key == 'delta':
+                    if interval is not None and other is not None:
+                        self.setGraphVal(graph_name, 'other', other / interval)
+                    else:
+                        self.setGraphVal(graph_name, 'other', None)
+                else:
+                    self.setGraphVal(graph_name, 'total', 
+                                     stats['totals'].get(key))
+            top = [relstats['name'] 
+                   for relstats in stats['top'][:self._topTables]
+                   if relstats['delta'] > 0]
+            if not top:
+                top = prev.get('top', [])
+            self._state[kind] = {'time': now, 
+                                 'snapshot': stats['snapshot'],
+                                 'top': top}
+    
+    def _setStmtVals(self):
+        """Set values for statement graphs and store the snapshot of the 
+        pg_stat_statements counters in plugin state."""
+        if not [name for name in ('pg_stmt_time', 'pg_stmt_calls', 
+                                  'pg_stmt_latency') 
+                if self.hasGraph(name)]:
+            return
+        if self._stmtStats is None and self._getStmtStats() is None:
+            return
+        now = time.time()
+        prev = self._state.get('statements', {})
+        interval = None
+        if prev.has_key('time') and now > prev['time']:
+            interval = now - prev['time']
+        stats = self._stmtStats
+        for (graph_name, key) in (('pg_stmt_time', 'total_time'),
+                                  ('pg_stmt_calls', 'calls'),
+                                  ('pg_stmt_latency', 'mean_time')):
+            if not self.hasGraph(graph_name):
+                continue
+            fields = set(self.getGraphFieldList(graph_name))
+            fields.discard('other')
+            fields.discard('all')
+            other = stats['totals'][key]
+            graphed = dict([(stmt['queryid'], stmt) 
+                            for stmt in stats['selected'].values()])
+            for stmt in stats['top'][key]:
+                graphed[stmt['queryid']] = stmt
+            for stmt in graphed.values():
+                field = 'stmt_' + stmt['label']
+                if field not in fields:
+                    continue
+                fields.discard(field)
+                val = stmt[key]
+                if key != 'mean_time':
+                    other -= val
+                    val = val / interval if interval is not None else None
+                elif interval is None:
+                    val = None
+                self.setGraphVal(graph_name, field, val)
+            for field in fields:
+                self.setGraphVal(graph_name, field, None)
+            if key == 'mean_time':
+                if interval is not None:
+                    self.setGraphVal(graph_name, 'all', other)
+                else:
+                    self.setGraphVal(graph_name, 'all', None)
+            elif interval is not None:
+                self.setGraphVal(graph_name, 'other', other / interval)
+            else:
+                self.setGraphVal(graph_name, 'other', None)
+        top = prev.get('top', {})
+        for (key, stmts) in stats['top'].iteritems():
+            if stmts:
+                top[key] = [stmt['queryid'] for stmt in stmts]
+        selected = set()
+        for queryids in top.values():
+            selected.update(queryids)
+        texts = dict([(queryid, text) 
+                      for (queryid, text) in prev.get('text', {}).iteritems()
+                      if queryid in selected])
+        missing = [queryid for queryid in selected 
+                   if not texts.has_key(queryid)]
+        if missing:
+            texts.update(self._dbconn.getStatementText(missing))
+        self._state['statements'] = {'time': now, 
+                                     'snapshot': stats['snapshot'],
+                                     'top': top,
+                                     'text': texts}
+    
     def dbIncluded(self, name):
         """Utility method to check if database is included in graphs.
         
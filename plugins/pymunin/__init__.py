@@ -272,14 +272,15 @@ class MuninPlugin:
         storage to permit access to previous state in subsequent plugin runs.
         
         Any object that can be pickled and unpickled can be used to store the 
-        plugin state.
+        plugin state. The state is stored with the binary pickle protocol, 
+        which keeps large numeric arrays compact and fast to load.
         
         @param stateObj: Object that stores plugin state.
         
         """
         try:
-            fp = open(self._stateFile,  'w')
-            pickle.dump(stateObj, fp)
+            fp = open(self._stateFile,  'wb')
+            pickle.dump(stateObj, fp, pickle.HIGHEST_PROTOCOL)
         except:
             raise IOError("Failure in storing plugin state in file: %s" 
                           % self._stateFile)
@@ -294,7 +295,7 @@ class MuninPlugin:
         """
         if os.path.exists(self._stateFile):
             try:
-                fp = open(self._stateFile,  'r')
+                fp = open(self._stateFile,  'rb')
                 stateObj = pickle.load(fp)
             except:
                 raise IOError("Failure in reading plugin state from file: %s" 
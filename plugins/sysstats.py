@@ -11,12 +11,18 @@ Wild Card Plugin - No
 
 Multigraph Plugin - Graph Structure
    - sys_loadavg
+   - sys_pressure
    - sys_cpu_util
+   - sys_cpu_percpu
+   - sys_cpu_imbalance
    - sys_memory_util
    - sys_memory_avail
    - sys_processes
    - sys_forks
    - sys_intr_ctxt
+   - sys_irq_top
+   - sys_irq_percpu
+   - sys_softirq_net
    - sys_vm_paging
    - sys_vm_swapping
 
@@ -26,6 +32,8 @@ Environment Variables
   include_graphs: Comma separated list of enabled graphs.
                   (All graphs enabled by default.)
   exclude_graphs: Comma separated list of disabled graphs.
+  top_irqs:       Number of interrupt sources with highest rate in the last 
+                  interval to graph in sys_irq_top. (Default: 10)
 
   Example:
     [sysstats]
@@ -36,9 +44,12 @@ Environment Variables
 #%# family=auto
 #%# capabilities=noautoconf nosuggest
 
+import re
 import sys
+import time
 from pymunin import MuninGraph, MuninPlugin, muninMain
-from pysysinfo.system import SystemInfo
+from pysysinfo.system import (SystemInfo, cpu_busy_percent, cpu_imbalance,
+                              irq_deltas, irq_row_totals)
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -67,9 +78,16 @@ class MuninSysStatsPlugin(MuninPlugin):
         """     
         MuninPlugin.__init__(self, argv, env, debug)
         
-        self._sysinfo = SystemInfo()
+        self._sysinfo = SystemInfo(snapshot=True)
         self._loadstats = None
+        self._pressurestats = None
         self._cpustats = None
+        self._percpustats = None
+        self._irqstats = None
+        self._softirqstats = None
+        self._state = self.restoreState() or {}
+        self._newState = {}
+        self._topIrqs = int(self.envGet('top_irqs', 10))
         self._memstats = None
         self._procstats = None
         self._vmstats = None
@@ -83,6 +101,25 @@ class MuninSysStatsPlugin(MuninPlugin):
             graph.addField('load1min', '1 min', type='GAUGE', draw='LINE1')
             self.appendGraph('sys_loadavg', graph)
         
+        if self.graphEnabled('sys_pressure'):
+            self._pressurestats = self._sysinfo.getPressureStats()
+            if self._pressurestats:
+                graph = MuninGraph('Pressure Stall Time (%)', 'System',
+                    info='Percentage of time some or all non-idle tasks were '
+                         'stalled waiting for cpu, memory or io.',
+                    args='--base 1000 --lower-limit 0')
+                for (resource, line) in (('cpu', 'some'), 
+                                         ('memory', 'some'), 
+                                         ('memory', 'full'), 
+                                         ('io', 'some'), 
+                                         ('io', 'full')):
+                    if self._pressurestats.get(resource, {}).has_key(line):
+                        field = '%s_%s' % (resource, line)
+                        graph.addField(field, '%s %s' % (resource, line), 
+                                       type='DERIVE', min=0, draw='LINE2', 
+                                       cdef='%s,10000,/' % field)
+                self.appendGraph('sys_pressure', graph)
+        
         if self.graphEnabled('sys_cpu_util'):
             self._cpustats = self._sysinfo.getCPUuse()
             graph = MuninGraph('CPU Utilization (%)', 'System',
@@ -94,6 +131,34 @@ class MuninSysStatsPlugin(MuninPlugin):
                     graph.addField(field, field, type='DERIVE', min=0, 
                                    cdef='%s,10,/' % field, draw='AREASTACK')
             self.appendGraph('sys_cpu_util', graph)
+        
+        if self.graphEnabled('sys_cpu_percpu'):
+            self._percpustats = self._sysinfo.getPerCPUuse()
+            graph = MuninGraph('CPU Utilization per CPU (%)', 'System',
+                info='Percentage of busy time for each CPU.',
+                args='--base 1000 --lower-limit 0 --upper-limit 100')
+            for cpu in self._percpustats[0]:
+                graph.addField('cpu%d' % cpu, 'cpu%d' % cpu, type='GAUGE', 
+                               draw='LINE1', min=0, max=100)
+            self.appendGraph('sys_cpu_percpu', graph)
+        
+        if self.graphEnabled('sys_cpu_imbalance'):
+            if self._percpustats is None:
+                self._percpustats = self._sysinfo.getPerCPUuse()
+            graph = MuninGraph('CPU Utilization Imbalance (%)', 'System',
+                info='Summary of busy time percentage across CPUs.',
+                args='--base 1000 --lower-limit 0 --upper-limit 100')
+            graph.addField('max', 'max', type='GAUGE', draw='LINE2', min=0,
+                           info='Busy time percentage of busiest CPU.')
+            graph.addField('min', 'min', type='GAUGE', draw='LINE2', min=0,
+                           info='Busy time percentage of least busy CPU.')
+            graph.addField('avg', 'avg', type='GAUGE', draw='LINE2', min=0,
+                           info='Average busy time percentage of CPUs.')
+            graph.addField('stddev', 'stddev', type='GAUGE', draw='LINE2', 
+                           min=0,
+                           info='Standard deviation of busy time percentage '
+                                'of CPUs.')
+            self.appendGraph('sys_cpu_imbalance', graph)
             
         if self.graphEnabled('sys_mem_util'):
             if self._memstats is None:
@@ -183,6 +248,58 @@ class MuninSysStatsPlugin(MuninPlugin):
                     idx += 1
             self.appendGraph('sys_intr_ctxt', graph)
         
+        if self.graphEnabled('sys_irq_top') or self.graphEnabled('sys_irq_percpu'):
+            self._irqstats = self._sysinfo.getInterrupts()
+        
+        if self._irqstats and self.graphEnabled('sys_irq_top'):
+            graph = MuninGraph('Interrupts per Second - Top Sources', 'System',
+                info='Hardware Interrupts per second for the %d interrupt '
+                     'sources with highest rate in the last interval.' 
+                     % self._topIrqs,
+                args='--base 1000 --lower-limit 0')
+            irqs = [irq for irq in self._state.get('irqtop', [])
+                    if irq in self._irqstats['rows']]
+            if not irqs:
+                # No interrupt history on first run; use totals since boot.
+                irqs = self._selectTopIrqs(self._irqstats['rows'],
+                                           irq_row_totals(self._irqstats))
+            for irq in irqs:
+                desc = self._irqstats['desc'].get(irq, '')
+                if irq.isdigit() and desc:
+                    label = 'irq %s %s' % (irq, desc.split()[-1])
+                else:
+                    label = irq
+                graph.addField(self._irqFieldName(irq), label, 
+                               type='GAUGE', draw='LINE2', min=0, info=desc)
+            self.appendGraph('sys_irq_top', graph)
+        
+        if self._irqstats and self.graphEnabled('sys_irq_percpu'):
+            graph = MuninGraph('Interrupts per Second per CPU', 'System',
+                info='Hardware Interrupts per second serviced by each CPU.',
+                args='--base 1000 --lower-limit 0')
+            for cpu in self._irqstats['cpus']:
+                graph.addField('cpu%d' % cpu, 'cpu%d' % cpu, type='GAUGE', 
+                               draw='LINE1', min=0)
+            self.appendGraph('sys_irq_percpu', graph)
+        
+        if self.graphEnabled('sys_softirq_net'):
+            self._softirqstats = self._sysinfo.getSoftirqs()
+            if self._softirqstats:
+                graph = MuninGraph('Network Softirqs per Second per CPU', 
+                    'System',
+                    info='NET_RX (-) / NET_TX (+) Software Interrupts per '
+                         'second serviced by each CPU.',
+                    args='--base 1000 --lower-limit 0',
+                    vlabel='rx (-) / tx (+) per second')
+                for cpu in self._softirqstats['cpus']:
+                    graph.addField('rx_cpu%d' % cpu, 'cpu%d' % cpu, 
+                                   type='GAUGE', draw='LINE1', min=0, 
+                                   graph=False)
+                    graph.addField('tx_cpu%d' % cpu, 'cpu%d' % cpu, 
+                                   type='GAUGE', draw='LINE1', min=0, 
+                                   negative='rx_cpu%d' % cpu)
+                self.appendGraph('sys_softirq_net', graph)
+        
         if self.graphEnabled('sys_vm_paging'):
             graph = MuninGraph('VM - Paging', 'System',
                 info='Virtual Memory Paging: Pages In (-) / Out (+) per Second.',
@@ -213,10 +330,17 @@ class MuninSysStatsPlugin(MuninPlugin):
                 self.setGraphVal('sys_loadavg', 'load15min', self._loadstats[2])
                 self.setGraphVal('sys_loadavg', 'load5min', self._loadstats[1])
                 self.setGraphVal('sys_loadavg', 'load1min', self._loadstats[0])
+        if self._pressurestats and self.hasGraph('sys_pressure'):
+            for field in self.getGraphFieldList('sys_pressure'):
+                (resource, line) = field.split('_')
+                self.setGraphVal('sys_pressure', field, 
+                                 self._pressurestats[resource][line]['total'])
         if self._cpustats and self.hasGraph('sys_cpu_util'):
             for field in self.getGraphFieldList('sys_cpu_util'):
                 self.setGraphVal('sys_cpu_util', 
                                  field, int(self._cpustats[field] * 1000))
+        if self._percpustats is not None:
+            self._updatePerCPUstats()
         if self._memstats:
             if self.hasGraph('sys_mem_util'):
                 for field in self.getGraphFieldList('sys_mem_util'):
@@ -269,6 +393,121 @@ class MuninSysStatsPlugin(MuninPlugin):
                                  self._vmstats['pswpin'])
                 self.setGraphVal('sys_vm_swapping', 'out', 
                                  self._vmstats['pswpout'])
+        if self._irqstats or self._softirqstats:
+            self._updateIrqStats()
+        if self._newState:
+            self.saveState(self._newState)
+
+    def _updatePerCPUstats(self):
+        """Compute per CPU utilization since the last run from the CPU time 
+        counters saved in plugin state.
+        
+        """
+        (cpus, matrix) = self._percpustats
+        prev = self._state.get('percpu')
+        busy = None
+        if prev is not None and prev['cpus'] == cpus:
+            try:
+                busy = cpu_busy_percent(prev['matrix'], matrix)
+            except:
+                busy = None
+        if self.hasGraph('sys_cpu_percpu'):
+            for (idx, cpu) in enumerate(cpus):
+                if busy is not None:
+                    self.setGraphVal('sys_cpu_percpu', 'cpu%d' % cpu, busy[idx])
+                else:
+                    self.setGraphVal('sys_cpu_percpu', 'cpu%d' % cpu, None)
+        if self.hasGraph('sys_cpu_imbalance'):
+            if busy is not None:
+                summary = cpu_imbalance(busy)
+            else:
+                summary = {}
+            for field in ('max', 'min', 'avg', 'stddev'):
+                self.setGraphVal('sys_cpu_imbalance', field, summary.get(field))
+        self._newState['percpu'] = {'cpus': cpus, 'matrix': matrix}
+    
+    def _updateIrqStats(self):
+        """Compute interrupt and softirq rates since the last run from the 
+        counters saved in plugin state, and select the top interrupt sources 
+        for the next run.
+        
+        """
+        now = time.time()
+        prev_time = self._state.get('time')
+        if prev_time is not None and now > prev_time:
+            interval = now - prev_time
+        else:
+            interval = None
+        self._newState['time'] = now
+        if self._irqstats:
+            deltas = None
+            if interval is not None:
+                deltas = irq_deltas(self._state.get('irq'), self._irqstats)
+            if self.hasGraph('sys_irq_top'):
+                rates = {}
+                if deltas is not None:
+                    rates = dict(zip(deltas['rows'], 
+                                     [val / interval 
+                                      for val in deltas['rowtotals']]))
+                for irq in self._graphIrqs():
+                    self.setGraphVal('sys_irq_top', self._irqFieldName(irq), 
+                                     rates.get(irq))
+                if deltas is not None:
+                    self._newState['irqtop'] = self._selectTopIrqs(
+                        deltas['rows'], deltas['rowtotals'])
+                else:
+                    self._newState['irqtop'] = self._state.get('irqtop', [])
+            if self.hasGraph('sys_irq_percpu'):
+                for (idx, cpu) in enumerate(self._irqstats['cpus']):
+                    if deltas is not None:
+                        val = deltas['cputotals'][idx] / interval
+                    else:
+                        val = None
+                    self.setGraphVal('sys_irq_percpu', 'cpu%d' % cpu, val)
+            self._newState['irq'] = self._irqstats
+        if self._softirqstats:
+            deltas = None
+            if interval is not None:
+                deltas = irq_deltas(self._state.get('softirq'), 
+                                    self._softirqstats)
+            for (prefix, row) in (('rx', 'NET_RX'), ('tx', 'NET_TX')):
+                row_delta = None
+                if deltas is not None and row in deltas['rows']:
+                    row_delta = deltas['matrix'][deltas['rows'].index(row)]
+                for (idx, cpu) in enumerate(self._softirqstats['cpus']):
+                    if row_delta is not None:
+                        val = row_delta[idx] / interval
+                    else:
+                        val = None
+                    self.setGraphVal('sys_softirq_net', 
+                                     '%s_cpu%d' % (prefix, cpu), val)
+            self._newState['softirq'] = self._softirqstats
+    
+    def _graphIrqs(self):
+        """Return list of interrupt sources in sys_irq_top graph."""
+        fields = self.getGraphFieldList('sys_irq_top')
+        return [irq for irq in self._irqstats['rows'] 
+                if self._irqFieldName(irq) in fields]
+    
+    def _selectTopIrqs(self, irqs, totals):
+        """Return top N interrupt sources ranked by totals.
+        
+        @param irqs:   List of interrupt sources.
+        @param totals: List of interrupt counts for sources.
+        @return:       List of selected interrupt sources.
+        
+        """
+        ranked = sorted(zip(totals, irqs), reverse=True)
+        return [irq for (total, irq) in ranked[:self._topIrqs] if total > 0]
+    
+    def _irqFieldName(self, irq):
+        """Return field name for interrupt source.
+        
+        @param irq: Interrupt source.
+        @return:    Field name.
+        
+        """
+        return 'irq_' + re.sub('\W', '_', irq)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,328 @@
+"""Implements CgroupInfo Class for gathering resource usage stats for Control
+Groups from the Linux cgroup v2 (unified) hierarchy.
+
+"""
+
+import os
+import time
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.9"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+cgroupRootDirs = ('/sys/fs/cgroup', '/sys/fs/cgroup/unified')
+cgroupControllersFile = 'cgroup.controllers'
+fullScanInterval = 3600
+
+# Maps
+cpuStatKeys = {'usage_usec': 'cpu_usage',
+               'user_usec': 'cpu_user',
+               'system_usec': 'cpu_system',
+               'nr_throttled': 'cpu_nr_throttled',
+               'throttled_usec': 'cpu_throttled'}
+memoryStatKeys = {'anon': 'memory_anon',
+                  'file': 'memory_file',
+                  'kernel_stack': 'memory_kernel_stack',
+                  'sock': 'memory_sock',
+                  'shmem': 'memory_shmem'}
+ioStatKeys = {'rbytes': 'io_rbytes',
+              'wbytes': 'io_wbytes',
+              'rios': 'io_rios',
+              'wios': 'io_wios'}
+
+
+class CgroupInfo:
+    """Class to retrieve resource usage stats for cgroup v2 Control Groups.
+
+    The directory topology of the hierarchy is cached. On refresh only the
+    cached directories are checked with stat, and the subtrees are listed
+    again only for directories where child cgroups were created or removed.
+    The topology can be exported with getTopology and passed back on
+    instantiation to keep the cache between runs.
+
+    A child removed and another created under the same parent within the
+    same second leaves the signature of the parent unchanged, so the whole
+    hierarchy is walked again once the cached topology is older than
+    fullScanInterval seconds.
+
+    """
+
+    def __init__(self, root=None, topology=None, 
+                 fullScanInterval=fullScanInterval):
+        """Initialize cgroup hierarchy.
+
+        @param root:             Mount point of cgroup v2 hierarchy. (The 
+                                 default mount points are tried if not 
+                                 defined.)
+        @param topology:         Cached topology returned by getTopology.
+        @param fullScanInterval: Walk the whole hierarchy again if the cached
+                                 topology is older than this number of 
+                                 seconds.
+
+        """
+        if root is None:
+            for path in cgroupRootDirs:
+                if os.path.exists(os.path.join(path, cgroupControllersFile)):
+                    root = path
+                    break
+            else:
+                raise IOError('Could not find mount point for cgroup v2 '
+                              'hierarchy.')
+        self._root = root
+        self._rescans = 0
+        now = time.time()
+        if (topology is not None and topology.get('root') == root
+            and 0 <= now - topology.get('scantime', 0) < fullScanInterval):
+            self._dirs = topology['dirs']
+            self._scantime = topology['scantime']
+            self._refreshTopology()
+        else:
+            self._dirs = {}
+            self._scantime = now
+            self._scanTree('')
+
+    def _absPath(self, cgroup):
+        """Return absolute path of directory for cgroup.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+        @return:       Absolute path.
+
+        """
+        if cgroup:
+            return os.path.join(self._root, cgroup)
+        else:
+            return self._root
+
+    def _listChildren(self, cgroup):
+        """Return list of child cgroups.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+        @return:       List of paths of child cgroups.
+
+        """
+        path = self._absPath(cgroup)
+        if scandir is not None:
+            names = [entry.name for entry in scandir(path)
+                     if entry.is_dir(follow_symlinks=False)]
+        else:
+            names = [name for name in os.listdir(path)
+                     if os.path.isdir(os.path.join(path, name))]
+        if cgroup:
+            return [cgroup + '/' + name for name in names]
+        else:
+            return names
+
+    def _dirSignature(self, cgroup):
+        """Return signature of cgroup directory that changes when child 
+        cgroups are created or removed.
+
+        The link count of directories in cgroupfs is the number of
+        subdirectories plus two; the modification time is included too.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+        @return:       Tuple of modification time and link count.
+
+        """
+        st = os.stat(self._absPath(cgroup))
+        return (st.st_mtime, st.st_nlink)
+
+    def _scanTree(self, cgroup):
+        """Walk subtree of cgroup and add directories to topology.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+
+        """
+        self._rescans += 1
+        stack = [cgroup]
+        while stack:
+            current = stack.pop()
+            try:
+                signature = self._dirSignature(current)
+                children = self._listChildren(current)
+            except OSError:
+                continue
+            self._dirs[current] = signature
+            stack.extend(children)
+
+    def _dropTree(self, cgroup):
+        """Remove subtree of cgroup from topology.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+
+        """
+        prefix = cgroup + '/'
+        for path in self._dirs.keys():
+            if path == cgroup or path.startswith(prefix):
+                del self._dirs[path]
+
+    def _rescanChildren(self, cgroup):
+        """List child cgroups of cgroup again, drop the removed children
+        and walk the subtrees of the new children.
+
+        @param cgroup: Path of cgroup relative to root of hierarchy.
+
+        """
+        if not self._dirs.has_key(cgroup):
+            return
+        try:
+            self._dirs[cgroup] = self._dirSignature(cgroup)
+            children = set(self._listChildren(cgroup))
+        except OSError:
+            self._dropTree(cgroup)
+            return
+        if cgroup:
+            prefix = cgroup + '/'
+        else:
+            prefix = ''
+        for path in self._dirs.keys():
+            if (path and path.startswith(prefix) 
+                and path.find('/', len(prefix)) == -1
+                and path not in children):
+                self._dropTree(path)
+        for child in children:
+            if not self._dirs.has_key(child):
+                self._scanTree(child)
+
+    def _refreshTopology(self):
+        """Check signatures of cached directories and rescan the directories 
+        where child cgroups were created or removed."""
+        changed = set()
+        for cgroup in sorted(self._dirs.keys()):
+            if not self._dirs.has_key(cgroup):
+                continue
+            try:
+                signature = self._dirSignature(cgroup)
+            except OSError:
+                self._dropTree(cgroup)
+                changed.add(cgroup.rpartition('/')[0])
+                continue
+            if signature != self._dirs[cgroup]:
+                changed.add(cgroup)
+        for cgroup in sorted(changed):
+            self._rescanChildren(cgroup)
+
+    def getRescans(self):
+        """Return number of subtree scans executed on instantiation.
+
+        @return: Number of subtree scans.
+
+        """
+        return self._rescans
+
+    def getTopology(self):
+        """Return cached topology of hierarchy for reuse in the next run.
+
+        @return: Dictionary of topology.
+
+        """
+        return {'root': self._root, 'dirs': self._dirs, 
+                'scantime': self._scantime}
+
+    def getCgroups(self, maxdepth=None, leaves=False):
+        """Return list of cgroups, excluding the root cgroup.
+
+        @param maxdepth: Return only cgroups up to this depth in hierarchy.
+        @param leaves:   Return only cgroups without child cgroups. (Child
+                         usage is accounted in parents too, so leaves avoid
+                         double counting.)
+        @return:         List of paths of cgroups relative to root.
+
+        """
+        cgroups = [path for path in self._dirs.keys() if path]
+        if maxdepth is not None:
+            cgroups = [path for path in cgroups
+                       if path.count('/') < maxdepth]
+        if leaves:
+            parents = set()
+            for path in cgroups:
+                parents.add(path.rpartition('/')[0])
+            cgroups = [path for path in cgroups if path not in parents]
+        cgroups.sort()
+        return cgroups
+
+    def _readFile(self, cgroup, filename):
+        """Return contents of file in cgroup directory.
+
+        @param cgroup:   Path of cgroup relative to root of hierarchy.
+        @param filename: Name of file.
+        @return:         File contents or None if unavailable.
+
+        """
+        try:
+            fp = open(os.path.join(self._absPath(cgroup), filename), 'r')
+            data = fp.read()
+            fp.close()
+        except IOError:
+            return None
+        return data
+
+    def getCgroupStats(self, cgroups=None, cpu=True, memory=True, io=True,
+                       memstat=False):
+        """Return resource usage stats for cgroups.
+
+        Counters for CPU time are in microseconds and cumulative, memory
+        usage is in bytes and the io counters are cumulative and summed over
+        all devices. Stats are omitted for controllers that are not enabled
+        for the cgroup.
+
+        @param cgroups: List of cgroup paths. (All cgroups by default.)
+        @param cpu:     Include stats from cpu.stat.
+        @param memory:  Include stats from memory.current.
+        @param io:      Include stats from io.stat.
+        @param memstat: Include breakdown of memory usage from memory.stat.
+        @return:        Nested dictionary of stats keyed by cgroup path.
+
+        """
+        if cgroups is None:
+            cgroups = self.getCgroups()
+        info_dict = {}
+        for cgroup in cgroups:
+            stats = {}
+            if cpu:
+                data = self._readFile(cgroup, 'cpu.stat')
+                if data is not None:
+                    for line in data.splitlines():
+                        cols = line.split()
+                        if len(cols) == 2 and cpuStatKeys.has_key(cols[0]):
+                            stats[cpuStatKeys[cols[0]]] = long(cols[1])
+            if memory:
+                data = self._readFile(cgroup, 'memory.current')
+                if data is not None:
+                    stats['memory_current'] = long(data)
+                    if memstat:
+                        data = self._readFile(cgroup, 'memory.stat')
+                    else:
+                        data = None
+                    if data is not None:
+                        for line in data.splitlines():
+                            cols = line.split()
+                            if (len(cols) == 2
+                                and memoryStatKeys.has_key(cols[0])):
+                                stats[memoryStatKeys[cols[0]]] = long(cols[1])
+            if io:
+                data = self._readFile(cgroup, 'io.stat')
+                if data is not None:
+                    for key in ioStatKeys.values():
+                        stats[key] = 0
+                    for line in data.splitlines():
+                        for col in line.split()[1:]:
+                            (key, sep, val) = col.partition('=')
+                            if ioStatKeys.has_key(key):
+                                stats[ioStatKeys[key]] += long(val)
+            if stats:
+                info_dict[cgroup] = stats
+        return info_dict
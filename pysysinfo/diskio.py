@@ -4,7 +4,13 @@
 
 import re
 import os
-from filesystem import FilesystemInfo
+import array
+import hashlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from filesystem import FilesystemInfo, mountinfoFile
 from system import SystemInfo
 
 __author__ = "Ali Onur Uyar"
@@ -23,18 +29,49 @@ diskStatsFile = '/proc/diskstats'
 devicesFile = '/proc/devices'
 devmapperDir = '/dev/mapper'
 sysfsBlockdevDir = '/sys/block'
+partitionsFile = '/proc/partitions'
+swapsFile = '/proc/swaps'
+
+# Device classes (names in /proc/devices) of optical drives, which have a
+# device link in sysfs but are not counted as disks.
+diskExcludeClasses = ('sr',)
+
+# Counters in /proc/diskstats following major, minor and device name; 
+# kernels add discard (4.18) and flush (5.5) counters, old kernels report
+# only rios, rsect, wios and wsect for partitions.
+diskStatsFields = ('rios', 'rmerges', 'rsect', 'rticks',
+                   'wios', 'wmerges', 'wsect', 'wticks',
+                   'ios_active', 'totticks', 'rqticks',
+                   'dios', 'dmerges', 'dsect', 'dticks',
+                   'fios', 'fticks')
+diskStatsPartFields = ('rios', 'rsect', 'wios', 'wsect')
+
+# Attributes cached by getTopology
+topologyAttrs = ('_mapMajorDevclass', '_dmMajorNum', '_mapMinorDmName',
+                 '_mapMinorLV', '_mapLVminor', '_vgTree', '_devClassTree',
+                 '_partitionTree', '_mapDevType', '_mapFSpathDev', 
+                 '_swapList', '_diskDict', '_mpathTree', '_mapDmKind')
+
+# Maps
+dmUUIDprefixes = (('mpath-', 'multipath'), ('LVM-', 'lvm'), 
+                  ('CRYPT-', 'crypt'), ('part', 'part'))
 
 
 class DiskIOinfo:
     """Class to retrieve I/O stats for Block Devices."""
     
-    def __init__(self):
+    def __init__(self, topology=None):
         """Initialization
         
-        @param autoInit: If True parse stats on initization.
+        @param topology: Device topology returned by getTopology in a 
+                         previous run. The topology is reused if the 
+                         fingerprint of the system configuration has not 
+                         changed.
         
         """
-        self._diskStats = None
+        self._devIndex = None
+        self._devNames = None
+        self._diskCounters = None
         self._mapMajorDevclass = None
         self._mapMinorLV = None
         self._mapLVminor = None
@@ -43,10 +80,88 @@ class DiskIOinfo:
         self._mapFSpathDev = None
         self._dmMajorNum = None
         self._devClassTree = None
+        self._diskDict = None
+        self._mpathTree = None
+        self._mapDmKind = None
         self._partitionTree = None
         self._vgTree = None
         self._partList = None
         self._swapList = None
+        self._fingerprint = None
+        if topology is not None:
+            self.loadTopology(topology)
+
+    def _getFingerprint(self):
+        """Return fingerprint of block device, mount and swap configuration.
+        
+        The fingerprint is a hash of the contents of /proc/partitions and 
+        /proc/self/mountinfo (the mount table read by FilesystemInfo), the 
+        swap devices in /proc/swaps and the listings of /sys/block and 
+        /dev/mapper, which are cheap to read compared to rebuilding the 
+        device topology.
+        
+        @return: Fingerprint string.
+        
+        """
+        if self._fingerprint is None:
+            md5 = hashlib.md5()
+            for filename in (partitionsFile, mountinfoFile, swapsFile):
+                try:
+                    fp = open(filename, 'r')
+                    data = fp.read()
+                    fp.close()
+                except IOError:
+                    data = ''
+                if filename == swapsFile:
+                    # Skip usage columns that change between runs.
+                    data = '\n'.join([' '.join(line.split()[:2]) 
+                                      for line in data.splitlines()])
+                md5.update(data)
+                md5.update('\0')
+            for dirname in (sysfsBlockdevDir, devmapperDir):
+                try:
+                    md5.update(' '.join(sorted(os.listdir(dirname))))
+                except OSError:
+                    pass
+                md5.update('\0')
+            self._fingerprint = md5.hexdigest()
+        return self._fingerprint
+    
+    def loadTopology(self, topology):
+        """Initialize device maps from topology returned by getTopology in a 
+        previous run if the fingerprint of the configuration is unchanged.
+        
+        @param topology: Dictionary of device maps.
+        @return:         True if the topology was loaded.
+        
+        """
+        if topology.get('fingerprint') != self._getFingerprint():
+            return False
+        for attr in topologyAttrs:
+            if not topology.has_key(attr):
+                return False
+        for attr in topologyAttrs:
+            setattr(self, attr, topology.get(attr))
+        return True
+    
+    def getTopology(self):
+        """Return device maps for reuse in later runs through loadTopology.
+        
+        @return: Dictionary of device maps.
+        
+        """
+        if self._devClassTree is None:
+            self._initDevClasses()
+        if self._vgTree is None:
+            self._initDMinfo()
+        if self._mapFSpathDev is None:
+            self._initFilesystemInfo()
+        if self._swapList is None:
+            self._initSwapInfo()
+        topology = {'fingerprint': self._getFingerprint()}
+        for attr in topologyAttrs:
+            topology[attr] = getattr(self, attr)
+        return topology
 
     def _initBlockMajorMap(self):
         """Parses /proc/devices to initialize device class - major number map
@@ -87,6 +202,8 @@ class DiskIOinfo:
         self._vgTree = {}
         if self._dmMajorNum is None:
             self._initBlockMajorMap()
+        if not os.path.isdir(devmapperDir):
+            return
         for file in os.listdir(devmapperDir):
             path = os.path.join(devmapperDir, file)
             fstat = os.stat(path)
@@ -108,7 +225,7 @@ class DiskIOinfo:
         """Initialize filesystem to device mappings."""
         self._mapFSpathDev = {}
         fsinfo = FilesystemInfo()
-        if self._diskStats is None:
+        if self._devIndex is None:
             self._initDiskStats()
         for fs in fsinfo.getFSlist():
             devpath = fsinfo.getFSdev(fs)
@@ -128,8 +245,14 @@ class DiskIOinfo:
                     self._swapList.append(mobj.group(1))
     
     def _initDiskStats(self):
-        """Parse and initialize block device I/O stats in /proc/diskstats."""
-        self._diskStats = {}
+        """Parse block device I/O stats in /proc/diskstats in a single pass 
+        into columnar form: a device name index and one array per counter.
+        
+        """
+        self._devIndex = {}
+        counters = {'major': array.array('d'), 'minor': array.array('d')}
+        for field in diskStatsFields:
+            counters[field] = array.array('d')
         try:
             fp = open(diskStatsFile, 'r')
             data = fp.read()
@@ -137,62 +260,128 @@ class DiskIOinfo:
         except:
             raise IOError('Failed reading interface stats from file: %s'
                           % diskStatsFile)
+        numfields = len(diskStatsFields)
+        devs = []
         for line in data.splitlines():
             cols = line.split()
-            dev = cols.pop(2)
-            if len(cols) == 13:
-                self._diskStats[dev] = dict(zip(
-                    ('major', 'minor',
-                     'rios', 'rmerges', 'rsect', 'rticks',
-                     'wios', 'wmerges', 'wsect', 'wticks',
-                     'ios_active', 'totticks', 'rqticks'),
-                    [int(x) for x in cols]))
-            elif len(cols) == 6:
-                self._diskStats[dev] = dict(zip(
-                    ('major', 'minor',
-                     'rios', 'rsect',
-                     'wios', 'wsect'),
-                    [int(x) for x in cols]))
+            numcols = len(cols) - 3
+            if numcols == len(diskStatsPartFields):
+                vals = dict(zip(diskStatsPartFields, cols[3:]))
+                vals = [vals.get(field, 0) for field in diskStatsFields]
+            elif numcols >= 11:
+                vals = cols[3:3 + numfields]
+                vals.extend([0] * (numfields - len(vals)))
             else:
                 continue
-            self._diskStats[dev]['rbytes'] = (
-                self._diskStats[dev]['rsect'] * sectorSize)
-            self._diskStats[dev]['wbytes'] = (
-                self._diskStats[dev]['wsect'] * sectorSize) 
-                    
+            self._devIndex[cols[2]] = len(devs)
+            devs.append(cols[2])
+            counters['major'].append(float(cols[0]))
+            counters['minor'].append(float(cols[1]))
+            for (field, val) in zip(diskStatsFields, vals):
+                counters[field].append(float(val))
+        self._devNames = devs
+        self._diskCounters = counters
+    
+    def _readSysfsAttr(self, devdir, attr):
+        """Returns contents of sysfs attribute file of block device.
+        
+        @param devdir: Sysfs directory of block device.
+        @param attr:   Relative path of attribute file.
+        @return:       Attribute value or None if unavailable.
+        
+        """
+        try:
+            fp = open(os.path.join(devdir, attr), 'r')
+            val = fp.read().strip()
+            fp.close()
+        except IOError:
+            return None
+        return val
+    
     def _initDevClasses(self):
         """Sort block devices into lists depending on device class and 
-        initialize device type map and partition map."""
+        initialize device type map, partition map and disk map.
+        
+        The topology is built in a single pass over the /sys/block/<dev> 
+        directories:
+          - Each partition of a disk has a subdirectory.
+          - Disks (SCSI, NVMe, virtio, Xen, etc.) have a device link;
+            removable media and optical drives are not counted as disks.
+          - Device-mapper devices are classified by the prefix of dm/uuid;
+            the slaves of multipath maps are the paths of the map, and 
+            the slaves of kpartx partitions are the partitioned maps.
+        Multipath maps replace their paths in the disk map, so traffic is
+        not counted both for the map and the paths.
+        
+        """
         self._devClassTree = {}
         self._partitionTree = {}
         self._mapDevType = {}
+        self._diskDict = {}
+        self._mpathTree = {}
+        self._mapDmKind = {}
         basedevs = []
-        otherdevs = []
         if self._mapMajorDevclass is None:
             self._initBlockMajorMap()
-        if self._diskStats is None:
+        if self._devIndex is None:
             self._initDiskStats()
-        for dev in self._diskStats:
-            stats = self._diskStats[dev]
-            devclass = self._mapMajorDevclass.get(stats['major'])
+        majors = self._diskCounters['major']
+        for (dev, idx) in self._devIndex.iteritems():
+            devclass = self._mapMajorDevclass.get(int(majors[idx]))
             if devclass is not None:
-                devdir = os.path.join(sysfsBlockdevDir, dev)
+                # Slashes in device names are replaced by ! in sysfs.
+                devdir = os.path.join(sysfsBlockdevDir, dev.replace('/', '!'))
                 if os.path.isdir(devdir):
                     if not self._devClassTree.has_key(devclass):
                         self._devClassTree[devclass] = []
                     self._devClassTree[devclass].append(dev)
                     self._mapDevType[dev] = devclass
-                    basedevs.append(dev)
+                    basedevs.append((dev, devdir))
+        kpartx = []
+        for (dev, devdir) in basedevs:
+            try:
+                entries = os.listdir(devdir)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry == 'device':
+                    if (self._mapDevType[dev] not in diskExcludeClasses
+                        and self._readSysfsAttr(devdir, 'removable') != '1'):
+                        self._diskDict[dev] = 'disk'
+                elif entry == 'dm':
+                    uuid = self._readSysfsAttr(devdir, 'dm/uuid') or ''
+                    kind = 'other'
+                    for (prefix, dmkind) in dmUUIDprefixes:
+                        if uuid.startswith(prefix):
+                            kind = dmkind
+                            break
+                    self._mapDmKind[dev] = kind
+                    if kind in ('multipath', 'part'):
+                        try:
+                            slaves = os.listdir(os.path.join(devdir, 'slaves'))
+                        except OSError:
+                            slaves = []
+                        slaves = [slave.replace('!', '/') for slave in slaves]
+                        if kind == 'multipath':
+                            self._mpathTree[dev] = slaves
+                        else:
+                            kpartx.append((dev, slaves))
                 else:
-                    otherdevs.append(dev)
-        basedevs.sort(key=len, reverse=True)
-        otherdevs.sort(key=len, reverse=True)
-        idx = 0
-        for partdev in otherdevs:
-            while len(basedevs[idx]) > partdev:
-                idx += 1 
-            for dev in basedevs[idx:]:
-                if re.match("%s(\d+|p\d+)$" % dev, partdev):
+                    partdev = entry.replace('!', '/')
+                    if (self._devIndex.has_key(partdev) 
+                        and not self._mapDevType.has_key(partdev)):
+                        if not self._partitionTree.has_key(dev):
+                            self._partitionTree[dev] = []
+                        self._partitionTree[dev].append(partdev)
+                        self._mapDevType[partdev] = 'part'
+        for (mapdev, paths) in self._mpathTree.iteritems():
+            for path in paths:
+                if self._diskDict.has_key(path):
+                    del self._diskDict[path]
+            self._diskDict[mapdev] = 'multipath'
+        for (partdev, slaves) in kpartx:
+            for dev in slaves:
+                if self._mpathTree.has_key(dev):
                     if not self._partitionTree.has_key(dev):
                         self._partitionTree[dev] = []
                     self._partitionTree[dev].append(partdev)
@@ -214,19 +403,42 @@ class DiskIOinfo:
         @return: List of device names.
         
         """
-        if self._diskStats is None:
+        if self._devIndex is None:
             self._initDiskStats()
-        return self._diskStats.keys()
+        return list(self._devNames)
     
     def getDiskList(self):
-        """Returns list of disk devices.
+        """Returns list of disk devices. Multipath maps are listed instead of 
+        the paths of the map.
         
         @return: List of device names.
         
         """
-        if self._devClassTree is None:
+        if self._diskDict is None:
+            self._initDevClasses()
+        return self._diskDict.keys()
+    
+    def getMultipathDict(self):
+        """Returns dict of multipath maps and paths.
+        
+        @return: Dict of multipath maps and paths.
+        
+        """
+        if self._mpathTree is None:
             self._initDevClasses()
-        return self._devClassTree.get('sd')
+        return self._mpathTree
+    
+    def getDMkind(self, dev):
+        """Returns kind of device-mapper device derived from the uuid of the 
+        device (multipath, lvm, crypt, part or other).
+        
+        @param dev: Device name.
+        @return:    Kind of device-mapper device or None for other devices.
+        
+        """
+        if self._mapDmKind is None:
+            self._initDevClasses()
+        return self._mapDmKind.get(dev)
     
     def getMDlist(self):
         """Returns list of MD devices.
@@ -335,23 +547,34 @@ class DiskIOinfo:
         @return:        Dict of stats.
         
         """
-        if self._diskStats is None:
+        if self._devIndex is None:
             self._initDiskStats()
         if devtype is not None:
             if self._devClassTree is None:
                 self._initDevClasses()
             if devtype <> self._mapDevType.get(dev):
                 return None
-        return self._diskStats.get(dev) 
+        idx = self._devIndex.get(dev)
+        if idx is None:
+            return None
+        return DiskStatsView(self._diskCounters, idx)
 
     def getDiskStats(self, dev):
         """Returns I/O stats for hard disk device.
         
+        Any device classified as disk or multipath map by the sysfs topology
+        (see getDiskList) is accepted, regardless of device class; removable
+        devices and the paths of multipath maps are not.
+        
         @param dev: Device name for hard disk.
-        @return: Dict of stats.
+        @return: Dict of stats or None if dev is not a disk.
         
         """
-        return self.getDevStats(dev, 'sd')
+        if self._diskDict is None:
+            self._initDevClasses()
+        if self._diskDict.has_key(dev):
+            return self.getDevStats(dev)
+        return None
     
     def getPartitionStats(self, dev):
         """Returns I/O stats for partition device.
@@ -425,9 +648,120 @@ class DiskIOinfo:
         @return: Dict of stats.
         
         """
-        if self._diskStats is None:
+        if self._devIndex is None:
             self._initDiskStats()
         if self._mapFSpathDev is None:
             self._initFilesystemInfo()
-        return self._diskStats.get(self._mapFSpathDev.get(fs))
+        dev = self._mapFSpathDev.get(fs)
+        if dev is None:
+            return None
+        return self.getDevStats(dev)
+    
+    def getSnapshot(self):
+        """Returns I/O stats for all block devices in columnar form for 
+        computing deltas with diskstats_deltas.
+        
+        @return: Dictionary with list of device names (devs) and arrays of 
+                 counters (counters).
+        
+        """
+        if self._devIndex is None:
+            self._initDiskStats()
+        return {'devs': self._devNames, 'counters': self._diskCounters}
+
+
+class DiskStatsView:
+    """Read-only dictionary like view of the I/O stats of one block device in 
+    the columnar stats of DiskIOinfo. Values are returned as integers; rbytes 
+    and wbytes are computed from the sector counts on access.
+    
+    """
+    
+    def __init__(self, counters, idx):
+        """Initialize view.
+        
+        @param counters: Dictionary of arrays of counters.
+        @param idx:      Index of device in counter arrays.
+        
+        """
+        self._counters = counters
+        self._idx = idx
+    
+    def getIndex(self):
+        """Returns index of device in counter arrays and in the delta lists 
+        returned by diskstats_deltas for the snapshot.
+        
+        @return: Index of device.
+        
+        """
+        return self._idx
+        
+    def __getitem__(self, key):
+        if key == 'rbytes':
+            return int(self._counters['rsect'][self._idx]) * sectorSize
+        elif key == 'wbytes':
+            return int(self._counters['wsect'][self._idx]) * sectorSize
+        return int(self._counters[key][self._idx])
+    
+    def __contains__(self, key):
+        return self.has_key(key)
+    
+    def has_key(self, key):
+        return key in ('rbytes', 'wbytes') or self._counters.has_key(key)
+    
+    def get(self, key, default=None):
+        if self.has_key(key):
+            return self[key]
+        return default
+    
+    def keys(self):
+        return self._counters.keys() + ['rbytes', 'wbytes']
+
+
+def diskstats_deltas(prev, cur, fields=None):
+    """Returns deltas of counters between two snapshots returned by 
+    DiskIOinfo.getSnapshot.
+    
+    Devices are matched by name; devices that are not in the previous 
+    snapshot get None deltas. Negative deltas (counter resets) are 
+    clipped to zero.
+    
+    @param prev:   Snapshot from previous run.
+    @param cur:    Snapshot from current run.
+    @param fields: List of counters. (All counters by default.)
+    @return:       Dictionary mapping counter name to list of deltas in the 
+                   order of the devices of the current snapshot.
+    
+    """
+    if fields is None:
+        fields = cur['counters'].keys()
+    devs = cur['devs']
+    if prev['devs'] == devs:
+        aligned = None
+    else:
+        prev_idx = dict([(dev, idx) for (idx, dev) in enumerate(prev['devs'])])
+        aligned = [prev_idx.get(dev) for dev in devs]
+    deltas = {}
+    for field in fields:
+        cur_vals = cur['counters'][field]
+        prev_vals = prev['counters'].get(field)
+        if prev_vals is None:
+            deltas[field] = [None] * len(devs)
+            continue
+        if aligned is not None:
+            prev_vals = array.array('d', [(idx is not None and prev_vals[idx]) 
+                                          or 0.0 for idx in aligned])
+        if numpy is not None:
+            delta = (numpy.frombuffer(cur_vals, dtype=float) 
+                     - numpy.frombuffer(prev_vals, dtype=float)).clip(0)
+            delta = delta.tolist()
+        else:
+            delta = [max(val, 0.0) 
+                     for val in map(float.__sub__, cur_vals, prev_vals)]
+        if aligned is not None:
+            for (pos, idx) in enumerate(aligned):
+                if idx is None:
+                    delta[pos] = None
+        deltas[field] = delta
+    return deltas
     
\ No newline at end of file
@@ -2,7 +2,14 @@
 
 """
 
-import subprocess
+import os
+import re
+import time
+import select
+import hashlib
+import array
+import threading
+import Queue
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -15,30 +22,261 @@ __status__ = "Development"
 
 
 # Defaults
-dfCmd = '/bin/df'
-mountsFile = '/proc/mounts'
+mountsFile = '/proc/self/mounts'
+mountinfoFile = '/proc/self/mountinfo'
+statvfsTimeout = 2.0
+statvfsThreads = 4
+statvfsBackoff = 1800
+forecastSamples = 288
+forecastMaxSamples = 2016
+forecastMinSamples = 3
 
 
 
+def unescape_mount_path(path):
+    """Return path with the octal escapes used in the mount tables decoded.
+    
+    @param path: Path as listed in mount table.
+    @return:     Decoded path.
+    
+    """
+    if '\\' not in path:
+        return path
+    return re.sub(r'\\([0-7]{3})', lambda mobj: chr(int(mobj.group(1), 8)), 
+                  path)
+
+
+def parse_mountinfo(data):
+    """Parse contents of /proc/self/mountinfo into mount table indexes.
+    
+    Later entries for the same mount point override the earlier ones, as
+    the last mount hides the filesystems mounted before on the same path.
+    
+    @param data: Contents of mountinfo file.
+    @return:     Dictionary of indexes; fstype, dev and devnum map mount 
+                 points to filesystem type, source device and major:minor 
+                 device number; bytype and bydevnum map filesystem types and 
+                 device numbers to lists of mount points.
+    
+    """
+    fstypes = {}
+    devs = {}
+    devnums = {}
+    for line in data.splitlines():
+        (mountcols, sep, fscols) = line.partition(' - ')
+        cols = mountcols.split()
+        fscols = fscols.split()
+        if len(cols) < 5 or len(fscols) < 2:
+            continue
+        fspath = unescape_mount_path(cols[4])
+        fstypes[fspath] = fscols[0]
+        devs[fspath] = unescape_mount_path(fscols[1])
+        devnums[fspath] = cols[2]
+    bytype = {}
+    bydevnum = {}
+    for (fspath, fstype) in fstypes.iteritems():
+        bytype.setdefault(fstype, []).append(fspath)
+        bydevnum.setdefault(devnums[fspath], []).append(fspath)
+    return {'fstype': fstypes, 'dev': devs, 'devnum': devnums,
+            'bytype': bytype, 'bydevnum': bydevnum}
+
+
+def usage_history_add(history, timestamp, used, size=forecastSamples):
+    """Add usage sample to ring buffer and update the running sums for the 
+    linear regression of usage over time.
+    
+    The sums are updated in constant time by adding the new sample and 
+    subtracting the evicted one. Times and values are stored relative to 
+    the oldest sample; the offsets are moved forward each time the buffer 
+    wraps around to keep the sums small and precise. The samples are kept 
+    as packed strings of doubles, which pickle compactly in plugin state.
+    
+    @param history:   Ring buffer returned by previous call or None.
+    @param timestamp: Time of sample in seconds.
+    @param used:      Used space in bytes.
+    @param size:      Number of samples in ring buffer.
+    @return:          Ring buffer.
+    
+    """
+    itemsize = array.array('d').itemsize
+    if (history is None or not isinstance(history['times'], str)
+        or len(history['times']) != size * itemsize):
+        history = {'tbase': timestamp, 'ybase': float(used), 
+                   'pos': 0, 'count': 0,
+                   'times': '\0' * (size * itemsize),
+                   'used': '\0' * (size * itemsize),
+                   'sums': [0.0] * 4}
+    times = array.array('d')
+    times.fromstring(history['times'])
+    if history['count'] > 0:
+        last = (history['pos'] - 1) % size
+        if timestamp <= times[last] + history['tbase']:
+            return history
+    vals = array.array('d')
+    vals.fromstring(history['used'])
+    sums = history['sums']
+    pos = history['pos']
+    if history['count'] == size:
+        (t, y) = (times[pos], vals[pos])
+        sums[0] -= t
+        sums[1] -= y
+        sums[2] -= t * t
+        sums[3] -= t * y
+        history['count'] -= 1
+    t = timestamp - history['tbase']
+    y = used - history['ybase']
+    times[pos] = t
+    vals[pos] = y
+    sums[0] += t
+    sums[1] += y
+    sums[2] += t * t
+    sums[3] += t * y
+    history['count'] += 1
+    history['pos'] = (pos + 1) % size
+    if history['pos'] == 0 and history['count'] == size:
+        tshift = times[0]
+        yshift = vals[0]
+        history['tbase'] += tshift
+        history['ybase'] += yshift
+        for idx in range(size):
+            times[idx] -= tshift
+            vals[idx] -= yshift
+        sums[0] = sum(times)
+        sums[1] = sum(vals)
+        sums[2] = sum([t * t for t in times])
+        sums[3] = sum(map(float.__mul__, times, vals))
+    history['times'] = times.tostring()
+    history['used'] = vals.tostring()
+    return history
+
+
+def usage_growth_rate(history, minsamples=forecastMinSamples):
+    """Return the least-squares slope of usage over time for ring buffer.
+    
+    @param history:    Ring buffer returned by usage_history_add.
+    @param minsamples: Minimum number of samples for estimation.
+    @return:           Growth rate in bytes per second or None if there are
+                       not enough samples.
+    
+    """
+    if history is None:
+        return None
+    n = history['count']
+    (st, sy, stt, sty) = history['sums']
+    denom = n * stt - st * st
+    if n < minsamples or denom <= 0:
+        return None
+    return (n * sty - st * sy) / denom
+
+
 class FilesystemInfo:
-    """Class to retrieve stats for disk utilization."""
+    """Class to retrieve stats for disk utilization.
     
-    def __init__(self):
-        """Read /proc/mounts to get filesystem types.
+    The stats are retrieved with statvfs calls executed by a small pool of 
+    worker threads, so a hung network or FUSE mount can not block the caller 
+    longer than the timeout. Mounts that time out are reported as unavailable 
+    and are not queried again until the back-off period expires.
+    
+    """
+    
+    def __init__(self, hung=None, timeout=statvfsTimeout, 
+                 backoff=statvfsBackoff, threads=statvfsThreads, 
+                 mounttable=None):
+        """Read /proc/self/mountinfo to get filesystem types.
+        
+        @param hung:    Dictionary of mounts that timed out in previous runs 
+                        returned by getHungMounts.
+        @param timeout: Timeout in seconds for the statvfs call of each mount.
+        @param backoff: Period in seconds for skipping mounts that time out.
+        @param threads: Number of worker threads for statvfs calls.
+        @param mounttable: Cached mount table returned by getMountTable. 
+                           Reused if the mounts have not changed.
+        
+        """
+        self._timeout = timeout
+        self._backoff = backoff
+        self._threads = threads
+        self._hung = dict(hung or {})
+        self._poll = None
+        self._pollFile = None
+        self._loadMountTable(mounttable)
+    
+    def _loadMountTable(self, mounttable=None):
+        """Read /proc/self/mountinfo and build the indexes of mounts unless 
+        the contents of the file match the hash of the cached mount table.
+        
+        @param mounttable: Cached mount table returned by getMountTable.
+        @return:           True if the mount table was parsed again.
         
         """
-        self._fstypeDict = {}
-        self._fs2devDict = {}
         try:
-            fp = open(mountsFile, 'r')
+            fp = open(mountinfoFile, 'r')
             data = fp.read()
             fp.close()
         except:
-            raise IOError('Reading of file %s failed.' % mountsFile)
-        for line in data.splitlines():
-            cols = line.split()
-            self._fstypeDict[cols[1]] = cols[2]
-            self._fs2devDict[cols[1]] = cols[0]
+            raise IOError('Reading of file %s failed.' % mountinfoFile)
+        digest = hashlib.md5(data).hexdigest()
+        if mounttable is not None and mounttable.get('hash') == digest:
+            parsed = False
+        else:
+            mounttable = parse_mountinfo(data)
+            mounttable['hash'] = digest
+            parsed = True
+        self._mountTable = mounttable
+        self._fstypeDict = mounttable['fstype']
+        self._fs2devDict = mounttable['dev']
+        self._statvfsDict = {}
+        return parsed
+    
+    def getMountTable(self):
+        """Return the indexed mount table for reuse in the next run.
+        
+        @return: Dictionary of mount table indexes.
+        
+        """
+        return self._mountTable
+    
+    def watchMounts(self):
+        """Register for change notifications on /proc/self/mounts for 
+        long-running processes (daemon mode); refreshMounts will then only 
+        read the mount table after the kernel reports a change.
+        
+        The kernel flags the file with POLLERR | POLLPRI when a filesystem 
+        is mounted or unmounted in the mount namespace; each poll clears the
+        flag, so a change is reported once.
+        
+        """
+        if self._poll is None:
+            self._pollFile = open(mountsFile, 'r')
+            self._poll = select.poll()
+            self._poll.register(self._pollFile.fileno(), 
+                                select.POLLERR | select.POLLPRI)
+    
+    def unwatchMounts(self):
+        """Stop change notifications registered with watchMounts."""
+        if self._poll is not None:
+            self._poll.unregister(self._pollFile.fileno())
+            self._pollFile.close()
+            self._poll = None
+            self._pollFile = None
+    
+    def refreshMounts(self):
+        """Reload the mount table if mounts were added or removed.
+        
+        With watchMounts the mount table is parsed again only after a change
+        notification. Without watchMounts (one-shot mode) the contents of 
+        /proc/self/mountinfo are compared with the hash of the cached table 
+        on every call.
+        
+        @return: True if the mount table was parsed again.
+        
+        """
+        if self._poll is not None:
+            events = self._poll.poll(0)
+            if not [event for (fd, event) in events 
+                    if event & (select.POLLERR | select.POLLPRI)]:
+                return False
+        return self._loadMountTable(self._mountTable)
     
     def getFSlist(self):
         """Returns list of filesystems.
@@ -64,54 +302,189 @@ class FilesystemInfo:
         """
         return self._fs2devDict.get(fs)
 
-    def getSpaceUse(self):
+    def getHungMounts(self):
+        """Return the mounts that timed out and are being skipped.
+        
+        @return: Dictionary mapping mount point to the time when the mount 
+                 will be queried again.
+        
+        """
+        now = time.time()
+        return dict([(fs, retry) for (fs, retry) in self._hung.iteritems()
+                     if retry > now])
+    
+    def _statvfsMounts(self, fslist):
+        """Execute statvfs calls for mounts in parallel and cache results.
+        
+        A worker thread stuck on a mount for longer than the timeout is 
+        abandoned and replaced by a new worker; the stuck threads are daemon 
+        threads and do not prevent the process from exiting.
+        
+        @param fslist: List of mount points.
+        
+        """
+        now = time.time()
+        pending = []
+        for fs in fslist:
+            if self._statvfsDict.has_key(fs):
+                continue
+            if self._hung.get(fs, 0) > now:
+                self._statvfsDict[fs] = None
+            else:
+                pending.append(fs)
+        if not pending:
+            return
+        todo = Queue.Queue()
+        done = Queue.Queue()
+        started = {}
+        for fs in pending:
+            todo.put(fs)
+        def worker():
+            while True:
+                try:
+                    fs = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                started[fs] = time.time()
+                try:
+                    done.put((fs, os.statvfs(fs)))
+                except OSError:
+                    done.put((fs, False))
+        def start_worker():
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+        for i in range(min(self._threads, len(pending))):
+            start_worker()
+        abandoned = set()
+        remaining = len(pending)
+        while remaining > 0:
+            now = time.time()
+            wait = self._timeout
+            for (fs, start) in started.items():
+                if self._statvfsDict.has_key(fs) or fs in abandoned:
+                    continue
+                if now - start >= self._timeout:
+                    abandoned.add(fs)
+                    self._statvfsDict[fs] = None
+                    self._hung[fs] = now + self._backoff
+                    remaining -= 1
+                    start_worker()
+                else:
+                    wait = min(wait, start + self._timeout - now)
+            if remaining == 0:
+                break
+            try:
+                (fs, st) = done.get(True, wait)
+            except Queue.Empty:
+                continue
+            if fs not in abandoned:
+                self._statvfsDict[fs] = st
+                self._hung.pop(fs, None)
+                remaining -= 1
+    
+    def _getStatvfs(self, fslist, total='f_blocks'):
+        """Return statvfs results for filesystems.
+        
+        @param fslist: List of mount points. (All filesystems by default.)
+        @param total:  Name of statvfs attribute for the total count of the
+                       resource; f_blocks for space or f_files for inodes.
+        @return:       Dictionary mapping mount point to statvfs result or 
+                       None for mounts that timed out. Filesystems where the 
+                       total is zero and mounts where the call failed are 
+                       excluded like in the output of df.
+        
+        """
+        if fslist is None:
+            fslist = self.getFSlist()
+        self._statvfsMounts(fslist)
+        results = {}
+        for fs in fslist:
+            st = self._statvfsDict.get(fs, False)
+            if st is None or (st and getattr(st, total) > 0):
+                results[fs] = st
+        return results
+    
+    def getFSdevnum(self, fs):
+        """Return the major:minor device number of the filesystem fs.
+        
+        @return: Device number as string.
+        
+        """
+        return self._mountTable['devnum'].get(fs)
+    
+    def getFSlistByType(self, fstype):
+        """Return list of filesystems of type fstype.
+        
+        @return: List of mount points.
+        
+        """
+        return list(self._mountTable['bytype'].get(fstype, []))
+    
+    def getFSlistByDevnum(self, devnum):
+        """Return list of filesystems mounted from device devnum.
+        
+        @param devnum: Device number as major:minor string.
+        @return:       List of mount points.
+        
+        """
+        return list(self._mountTable['bydevnum'].get(devnum, []))
+    
+    def getSpaceUse(self, fslist=None):
         """Get disk space usage.
         
-        @return: Dictionary of filesystem space utilization stats for filesystems.
+        @param fslist: List of mount points for filtering filesystems before
+                       querying. (All filesystems by default.)
+        @return:       Dictionary of filesystem space utilization stats for 
+                       filesystems. The value is None for filesystems that
+                       timed out.
         
         """
         stats = {}
-        try:
-            out = subprocess.Popen([dfCmd, "-Pk"], 
-                                   stdout=subprocess.PIPE).communicate()[0]
-        except:
-            raise Exception('Execution of command %s failed.' % dfCmd)
-        lines = out.splitlines()
-        if len(lines) > 1:
-            for line in lines[1:]:
-                fsstats = {}
-                cols = line.split()
-                fsstats['device'] = cols[0]
-                fsstats['type'] = self._fstypeDict[cols[5]]
-                fsstats['total'] = 1024 * int(cols[1])
-                fsstats['inuse'] = 1024 * int(cols[2])
-                fsstats['avail'] = 1024 * int(cols[3])
-                fsstats['inuse_pcent'] = int(cols[4][:-1])
-                stats[cols[5]] = fsstats
+        for (fs, st) in self._getStatvfs(fslist).iteritems():
+            if st is None:
+                stats[fs] = None
+                continue
+            fsstats = {}
+            fsstats['device'] = self._fs2devDict[fs]
+            fsstats['type'] = self._fstypeDict[fs]
+            fsstats['total'] = st.f_frsize * st.f_blocks
+            fsstats['inuse'] = st.f_frsize * (st.f_blocks - st.f_bfree)
+            fsstats['avail'] = st.f_frsize * st.f_bavail
+            used = st.f_blocks - st.f_bfree
+            if used + st.f_bavail > 0:
+                fsstats['inuse_pcent'] = int(
+                    -(-100 * used // (used + st.f_bavail)))
+            else:
+                fsstats['inuse_pcent'] = 0
+            stats[fs] = fsstats
         return stats
     
-    def getInodeUse(self):
-        """Get disk space usage.
+    def getInodeUse(self, fslist=None):
+        """Get disk inode usage.
         
-        @return: Dictionary of filesysten inode utilization stats for filesystems.
+        @param fslist: List of mount points for filtering filesystems before
+                       querying. (All filesystems by default.)
+        @return:       Dictionary of filesystem inode utilization stats for 
+                       filesystems. The value is None for filesystems that
+                       timed out.
         
         """
         stats = {}
-        try:
-            out = subprocess.Popen([dfCmd, "-i", "-Pk"], 
-                                   stdout=subprocess.PIPE).communicate()[0]
-        except:
-            raise Exception('Execution of command %s failed.' % dfCmd)
-        lines = out.splitlines()
-        if len(lines) > 1:
-            for line in lines[1:]:
-                fsstats = {}
-                cols = line.split()
-                fsstats['device'] = cols[0]
-                fsstats['type'] = self._fstypeDict[cols[5]]
-                fsstats['total'] = int(cols[1])
-                fsstats['inuse'] = int(cols[2])
-                fsstats['avail'] = int(cols[3])
-                fsstats['inuse_pcent'] = int(cols[4][:-1])
-                stats[cols[5]] = fsstats
+        for (fs, st) in self._getStatvfs(fslist, 'f_files').iteritems():
+            if st is None:
+                stats[fs] = None
+                continue
+            fsstats = {}
+            fsstats['device'] = self._fs2devDict[fs]
+            fsstats['type'] = self._fstypeDict[fs]
+            fsstats['total'] = st.f_files
+            fsstats['inuse'] = st.f_files - st.f_ffree
+            fsstats['avail'] = st.f_ffree
+            if st.f_files > 0:
+                fsstats['inuse_pcent'] = int(
+                    -(-100 * (st.f_files - st.f_ffree) // st.f_files))
+            else:
+                fsstats['inuse_pcent'] = 0
+            stats[fs] = fsstats
         return stats
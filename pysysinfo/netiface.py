@@ -3,7 +3,17 @@
 """
 
 import re
+import os
+import time
+import math
+import array
+import fnmatch
+import socket
+import struct
+import fcntl
 import subprocess
+import cPickle as pickle
+from netlink import NetlinkSocket, NETLINK_ROUTE, parse_attrs
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -17,19 +27,185 @@ __status__ = "Development"
 
 # Defaults
 ifaceStatsFile = '/proc/net/dev'
+sysfsNetDir = '/sys/class/net'
+burstSampleInterval = 0.1
+burstPeriod = 300
+burstLeasePeriods = 3
 ipCmd = '/sbin/ip'
-routeCmd = '/sbin/route'
+routeFile = '/proc/net/route'
+
+# Routing Netlink Constants
+RTM_GETLINK = 18
+RTM_GETADDR = 22
+RTM_GETROUTE = 26
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RTN_UNICAST = 1
+
+ifinfomsgFmt = '=BxHiII'
+ifinfomsgLen = struct.calcsize(ifinfomsgFmt)
+ifaddrmsgFmt = '=BBBBI'
+ifaddrmsgLen = struct.calcsize(ifaddrmsgFmt)
+rtmsgFmt = '=BBBBBBBBI'
+rtmsgLen = struct.calcsize(rtmsgFmt)
+
+# Maps
+linkTypeNames = {1: 'ether',
+                 32: 'infiniband',
+                 512: 'ppp',
+                 768: 'ipip',
+                 769: 'tunnel6',
+                 776: 'sit',
+                 778: 'gre',
+                 772: 'loopback',
+                 823: 'gre6',
+                 65534: 'none',}
+
+ifStatsFields = ('rxbytes', 'rxpackets', 'rxerrs', 'rxdrop', 'rxfifo',
+                 'rxframe', 'rxcompressed', 'rxmulticast',
+                 'txbytes', 'txpackets', 'txerrs', 'txdrop', 'txfifo',
+                 'txcolls', 'txcarrier', 'txcompressed')
+sysfsStatsFiles = ('rx_bytes', 'rx_packets', 'rx_errors', 'rx_dropped', 
+                   'rx_fifo_errors', 'rx_frame_errors', 'rx_compressed', 
+                   'multicast',
+                   'tx_bytes', 'tx_packets', 'tx_errors', 'tx_dropped', 
+                   'tx_fifo_errors', 'collisions', 'tx_carrier_errors', 
+                   'tx_compressed')
+
+burstCounters = (('rxbytes', 'rx_bytes'), ('txbytes', 'tx_bytes'),
+                 ('rxpackets', 'rx_packets'), ('txpackets', 'tx_packets'),
+                 ('rxdrop', 'rx_dropped'), ('txdrop', 'tx_dropped'))
+
+# Route Flags
+routeFlags = ((0x0001, 'U'), (0x0002, 'G'), (0x0004, 'H'), (0x0008, 'R'),
+              (0x0010, 'D'), (0x0020, 'M'), (0x0200, '!'))
 
 
 class NetIfaceInfo:
     """Class to retrieve stats for Network Interfaces."""
+    
+    def __init__(self):
+        """Initialize Network Interface Stats."""
+        self._rtnlAvail = None
+    
+    def _rtnlDump(self, addrs=True, routes=True):
+        """Dump links, and optionally addresses and IPv4 routes of the main
+        routing table, through NETLINK_ROUTE.
+        
+        The dumps are sent sequentially through a single socket (the kernel 
+        runs one dump at a time per socket) and the binary attributes of the 
+        replies are parsed directly.
+        
+        @param addrs:  Dump interface addresses if True.
+        @param routes: Dump routes if True.
+        @return:       Dictionary with links keyed by interface index (links),
+                       list of (index, family, addrinfo) tuples (addrs) and 
+                       list of route dictionaries (routes), or None if 
+                       Routing Netlink is unavailable.
+        
+        """
+        if self._rtnlAvail is False:
+            return None
+        links = {}
+        addrlist = []
+        routelist = []
+        nlsock = None
+        try:
+            try:
+                nlsock = NetlinkSocket(NETLINK_ROUTE)
+                for (msgtype, data, start, end) in nlsock.dump(
+                        RTM_GETLINK, struct.pack(ifinfomsgFmt, 0, 0, 0, 0, 0)):
+                    (family, linktype, index, flags, change) = struct.unpack_from(
+                        ifinfomsgFmt, data, start)
+                    attrs = parse_attrs(data, start + ifinfomsgLen, end)
+                    link = {'type': linkTypeNames.get(linktype, 
+                                                      '[%d]' % linktype)}
+                    if attrs.has_key(IFLA_IFNAME):
+                        (astart, aend) = attrs[IFLA_IFNAME]
+                        link['name'] = data[astart:aend].rstrip('\0')
+                    if attrs.has_key(IFLA_ADDRESS):
+                        (astart, aend) = attrs[IFLA_ADDRESS]
+                        link['hwaddr'] = ':'.join(['%02x' % ord(c) 
+                                                   for c in data[astart:aend]])
+                    links[index] = link
+                if addrs:
+                    for (msgtype, data, start, end) in nlsock.dump(
+                            RTM_GETADDR, struct.pack(ifaddrmsgFmt, 0, 0, 0, 0, 0)):
+                        (family, prefixlen, flags, scope, 
+                         index) = struct.unpack_from(ifaddrmsgFmt, data, start)
+                        if family not in (socket.AF_INET, socket.AF_INET6):
+                            continue
+                        attrs = parse_attrs(data, start + ifaddrmsgLen, end)
+                        addr_attr = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+                        if addr_attr is None:
+                            continue
+                        addrinfo = {'addr': socket.inet_ntop(family, 
+                                        data[addr_attr[0]:addr_attr[1]]),
+                                    'mask': prefixlen}
+                        if attrs.has_key(IFA_BROADCAST):
+                            (astart, aend) = attrs[IFA_BROADCAST]
+                            addrinfo['brd'] = socket.inet_ntop(family,
+                                                               data[astart:aend])
+                        addrlist.append((index, family, addrinfo))
+                if routes:
+                    for (msgtype, data, start, end) in nlsock.dump(
+                            RTM_GETROUTE, struct.pack(rtmsgFmt, socket.AF_INET, 
+                                                      0, 0, 0, 0, 0, 0, 0, 0)):
+                        (family, dst_len, src_len, tos, table, proto, scope, 
+                         rtype, flags) = struct.unpack_from(rtmsgFmt, data, start)
+                        attrs = parse_attrs(data, start + rtmsgLen, end)
+                        if attrs.has_key(RTA_TABLE):
+                            (astart, aend) = attrs[RTA_TABLE]
+                            table = struct.unpack_from('=I', data, astart)[0]
+                        if table != RT_TABLE_MAIN:
+                            continue
+                        route = {'dst_len': dst_len, 'type': rtype, 
+                                 'dst': '0.0.0.0', 'gateway': '0.0.0.0',
+                                 'oif': None, 'metric': 0}
+                        for (attr, key) in ((RTA_DST, 'dst'), 
+                                            (RTA_GATEWAY, 'gateway')):
+                            if attrs.has_key(attr):
+                                (astart, aend) = attrs[attr]
+                                route[key] = socket.inet_ntoa(data[astart:aend])
+                        for (attr, key) in ((RTA_OIF, 'oif'), 
+                                            (RTA_PRIORITY, 'metric')):
+                            if attrs.has_key(attr):
+                                (astart, aend) = attrs[attr]
+                                route[key] = struct.unpack_from('=I', data, 
+                                                                astart)[0]
+                        routelist.append(route)
+            except (socket.error, IOError):
+                self._rtnlAvail = False
+                return None
+        finally:
+            if nlsock is not None:
+                nlsock.close()
+        self._rtnlAvail = True
+        return {'links': links, 'addrs': addrlist, 'routes': routelist}
 
-    def getIfStats(self):
+    def getIfStats(self, ifaces=None):
         """Return dictionary of Traffic Stats for Network Interfaces.
         
-        @return: Nested dictionary of statistics for each interface.
+        The stats for all interfaces are parsed from /proc/net/dev. When a 
+        list of interfaces is passed, the counters for only those interfaces 
+        are read from /sys/class/net/<iface>/statistics instead, which is 
+        cheaper on hosts with thousands of interfaces.
+        
+        @param ifaces: List of interfaces. (All interfaces by default.)
+        @return:       Nested dictionary of statistics for each interface.
         
         """
+        if ifaces is not None:
+            return self._getIfStatsSysfs(ifaces)
         info_dict = {}
         try:
             fp = open(ifaceStatsFile, 'r')
@@ -38,23 +214,135 @@ class NetIfaceInfo:
         except:
             raise IOError('Failed reading interface stats from file: %s'
                           % ifaceStatsFile)
+        numfields = len(ifStatsFields)
         for line in data.splitlines():
-            mobj = re.match('^\s*([\w\d:]+):\s*(.*\S)\s*$', line)
-            if mobj:
-                iface = mobj.group(1)
-                statline = mobj.group(2)
-                info_dict[iface] = dict(zip(
-                    ('rxbytes', 'rxpackets', 'rxerrs', 'rxdrop', 'rxfifo',
-                     'rxframe', 'rxcompressed', 'rxmulticast',
-                     'txbytes', 'txpackets', 'txerrs', 'txdrop', 'txfifo',
-                     'txcolls', 'txcarrier', 'txcompressed'),
-                    [int(x) for x in statline.split()]))
-                    
+            (iface, sep, statline) = line.partition(':')
+            if sep:
+                vals = statline.split()
+                if len(vals) == numfields:
+                    info_dict[iface.strip()] = dict(zip(ifStatsFields, 
+                                                        map(int, vals)))
+        return info_dict
+    
+    def _getIfStatsSysfs(self, ifaces):
+        """Return dictionary of Traffic Stats for Network Interfaces reading
+        counters from /sys/class/net/<iface>/statistics.
+        
+        @param ifaces: List of interfaces.
+        @return:       Nested dictionary of statistics for each interface.
+        
+        """
+        info_dict = {}
+        for iface in ifaces:
+            statsdir = os.path.join(sysfsNetDir, iface, 'statistics')
+            if not os.path.isdir(statsdir):
+                continue
+            stats = {}
+            for (key, filename) in zip(ifStatsFields, sysfsStatsFiles):
+                try:
+                    fp = open(os.path.join(statsdir, filename), 'r')
+                    stats[key] = int(fp.read())
+                    fp.close()
+                except (IOError, ValueError):
+                    stats[key] = 0
+            info_dict[iface] = stats
         return info_dict
     
+    def getIfType(self, iface):
+        """Return type of Network Interface from sysfs.
+        
+        The type is the DEVTYPE for the interface (vlan, bridge, bond, wlan, 
+        etc.) if defined, loopback for loopback interfaces, physical for 
+        interfaces backed by a device and virtual for the rest (veth, tun, 
+        etc.)
+        
+        @param iface: Interface name.
+        @return:      Interface type or None for unknown interface.
+        
+        """
+        ifdir = os.path.join(sysfsNetDir, iface)
+        try:
+            fp = open(os.path.join(ifdir, 'uevent'), 'r')
+            data = fp.read()
+            fp.close()
+        except IOError:
+            return None
+        for line in data.splitlines():
+            if line.startswith('DEVTYPE='):
+                return line[len('DEVTYPE='):]
+        try:
+            fp = open(os.path.join(ifdir, 'type'), 'r')
+            linktype = int(fp.read())
+            fp.close()
+        except (IOError, ValueError):
+            linktype = None
+        if linktype == 772:
+            return 'loopback'
+        elif os.path.exists(os.path.join(ifdir, 'device')):
+            return 'physical'
+        else:
+            return 'virtual'
+    
+    def filterIfaces(self, ifaces, globs=None, regex=None, types=None):
+        """Select interfaces matching name patterns and / or types.
+        
+        The type of interfaces is only looked up for the interfaces that 
+        pass the name filters.
+        
+        @param ifaces: List of interface names.
+        @param globs:  List of shell style wildcard patterns. Interfaces 
+                       matching any pattern are selected.
+        @param regex:  Regular expression. Interfaces matching the 
+                       expression are selected.
+        @param types:  List of interface types as returned by getIfType.
+        @return:       List of selected interfaces.
+        
+        """
+        if globs:
+            globs_regex = re.compile('|'.join([fnmatch.translate(pattern)
+                                               for pattern in globs]))
+            ifaces = [iface for iface in ifaces if globs_regex.match(iface)]
+        if regex:
+            regex = re.compile(regex)
+            ifaces = [iface for iface in ifaces if regex.search(iface)]
+        if types:
+            ifaces = [iface for iface in ifaces 
+                      if self.getIfType(iface) in types]
+        return ifaces
+    
     def getIfConfig(self):
         """Return dictionary of Interface Configuration (ifconfig).
         
+        The configuration is obtained through Routing Netlink. The output of 
+        the ip command is parsed if Netlink is not available.
+        
+        @return: Dictionary of if configurations keyed by if name.
+        
+        """
+        rtnl = self._rtnlDump(addrs=True, routes=False)
+        if rtnl is not None:
+            conf = {}
+            for link in rtnl['links'].itervalues():
+                if link.has_key('name'):
+                    conf[link['name']] = dict([(key, val) 
+                                               for (key, val) in link.items()
+                                               if key != 'name'])
+            for (index, family, addrinfo) in rtnl['addrs']:
+                link = rtnl['links'].get(index)
+                if link is None or not link.has_key('name'):
+                    continue
+                if family == socket.AF_INET:
+                    proto = 'inet'
+                else:
+                    proto = 'inet6'
+                conf[link['name']].setdefault(proto, []).append(addrinfo)
+            return conf
+        return self._getIfConfigCmd()
+    
+    def _getIfConfigCmd(self):
+        """Return dictionary of Interface Configuration parsing the output of 
+        the ip command.
+        
         @return: Dictionary of if configurations keyed by if name.
         
         """
@@ -96,18 +384,383 @@ class NetIfaceInfo:
     def getRoutes(self):
         """Get routing table.
         
+        The routes of the main IPv4 routing table are obtained through 
+        Routing Netlink, or by parsing /proc/net/route if Netlink is not 
+        available.
+        
+        @return: List of routes.
+        
+        """
+        rtnl = self._rtnlDump(addrs=False, routes=True)
+        if rtnl is None:
+            return self._getRoutesProc()
+        routes = []
+        for route in rtnl['routes']:
+            flags = 'U'
+            if route['type'] != RTN_UNICAST:
+                flags += '!'
+            if route['gateway'] != '0.0.0.0':
+                flags += 'G'
+            if route['dst_len'] == 32:
+                flags += 'H'
+            link = rtnl['links'].get(route['oif'], {})
+            if route['dst_len'] > 0:
+                mask = (0xffffffffL << (32 - route['dst_len'])) & 0xffffffffL
+            else:
+                mask = 0
+            routes.append({'destination': route['dst'],
+                           'gateway': route['gateway'],
+                           'genmask': socket.inet_ntoa(struct.pack('!I', mask)),
+                           'flags': flags,
+                           'metric': str(route['metric']),
+                           'ref': '0',
+                           'use': '0',
+                           'iface': link.get('name', '*')})
+        return routes
+    
+    def _getRoutesProc(self):
+        """Get routing table parsing /proc/net/route.
+        
         @return: List of routes.
         
         """
         routes = []
         try:
-            out = subprocess.Popen([routeCmd, "-n"], 
-                                   stdout=subprocess.PIPE).communicate()[0]
+            fp = open(routeFile, 'r')
+            data = fp.read()
+            fp.close()
         except:
-            raise Exception('Execution of command %s failed.' % ipCmd)
-        lines = out.splitlines()
-        if len(lines) > 1:
-            headers = [col.lower() for col in lines[1].split()]
-            for line in lines[2:]:
-                routes.append(dict(zip(headers, line.split())))
+            raise IOError('Failed reading routes from file: %s' % routeFile)
+        for line in data.splitlines()[1:]:
+            cols = line.split()
+            if len(cols) < 8:
+                continue
+            flags = ''
+            for (flag, code) in routeFlags:
+                if int(cols[3], 16) & flag:
+                    flags += code
+            (dst, gw, mask) = [socket.inet_ntoa(struct.pack('=I', int(col, 16)))
+                               for col in (cols[1], cols[2], cols[7])]
+            routes.append({'destination': dst,
+                           'gateway': gw,
+                           'genmask': mask,
+                           'flags': flags,
+                           'metric': cols[6],
+                           'ref': cols[4],
+                           'use': cols[5],
+                           'iface': cols[0]})
         return routes
+
+
+class IfaceBurstSampler:
+    """Class for sampling Network Interface counters at sub-second intervals 
+    to detect traffic microbursts that are hidden by averaging.
+    
+    The byte, packet and drop counters are read from 
+    /sys/class/net/<iface>/statistics through file descriptors that are kept
+    open between reads. At the end of every period the samples are reduced 
+    to maximum rate and 99th percentile rate for each counter, and the 
+    summary is written to a file for the Munin Plugin.
+    
+    The list of interfaces and the sampling settings are read from the 
+    config file written by write_burst_config at the end of every period, so 
+    the sampler follows changes without being restarted. The config file 
+    doubles as lease; the sampler exits when it has not been rewritten for 
+    leasePeriods periods, so it does not outlive the plugin. Only one sampler
+    runs for each lock file; the sampler holds an exclusive lock on the file
+    while running.
+    
+    """
+    
+    def __init__(self, configFile, summaryFile, lockFile, 
+                 leasePeriods=burstLeasePeriods):
+        """Initialize sampler.
+        
+        @param configFile:   Path of config file written by 
+                             write_burst_config.
+        @param summaryFile:  Path of file for writing period summaries.
+        @param lockFile:     Path of pid file locked by the running sampler.
+        @param leasePeriods: Exit if config file is older than this number 
+                             of periods.
+        
+        """
+        self._configFile = configFile
+        self._summaryFile = summaryFile
+        self._lockFile = lockFile
+        self._leasePeriods = leasePeriods
+        self._configTime = None
+        self._ifaces = []
+        self._interval = burstSampleInterval
+        self._period = burstPeriod
+        self._fds = []
+    
+    def _lock(self):
+        """Acquire exclusive lock on lock file and write PID.
+        
+        @return: True if lock was acquired, False if another sampler holds
+                 the lock.
+        
+        """
+        self._lockFd = os.open(self._lockFile, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(self._lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(self._lockFd)
+            return False
+        os.ftruncate(self._lockFd, 0)
+        os.write(self._lockFd, "%d\n" % os.getpid())
+        return True
+    
+    def _loadConfig(self):
+        """Read config file if it was rewritten since the last read.
+        
+        @return: True if the list of interfaces or the sampling settings 
+                 have changed.
+        
+        """
+        try:
+            mtime = os.stat(self._configFile).st_mtime
+        except OSError:
+            return False
+        if mtime == self._configTime:
+            return False
+        self._configTime = mtime
+        config = read_burst_summary(self._configFile)
+        if config is None:
+            return False
+        ifaces = sorted(config['ifaces'])
+        changed = (ifaces != self._ifaces 
+                   or config['interval'] != self._interval
+                   or config['period'] != self._period)
+        self._ifaces = ifaces
+        self._interval = config['interval']
+        self._period = config['period']
+        return changed
+    
+    def _openCounters(self):
+        """Open file descriptors for counters of all interfaces."""
+        self._fds = []
+        for iface in self._ifaces:
+            statsdir = os.path.join(sysfsNetDir, iface, 'statistics')
+            for (key, filename) in burstCounters:
+                try:
+                    fd = os.open(os.path.join(statsdir, filename), os.O_RDONLY)
+                except OSError:
+                    fd = None
+                self._fds.append(fd)
+    
+    def _closeCounters(self):
+        """Close file descriptors for counters."""
+        for fd in self._fds:
+            if fd is not None:
+                os.close(fd)
+        self._fds = []
+    
+    def _readCounters(self):
+        """Read current values of counters.
+        
+        @return: List of counter values, None for unavailable counters.
+        
+        """
+        vals = []
+        for fd in self._fds:
+            val = None
+            if fd is not None:
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    val = int(os.read(fd, 32))
+                except (OSError, ValueError):
+                    pass
+            vals.append(val)
+        return vals
+    
+    def _reduce(self, rates):
+        """Reduce samples of period to summary stats.
+        
+        @param rates:  List of arrays of rate samples for each counter.
+        @return:       Nested dictionary of stats keyed by interface and 
+                       <counter>_max, <counter>_p99.
+        
+        """
+        stats = {}
+        idx = 0
+        for iface in self._ifaces:
+            ifstats = {}
+            for (key, filename) in burstCounters:
+                samples = sorted(rates[idx])
+                if samples:
+                    ifstats[key + '_max'] = samples[-1]
+                    pos = int(math.ceil(0.99 * len(samples))) - 1
+                    ifstats[key + '_p99'] = samples[pos]
+                idx += 1
+            stats[iface] = ifstats
+        return stats
+    
+    def _writeSummary(self, stats):
+        """Write summary atomically to summary file.
+        
+        @param stats: Nested dictionary of stats.
+        
+        """
+        summary = {'pid': os.getpid(), 
+                   'time': time.time(),
+                   'interval': self._interval, 
+                   'period': self._period,
+                   'ifaces': self._ifaces, 
+                   'stats': stats}
+        tmpfile = "%s.%d" % (self._summaryFile, os.getpid())
+        fp = open(tmpfile, 'w')
+        pickle.dump(summary, fp)
+        fp.close()
+        os.rename(tmpfile, self._summaryFile)
+    
+    def _leaseValid(self):
+        """Return True if the config file was rewritten recently."""
+        try:
+            age = time.time() - os.stat(self._configFile).st_mtime
+        except OSError:
+            return False
+        return age < self._period * self._leasePeriods
+    
+    def run(self):
+        """Run sampling loop until lease expires.
+        
+        Returns immediately if another sampler holds the lock.
+        
+        """
+        if not self._lock():
+            return
+        self._loadConfig()
+        self._openCounters()
+        try:
+            self._writeSummary({})
+            numcounters = len(self._fds)
+            prev_vals = self._readCounters()
+            prev_time = time.time()
+            next_tick = prev_time + self._interval
+            period_end = prev_time + self._period
+            rates = [array.array('d') for i in range(numcounters)]
+            while True:
+                delay = next_tick - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                    next_tick += self._interval
+                else:
+                    # Fell behind; skip missed ticks.
+                    next_tick = time.time() + self._interval
+                vals = self._readCounters()
+                now = time.time()
+                elapsed = now - prev_time
+                if elapsed > 0:
+                    for i in xrange(numcounters):
+                        val = vals[i]
+                        prev = prev_vals[i]
+                        if val is not None and prev is not None and val >= prev:
+                            rates[i].append((val - prev) / elapsed)
+                prev_vals = vals
+                prev_time = now
+                if now >= period_end:
+                    self._writeSummary(self._reduce(rates))
+                    if not self._leaseValid():
+                        break
+                    if self._loadConfig():
+                        self._closeCounters()
+                        self._openCounters()
+                        numcounters = len(self._fds)
+                        prev_vals = self._readCounters()
+                        prev_time = time.time()
+                        next_tick = prev_time + self._interval
+                        period_end = prev_time + self._period
+                    else:
+                        period_end += self._period
+                    rates = [array.array('d') for i in range(numcounters)]
+        finally:
+            self._closeCounters()
+
+
+def read_burst_summary(summaryFile):
+    """Read summary written by IfaceBurstSampler or config written by 
+    write_burst_config.
+    
+    @param summaryFile: Path of summary file.
+    @return:            Summary dictionary or None if unavailable.
+    
+    """
+    try:
+        fp = open(summaryFile, 'r')
+        summary = pickle.load(fp)
+        fp.close()
+    except:
+        return None
+    return summary
+
+
+def write_burst_config(configFile, ifaces, interval=burstSampleInterval, 
+                       period=burstPeriod):
+    """Write config for IfaceBurstSampler atomically; rewriting the config 
+    renews the lease of the sampler.
+    
+    @param configFile: Path of config file.
+    @param ifaces:     List of interfaces.
+    @param interval:   Sampling interval in seconds.
+    @param period:     Summary period in seconds.
+    
+    """
+    tmpfile = "%s.%d" % (configFile, os.getpid())
+    fp = open(tmpfile, 'w')
+    pickle.dump({'ifaces': list(ifaces), 'interval': interval, 
+                 'period': period}, fp)
+    fp.close()
+    os.rename(tmpfile, configFile)
+
+
+def burst_sampler_running(lockFile):
+    """Check if a sampler holds the lock on lockFile.
+    
+    @param lockFile: Path of pid file locked by the running sampler.
+    @return:         True if a sampler is running.
+    
+    """
+    try:
+        fd = os.open(lockFile, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except IOError:
+            return True
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+    finally:
+        os.close(fd)
+
+
+def start_burst_sampler(configFile, summaryFile, lockFile):
+    """Start IfaceBurstSampler as a detached background process.
+    
+    The standard streams of the sampler are redirected to /dev/null, so that 
+    the caller is not held up by the sampler. The new process exits at once
+    if another sampler holds the lock.
+    
+    @param configFile:  Path of config file written by write_burst_config.
+    @param summaryFile: Path of file for writing period summaries.
+    @param lockFile:    Path of pid file locked by the running sampler.
+    
+    """
+    pid = os.fork()
+    if pid > 0:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.closerange(3, 256)
+        sampler = IfaceBurstSampler(configFile, summaryFile, lockFile)
+        sampler.run()
+    finally:
+        os._exit(0)
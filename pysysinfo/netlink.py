@@ -0,0 +1,170 @@
+"""Implements NetlinkSocket Class for querying the Linux Kernel through
+Netlink Sockets.
+
+The class only implements the generic message framing; the protocol specific
+requests and replies are packed and parsed by the monitoring classes.
+
+"""
+
+import os
+import socket
+import struct
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.9"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+recvBuffSize = 65536
+
+# Netlink Protocols
+NETLINK_ROUTE = 0
+NETLINK_SOCK_DIAG = 4
+
+# Netlink Message Flags
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_ROOT = 0x100
+NLM_F_MATCH = 0x200
+NLM_F_DUMP = NLM_F_ROOT | NLM_F_MATCH
+
+# Netlink Message Types
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+nlmsghdrFmt = '=IHHII'
+nlmsghdrLen = struct.calcsize(nlmsghdrFmt)
+nlattrFmt = '=HH'
+nlattrLen = struct.calcsize(nlattrFmt)
+
+
+def nlmsg_align(length):
+    """Returns length rounded up to the 4 byte Netlink alignment boundary.
+
+    @param length: Length in bytes.
+    @return:       Aligned length in bytes.
+
+    """
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, payload):
+    """Returns Netlink attribute (TLV) of type attr_type with payload.
+
+    @param attr_type: Attribute type.
+    @param payload:   Attribute payload as packed string.
+    @return:          Packed attribute padded to alignment boundary.
+
+    """
+    attrlen = nlattrLen + len(payload)
+    return (struct.pack(nlattrFmt, attrlen, attr_type) + payload
+            + '\0' * (nlmsg_align(attrlen) - attrlen))
+
+
+def parse_attrs(data, start, end):
+    """Parse Netlink attributes in data buffer between offsets start and end.
+
+    The attribute payloads are not copied; offsets into the data buffer are
+    returned instead.
+
+    @param data:  Data buffer.
+    @param start: Offset of first attribute in buffer.
+    @param end:   Offset of the end of the attribute block in buffer.
+    @return:      Dictionary mapping attribute type to (start, end) offsets
+                  of the attribute payload.
+
+    """
+    attrs = {}
+    offset = start
+    while offset + nlattrLen <= end:
+        (attrlen, attr_type) = struct.unpack_from(nlattrFmt, data, offset)
+        if attrlen < nlattrLen:
+            break
+        attrs[attr_type & 0x3fff] = (offset + nlattrLen, offset + attrlen)
+        offset += nlmsg_align(attrlen)
+    return attrs
+
+
+class NetlinkSocket:
+    """Class for sending requests to and receiving replies from the Kernel
+    through Netlink Sockets."""
+
+    def __init__(self, protocol, autoInit=True):
+        """Initialize Netlink Socket.
+
+        @param protocol: Netlink protocol family.
+        @param autoInit: If True open the socket on instantiation.
+
+        """
+        self._protocol = protocol
+        self._sock = None
+        self._seq = 0
+        if autoInit:
+            self._connect()
+
+    def __del__(self):
+        """Cleanup."""
+        self.close()
+
+    def _connect(self):
+        """Open and bind Netlink Socket."""
+        family = getattr(socket, 'AF_NETLINK', None)
+        if family is None:
+            raise IOError('Netlink sockets are not supported on this platform.')
+        self._sock = socket.socket(family, socket.SOCK_RAW, self._protocol)
+        self._sock.bind((0, 0))
+
+    def close(self):
+        """Close Netlink Socket."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def dump(self, msgtype, payload):
+        """Send dump request and iterate through the reply messages.
+
+        The reply messages are processed as they are received from the socket
+        without being accumulated in memory.
+
+        @param msgtype: Netlink message type for request.
+        @param payload: Request payload as packed string.
+        @return:        Generator of (msgtype, data, start, end) tuples, where
+                        data is the receive buffer, and start and end are the
+                        offsets of the message payload in the buffer.
+
+        """
+        self._seq += 1
+        seq = self._seq
+        msg = struct.pack(nlmsghdrFmt, nlmsghdrLen + len(payload), msgtype,
+                          NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + payload
+        self._sock.send(msg)
+        while True:
+            data = self._sock.recv(recvBuffSize)
+            if not data:
+                raise IOError('Netlink socket closed while reading reply.')
+            datalen = len(data)
+            offset = 0
+            while offset + nlmsghdrLen <= datalen:
+                (msglen, mtype, flags, mseq, pid) = struct.unpack_from(
+                    nlmsghdrFmt, data, offset)
+                if msglen < nlmsghdrLen or offset + msglen > datalen:
+                    raise IOError('Malformed Netlink message in reply.')
+                if mseq == seq:
+                    if mtype == NLMSG_DONE:
+                        return
+                    elif mtype == NLMSG_ERROR:
+                        err = -struct.unpack_from('=i', data,
+                                                  offset + nlmsghdrLen)[0]
+                        if err > 0:
+                            raise IOError(err, os.strerror(err))
+                    elif mtype != NLMSG_NOOP:
+                        yield (mtype, data, offset + nlmsghdrLen,
+                               offset + msglen)
+                offset += nlmsg_align(msglen)
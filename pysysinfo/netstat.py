@@ -3,8 +3,13 @@
 """
 
 import re
+import os
+import socket
+import struct
 import subprocess
 from util import TableFilter
+from process import SockProcMap
+from netlink import NetlinkSocket, NETLINK_SOCK_DIAG, pack_attr
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -18,15 +23,456 @@ __status__ = "Development"
 
 # Defaults
 netstatCmd = '/bin/netstat'
+procNetDir = '/proc/net'
+snmpFile = '/proc/net/snmp'
+snmp6File = '/proc/net/snmp6'
+netstatFile = '/proc/net/netstat'
+prefixLenIPv4 = 24
+prefixLenIPv6 = 64
+
+# Socket Diagnostics Constants
+SOCK_DIAG_BY_FAMILY = 20
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_JMP = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+
+inetDiagMsgFmt = '!BBxxH'
+inetDiagQueueFmt = '=II'
+inetDiagQueueOffset = 56
+inetDiagOpFmt = '=BBH'
+
+# Maps
+tcpStateNames = {1: 'ESTABLISHED',
+                 2: 'SYN_SENT',
+                 3: 'SYN_RECV',
+                 4: 'FIN_WAIT1',
+                 5: 'FIN_WAIT2',
+                 6: 'TIME_WAIT',
+                 7: 'CLOSE',
+                 8: 'CLOSE_WAIT',
+                 9: 'LAST_ACK',
+                 10: 'LISTEN',
+                 11: 'CLOSING',
+                 12: 'SYN_RECV',}
+tcpStateListen = 10
+udpStateEstablished = 1
+udpStateUnconnected = 7
+
+aggHeaders = ['proto', 'ipversion', 'recvq', 'sendq', 
+              'localaddr', 'localport','foreignaddr', 'foreignport', 
+              'state', 'foreignprefix', 'inode', 'pid', 'prog']
+sockDiagHeaders = ['proto', 'ipversion', 'localport', 'state']
+
 
-             
-    
 class NetstatInfo:
     """Class to retrieve network stats."""
     
     def __init__(self):
         """Initialize Process Stats."""
-        pass
+        self._sockDiagAvail = None
+    
+    def _sockDiagPortFilter(self, ports):
+        """Returns INET Diag bytecode for selecting sockets bound to any of the
+        local ports in the list.
+        
+        Each port is matched by a S_GE / S_LE pair of operations and the 
+        pairs are chained with jumps, so that the first match accepts the 
+        socket, and falling off the last pair rejects it.
+        
+        @param ports: List of local port numbers.
+        @return:      Bytecode as packed string.
+        
+        """
+        port = ports[0]
+        # (S_GE port) AND (S_LE port); failures jump past the end of block.
+        block = (struct.pack(inetDiagOpFmt, INET_DIAG_BC_S_GE, 8, 20)
+                 + struct.pack(inetDiagOpFmt, 0, 0, port)
+                 + struct.pack(inetDiagOpFmt, INET_DIAG_BC_S_LE, 8, 12)
+                 + struct.pack(inetDiagOpFmt, 0, 0, port))
+        if len(ports) == 1:
+            return block
+        rest = self._sockDiagPortFilter(ports[1:])
+        return (block 
+                + struct.pack(inetDiagOpFmt, INET_DIAG_BC_JMP, 4, len(rest) + 4)
+                + rest)
+    
+    def getSockDiagStats(self, group_by=('state',), ipv4=True, ipv6=True, 
+                         states=None, localports=None):
+        """Query the kernel for TCP sockets through NETLINK_SOCK_DIAG and 
+        return socket counts and queue sizes aggregated by group.
+        
+        Filtering on state and local port is done by the kernel, and the 
+        replies are aggregated as they are received, without building a row 
+        for each socket.
+        
+        @param group_by:   Column or list of columns used for grouping.
+                           Valid columns: proto, ipversion, localport, state.
+        @param ipv4:       Include IPv4 sockets if True.
+        @param ipv6:       Include IPv6 sockets if True.
+        @param states:     List of TCP state numbers to include. 
+                           (All states by default.)
+        @param localports: List of local port numbers to include.
+                           (All ports by default.)
+        @return:           Dictionary mapping group to dictionary of socket 
+                           count (count), and receive and send queue sums 
+                           (recvq, sendq), or None if Socket Diagnostics 
+                           Netlink is unavailable.
+        
+        """
+        if self._sockDiagAvail is False:
+            return None
+        if isinstance(group_by, basestring):
+            group_by = (group_by,)
+        for col in group_by:
+            if col not in sockDiagHeaders:
+                raise ValueError('Invalid column name %s for grouping.' % col)
+        if states is None:
+            state_mask = 0xfff
+        else:
+            state_mask = 0
+            for state in states:
+                state_mask |= 1 << state
+        families = []
+        if ipv4:
+            families.append(socket.AF_INET)
+        if ipv6:
+            families.append(socket.AF_INET6)
+        if localports:
+            bytecode = pack_attr(INET_DIAG_REQ_BYTECODE, 
+                self._sockDiagPortFilter(sorted(set(localports))))
+        else:
+            bytecode = ''
+        groups = {}
+        rec = {'proto': 'tcp'}
+        nlsock = None
+        try:
+            try:
+                nlsock = NetlinkSocket(NETLINK_SOCK_DIAG)
+                for family in families:
+                    if family == socket.AF_INET:
+                        rec['ipversion'] = '4'
+                    else:
+                        rec['ipversion'] = '6'
+                    req = (struct.pack('=BBBxI', family, socket.IPPROTO_TCP, 
+                                       0, state_mask)
+                           + '\0' * 48 + bytecode)
+                    for (msgtype, data, start, end) in nlsock.dump(
+                            SOCK_DIAG_BY_FAMILY, req):
+                        (family, state, port) = struct.unpack_from(
+                            inetDiagMsgFmt, data, start)
+                        (rqueue, wqueue) = struct.unpack_from(
+                            inetDiagQueueFmt, data, start + inetDiagQueueOffset)
+                        rec['state'] = tcpStateNames.get(state, 'UNKNOWN')
+                        rec['localport'] = port
+                        self._aggregateRecord(groups, group_by, rec, 
+                                              rqueue, wqueue)
+            except (socket.error, IOError):
+                self._sockDiagAvail = False
+                return None
+        finally:
+            if nlsock is not None:
+                nlsock.close()
+        self._sockDiagAvail = True
+        if 'localport' in group_by:
+            # Port numbers are converted to strings once per group.
+            idx = list(group_by).index('localport')
+            for key in groups.keys():
+                if len(group_by) == 1:
+                    groups[str(key)] = groups.pop(key)
+                else:
+                    newkey = list(key)
+                    newkey[idx] = str(newkey[idx])
+                    groups[tuple(newkey)] = groups.pop(key)
+        return groups
+    
+    def _aggregateRecord(self, groups, group_by, rec, recvq, sendq):
+        """Add socket to aggregate counters of group.
+        
+        @param groups:   Dictionary of aggregate counters for groups.
+        @param group_by: List of columns used for grouping.
+        @param rec:      Dictionary of column values for socket.
+        @param recvq:    Receive queue size for socket.
+        @param sendq:    Send queue size for socket.
+        
+        """
+        if len(group_by) == 1:
+            key = rec[group_by[0]]
+        else:
+            key = tuple([rec[col] for col in group_by])
+        agg = groups.get(key)
+        if agg is None:
+            agg = groups[key] = {'count': 0, 'recvq': 0, 'sendq': 0}
+        agg['count'] += 1
+        agg['recvq'] += recvq
+        agg['sendq'] += sendq
+    
+    def _decodeProcNetAddr(self, addr):
+        """Decode hexadecimal address from /proc/net/tcp and /proc/net/udp 
+        files into packed binary address in network byte order.
+        
+        @param addr: Address as hexadecimal string of native 32 bit words.
+        @return:     Packed binary address.
+        
+        """
+        words = [int(addr[i:i+8], 16) for i in range(0, len(addr), 8)]
+        return struct.pack('=%dI' % len(words), *words)
+    
+    def _addrPrefix(self, packed, prefix_len):
+        """Return network prefix for address in CIDR notation.
+        
+        @param packed:     Packed binary address.
+        @param prefix_len: Prefix length in bits.
+        @return:           Network prefix as string.
+        
+        """
+        nbits = len(packed) * 8
+        prefix_len = min(prefix_len, nbits)
+        val = long(packed.encode('hex'), 16)
+        val = val >> (nbits - prefix_len) << (nbits - prefix_len)
+        hexstr = '%0*x' % (len(packed) * 2, val)
+        if nbits == 32:
+            family = socket.AF_INET
+        else:
+            family = socket.AF_INET6
+        return "%s/%d" % (socket.inet_ntop(family, hexstr.decode('hex')), 
+                          prefix_len)
+    
+    def parseProcNet(self, group_by=('state',), tcp=True, udp=True, 
+                     ipv4=True, ipv6=True, include_listen=True, 
+                     only_listen=False, resolve_ports=False, 
+                     prefix_len4=prefixLenIPv4, prefix_len6=prefixLenIPv6, 
+                     pfilter=None, procmap=None):
+        """Parse /proc/net/tcp, tcp6, udp and udp6 and aggregate sockets by 
+        group in the same pass.
+        
+        Memory use is bounded by the number of groups; only the columns 
+        required for grouping and filtering are decoded for each socket.
+        
+        @param group_by:       Column or list of columns used for grouping.
+        @param tcp:            Include TCP ports in ouput if True.
+        @param udp:            Include UDP ports in ouput if True.
+        @param ipv4:           Include IPv4 ports in output if True.
+        @param ipv6:           Include IPv6 ports in output if True.
+        @param include_listen: Include listening ports in output if True.
+        @param only_listen:    Include only listening ports in output if True.
+        @param resolve_ports:  Resolve numeric ports to names if True.
+        @param prefix_len4:    Prefix length for foreignprefix column for 
+                               IPv4 addresses.
+        @param prefix_len6:    Prefix length for foreignprefix column for 
+                               IPv6 addresses.
+        @param pfilter:        TableFilter instance used for filtering 
+                               sockets.
+        @param procmap:        SockProcMap instance used for looking up the 
+                               pid and prog columns. A new index is built if
+                               None and the columns are required.
+        @return:               Dictionary mapping group to dictionary of 
+                               socket count (count), and receive and send 
+                               queue sums (recvq, sendq).
+        
+        """
+        if isinstance(group_by, basestring):
+            group_by = (group_by,)
+        cols = set(group_by)
+        if pfilter is not None:
+            cols.update(pfilter.getFilterColumns())
+        for col in cols:
+            if col not in aggHeaders:
+                raise ValueError('Invalid column name %s.' % col)
+        need_local = 'localaddr' in cols or 'localport' in cols
+        need_foreign = ('foreignaddr' in cols or 'foreignport' in cols
+                        or 'foreignprefix' in cols)
+        need_queues = 'recvq' in cols or 'sendq' in cols
+        need_procs = 'pid' in cols or 'prog' in cols
+        if need_procs and procmap is None:
+            procmap = SockProcMap()
+            procmap.refresh()
+        port_names = {}
+        groups = {}
+        for proto in ('tcp', 'udp'):
+            if (proto == 'tcp' and not tcp) or (proto == 'udp' and not udp):
+                continue
+            for ipversion in ('4', '6'):
+                if ipversion == '4':
+                    if not ipv4:
+                        continue
+                    filename = os.path.join(procNetDir, proto)
+                    family = socket.AF_INET
+                    prefix_len = prefix_len4
+                else:
+                    if not ipv6:
+                        continue
+                    filename = os.path.join(procNetDir, proto + '6')
+                    family = socket.AF_INET6
+                    prefix_len = prefix_len6
+                    if not os.path.exists(filename):
+                        continue
+                try:
+                    fp = open(filename, 'r')
+                except:
+                    raise IOError('Failed reading stats from file: %s' 
+                                  % filename)
+                rec = {'proto': proto, 'ipversion': ipversion}
+                try:
+                    fp.readline()
+                    for line in fp:
+                        fields = line.split()
+                        if len(fields) < 10:
+                            continue
+                        state = int(fields[3], 16)
+                        if proto == 'tcp':
+                            listening = (state == tcpStateListen)
+                            rec['state'] = tcpStateNames.get(state, 'UNKNOWN')
+                        else:
+                            listening = (state == udpStateUnconnected)
+                            if state == udpStateEstablished:
+                                rec['state'] = 'ESTABLISHED'
+                            else:
+                                rec['state'] = None
+                        if only_listen:
+                            if not listening:
+                                continue
+                        elif listening and not include_listen:
+                            continue
+                        (sendq, recvq) = fields[4].split(':')
+                        sendq = int(sendq, 16)
+                        recvq = int(recvq, 16)
+                        if need_queues:
+                            rec['recvq'] = str(recvq)
+                            rec['sendq'] = str(sendq)
+                        for (prefix, addrcol, 
+                             do_decode) in (('local', fields[1], need_local),
+                                            ('foreign', fields[2], 
+                                             need_foreign)):
+                            if not do_decode:
+                                continue
+                            (addr, port) = addrcol.split(':')
+                            port = int(port, 16)
+                            if port == 0 and prefix == 'foreign':
+                                port = '*'
+                            elif resolve_ports:
+                                if not port_names.has_key((port, proto)):
+                                    try:
+                                        port_names[(port, proto)] = \
+                                            socket.getservbyport(port, proto)
+                                    except socket.error:
+                                        port_names[(port, proto)] = str(port)
+                                port = port_names[(port, proto)]
+                            else:
+                                port = str(port)
+                            rec[prefix + 'port'] = port
+                            packed = self._decodeProcNetAddr(addr)
+                            rec[prefix + 'addr'] = socket.inet_ntop(family, 
+                                                                    packed)
+                            if prefix == 'foreign' and 'foreignprefix' in cols:
+                                rec['foreignprefix'] = self._addrPrefix(
+                                    packed, prefix_len)
+                        if need_procs or 'inode' in cols:
+                            rec['inode'] = fields[9]
+                        if need_procs:
+                            proc = procmap.lookup(fields[9])
+                            if proc is not None:
+                                (rec['pid'], rec['prog']) = proc
+                            else:
+                                rec['pid'] = rec['prog'] = None
+                        if pfilter is not None and not pfilter.checkRecord(rec):
+                            continue
+                        self._aggregateRecord(groups, group_by, rec, 
+                                              recvq, sendq)
+                finally:
+                    fp.close()
+        return groups
+    
+    def getAggregateStats(self, group_by=('state',), tcp=True, udp=True, 
+                          ipv4=True, ipv6=True, 
+                          include_listen=True, only_listen=False,
+                          resolve_ports=False, 
+                          prefix_len4=prefixLenIPv4, 
+                          prefix_len6=prefixLenIPv6, procmap=None,
+                          **kwargs):
+        """Return socket counts and queue size sums aggregated by group.
+        
+        The aggregation is done in the same pass as parsing, so memory use 
+        is bounded by the number of groups instead of the number of sockets.
+        Socket Diagnostics Netlink is used for TCP sockets, when the grouping 
+        and filtering can be handled by the kernel, the /proc/net files are 
+        parsed otherwise.
+        
+        @param group_by:       Column or list of columns used for grouping.
+                               Valid columns: proto, ipversion, recvq, sendq, 
+                               localaddr, localport, foreignaddr, foreignport, 
+                               state, foreignprefix, inode, pid, prog.
+        @param tcp:            Include TCP ports in ouput if True.
+        @param udp:            Include UDP ports in ouput if True.
+        @param ipv4:           Include IPv4 ports in output if True.
+        @param ipv6:           Include IPv6 ports in output if True.
+        @param include_listen: Include listening ports in output if True.
+        @param only_listen:    Include only listening ports in output if True.
+        @param resolve_ports:  Resolve numeric ports to names if True.
+        @param prefix_len4:    Prefix length for foreignprefix column for 
+                               IPv4 addresses.
+        @param prefix_len6:    Prefix length for foreignprefix column for 
+                               IPv6 addresses.
+        @param procmap:        SockProcMap instance used for looking up the 
+                               pid and prog columns. A new index is built if
+                               None and the columns are required.
+        @param **kwargs:       Keyword variables are used for filtering the 
+                               results depending on the values of the columns. 
+                               Each keyword must correspond to a field name with 
+                               an optional suffix:
+                               field:          Field equal to value or in list 
+                                               of values.
+                               field_ic:       Field equal to value or in list of 
+                                               values, using case insensitive 
+                                               comparison.
+                               field_regex:    Field matches regex value or 
+                                               matches with any regex in list of 
+                                               values.
+                               field_ic_regex: Field matches regex value or 
+                                               matches with any regex in list of 
+                                               values using case insensitive 
+                                               match.
+        @return:               Dictionary mapping group to dictionary of 
+                               socket count (count), and receive and send 
+                               queue sums (recvq, sendq). Groups are keyed by
+                               column value or by tuple of column values when
+                               grouping on multiple columns.
+        
+        """
+        if isinstance(group_by, basestring):
+            group_by = (group_by,)
+        if (tcp and not udp and not resolve_ports 
+            and set(group_by) <= set(sockDiagHeaders)
+            and set(kwargs.keys()) <= set(['state', 'localport'])):
+            states = [state for state in tcpStateNames
+                      if ((include_listen or only_listen 
+                           or state != tcpStateListen)
+                          and (not only_listen or state == tcpStateListen))]
+            localports = None
+            valid = True
+            for (key, vals) in kwargs.items():
+                if isinstance(vals, basestring):
+                    vals = [vals,]
+                if key == 'state':
+                    states = [state for state in states 
+                              if tcpStateNames[state] in vals]
+                elif [val for val in vals if not val.isdigit()]:
+                    valid = False
+                else:
+                    localports = [int(val) for val in vals]
+            if valid:
+                groups = self.getSockDiagStats(group_by, ipv4, ipv6, states, 
+                                               localports)
+                if groups is not None:
+                    return groups
+        if kwargs:
+            pfilter = TableFilter()
+            pfilter.registerFilters(**kwargs)
+        else:
+            pfilter = None
+        return self.parseProcNet(group_by, tcp, udp, ipv4, ipv6, 
+                                 include_listen, only_listen, resolve_ports, 
+                                 prefix_len4, prefix_len6, pfilter, procmap)
     
     def execNetstatCmd(self, *args):
         """Execute ps command with positional params args and return result as 
@@ -198,17 +644,12 @@ class NetstatInfo:
                                number of endpoints.
         
         """
-        status_dict = {}
-        result = self.getStats(tcp=True, udp=False, 
-                               include_listen=include_listen, 
-                               ipv4=ipv4, ipv6=ipv6, 
-                               **kwargs)
-        stats = result['stats']
-        for stat in stats:
-            if stat is not None:
-                status = stat[8].lower()
-            status_dict[status] = status_dict.get(status, 0) + 1
-        return status_dict
+        groups = self.getAggregateStats('state', tcp=True, udp=False, 
+                                        include_listen=include_listen, 
+                                        ipv4=ipv4, ipv6=ipv6, 
+                                        **kwargs)
+        return dict([(status.lower(), agg['count']) 
+                     for (status, agg) in groups.items()])
 
     def getTCPportConnCount(self, ipv4=True, ipv6=True, resolve_ports=False,
                             **kwargs):
@@ -234,17 +675,89 @@ class NetstatInfo:
                                               values using case insensitive 
                                               match.
         @return:              Dictionary mapping port number or name to the
-                              number of established connections.
+                              number of connections. Only established 
+                              connections are counted unless a state filter 
+                              is passed in kwargs.
+        
+        """
+        kwargs.setdefault('state', 'ESTABLISHED')
+        groups = self.getAggregateStats('localport', tcp=True, udp=False, 
+                                        include_listen=False, ipv4=ipv4, 
+                                        ipv6=ipv6, resolve_ports=resolve_ports,
+                                        **kwargs)
+        return dict([(port, agg['count']) for (port, agg) in groups.items()])
+
+    def _parseSnmpTable(self, filename, info_dict):
+        """Parse counters from files in header line / value line pair format 
+        (/proc/net/snmp, /proc/net/netstat) into info_dict.
+        
+        @param filename:  Path of file.
+        @param info_dict: Dictionary updated with counters keyed by protocol
+                          and counter name.
+        
+        """
+        try:
+            fp = open(filename, 'r')
+            data = fp.read()
+            fp.close()
+        except:
+            raise IOError('Failed reading stats from file: %s' % filename)
+        headers = None
+        for line in data.splitlines():
+            cols = line.split()
+            if not cols:
+                continue
+            if headers is not None and headers[0] == cols[0]:
+                info_dict[cols[0][:-1]] = dict(zip(headers[1:], 
+                                                   [int(val) 
+                                                    for val in cols[1:]]))
+                headers = None
+            else:
+                headers = cols
+    
+    def _parseSnmp6(self, filename, info_dict):
+        """Parse counters from files in name / value per line format 
+        (/proc/net/snmp6) into info_dict.
+        
+        @param filename:  Path of file.
+        @param info_dict: Dictionary updated with counters keyed by protocol
+                          and counter name.
+        
+        """
+        try:
+            fp = open(filename, 'r')
+            data = fp.read()
+            fp.close()
+        except:
+            raise IOError('Failed reading stats from file: %s' % filename)
+        for line in data.splitlines():
+            cols = line.split()
+            if len(cols) == 2:
+                # Protocol prefixes: Ip6, Icmp6, Udp6, UdpLite6
+                idx = cols[0].find('6') + 1
+                if idx > 0:
+                    proto = cols[0][:idx]
+                    if not info_dict.has_key(proto):
+                        info_dict[proto] = {}
+                    info_dict[proto][cols[0][idx:]] = int(cols[1])
+    
+    def getProtoStats(self, ipv6=True):
+        """Return kernel protocol counters from /proc/net/snmp, 
+        /proc/net/netstat and /proc/net/snmp6.
+        
+        The counters are obtained with a single read of each file, without 
+        enumerating sockets.
+        
+        @param ipv6: Include IPv6 counters from /proc/net/snmp6 if True.
+        @return:     Nested dictionary of counters keyed by protocol 
+                     (Ip, Icmp, Tcp, Udp, TcpExt, IpExt, Ip6, Udp6, etc.)
+                     and counter name.
         
         """
-        port_dict = {}
-        result = self.getStats(tcp=True, udp=False, 
-                               include_listen=False, ipv4=ipv4, 
-                               ipv6=ipv6, resolve_ports=resolve_ports,
-                               **kwargs)
-        stats = result['stats']
-        for stat in stats:
-            if stat[8] == 'ESTABLISHED':
-                port_dict[stat[5]] = port_dict.get(5, 0) + 1
-        return port_dict
-    
\ No newline at end of file
+        info_dict = {}
+        self._parseSnmpTable(snmpFile, info_dict)
+        if os.path.exists(netstatFile):
+            self._parseSnmpTable(netstatFile, info_dict)
+        if ipv6 and os.path.exists(snmp6File):
+            self._parseSnmp6(snmp6File, info_dict)
+        return info_dict
@@ -5,6 +5,9 @@ remote PostgreSQL Servers.
 
 """
 
+import time
+import array
+import heapq
 import util
 import psycopg2.extras
 
@@ -19,6 +22,79 @@ __status__ = "Development"
 
 
 defaultPGport = 5432
+dbSizeTTL = 3600
+dbSizeMaxQueries = 10
+
+# Columns of the batched statistics query
+dbStatsCols = ('numbackends', 'xact_commit', 'xact_rollback', 
+               'blks_read', 'blks_hit', 'tup_returned', 'tup_fetched', 
+               'tup_inserted', 'tup_updated', 'tup_deleted')
+bgwriterStatsCols = ('checkpoints_timed', 'checkpoints_req', 
+                     'buffers_checkpoint', 'buffers_clean', 
+                     'maxwritten_clean', 'buffers_backend', 'buffers_alloc')
+# PostgreSQL 17 moved the checkpoint stats from pg_stat_bgwriter to 
+# pg_stat_checkpointer and the backend writes to pg_stat_io.
+bgwriterStatsExprs17 = {
+    'checkpoints_timed': 'cp.num_timed',
+    'checkpoints_req': 'cp.num_requested',
+    'buffers_checkpoint': 'cp.buffers_written',
+    'buffers_backend': "(SELECT sum(io.writes)::bigint FROM pg_stat_io AS io "
+                       "WHERE io.object = 'relation' AND io.backend_type "
+                       "NOT IN ('background writer', 'checkpointer'))",
+}
+xlogStatusCols = ('xlog_location', 'xlog_filename', 
+                  'xlog_receive_location', 'xlog_replay_location')
+
+# Per-table and per-index stats: (id, name, activity, source, columns)
+relStatsDefs = {
+    'tables': ('s.relid', "s.schemaname || '.' || s.relname",
+               "s.seq_tup_read + COALESCE(s.idx_tup_fetch, 0) "
+               "+ s.n_tup_ins + s.n_tup_upd + s.n_tup_del",
+               "pg_stat_user_tables AS s JOIN pg_statio_user_tables AS io "
+               "ON io.relid = s.relid",
+               (('s', 'seq_scan'), ('s', 'seq_tup_read'), ('s', 'idx_scan'),
+                ('s', 'idx_tup_fetch'), ('s', 'n_tup_ins'), 
+                ('s', 'n_tup_upd'), ('s', 'n_tup_del'), ('s', 'n_live_tup'),
+                ('s', 'n_dead_tup'), ('s', 'vacuum_count'), 
+                ('s', 'autovacuum_count'), ('s', 'analyze_count'), 
+                ('s', 'autoanalyze_count'), ('io', 'heap_blks_read'), 
+                ('io', 'heap_blks_hit'), ('io', 'idx_blks_read'), 
+                ('io', 'idx_blks_hit'))),
+    'indexes': ('s.indexrelid', 
+                "s.schemaname || '.' || s.indexrelname",
+                "s.idx_scan",
+                "pg_stat_user_indexes AS s JOIN pg_statio_user_indexes AS io "
+                "ON io.indexrelid = s.indexrelid",
+                (('s', 'idx_scan'), ('s', 'idx_tup_read'), 
+                 ('s', 'idx_tup_fetch'), ('io', 'idx_blks_read'), 
+                 ('io', 'idx_blks_hit'))),
+}
+stmtStatsCols = ('calls', 'total_time', 'rows', 'shared_blks_hit', 
+                 'shared_blks_read', 'shared_blks_dirtied', 
+                 'shared_blks_written')
+stmtRankKeys = ('total_time', 'calls', 'mean_time')
+stmtTextLen = 200
+
+# Query ids are 64-bit hashes; arrays of C long are used for the ids where 
+# they are wide enough.
+try:
+    array.array('l', [-2 ** 63])
+    stmtIdTypecode = 'l'
+except OverflowError:
+    stmtIdTypecode = None
+relHitRatios = (('heap_hit_pcent', 'heap_blks_hit', 'heap_blks_read'),
+                ('idx_hit_pcent', 'idx_blks_hit', 'idx_blks_read'))
+
+
+def statement_label(queryid):
+    """Returns short label for pg_stat_statements query id that is stable 
+    between runs.
+    
+    @param queryid: Query id.
+    @return:        Label string.
+    
+    """
+    return 'q%016x' % (queryid & 0xffffffffffffffff)
 
 
 class PgInfo:
@@ -38,6 +114,7 @@ class PgInfo:
         """
         self._connParams = {}
         self._version = None
+        self._snapshotQueries = {}
         self._conn = None
         if host is not None:
             self._connParams['host'] = host
@@ -218,12 +295,34 @@ class PgInfo:
         
         """
         info_dict = {}
-        if self.checkVersion('8.3'):
+        if self.checkVersion('17'):
+            cur = self._conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT %s FROM %s" % self._getBgWriterCols())
+            info_dict = cur.fetchone()
+        elif self.checkVersion('8.3'):
             cur = self._conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             cur.execute("SELECT * FROM pg_stat_bgwriter")
             info_dict = cur.fetchone()
         return info_dict
     
+    def _getBgWriterCols(self):
+        """Returns select list and source for the columns in 
+        bgwriterStatsCols for the server version.
+        
+        @return: Tuple of select list and FROM clause.
+        
+        """
+        if self.checkVersion('17'):
+            cols = ["%s AS %s" % (bgwriterStatsExprs17.get(col, 'bg.' + col), 
+                                  col)
+                    for col in bgwriterStatsCols]
+            source = ("pg_stat_bgwriter AS bg "
+                      "CROSS JOIN pg_stat_checkpointer AS cp")
+        else:
+            cols = ["bg.%s" % col for col in bgwriterStatsCols]
+            source = "pg_stat_bgwriter AS bg"
+        return (", ".join(cols), source)
+    
     def getXlogStatus(self):
         """Returns Transaction Logging or Recovery Status.
         
@@ -249,3 +348,396 @@ class PgInfo:
         if inRecovery is not None:
             info_dict['in_recovery'] = inRecovery
         return info_dict
+    
+    def _getSnapshotQuery(self, dbsize):
+        """Returns batched statistics query for the server version.
+        
+        The server level stats are in one row joined with the rows of 
+        pg_stat_database, so the whole snapshot is retrieved with a single 
+        statement in one round trip.
+        
+        @param dbsize: Include disk usage of databases if True.
+        @return:       Query string.
+        
+        """
+        query = self._snapshotQueries.get(dbsize)
+        if query is not None:
+            return query
+        if self.checkVersion('10'):
+            funcs = ('pg_current_wal_lsn()', 
+                     'pg_walfile_name(pg_current_wal_lsn())',
+                     'pg_last_wal_receive_lsn()', 'pg_last_wal_replay_lsn()')
+        else:
+            funcs = ('pg_current_xlog_location()',
+                     'pg_xlogfile_name(pg_current_xlog_location())',
+                     'pg_last_xlog_receive_location()', 
+                     'pg_last_xlog_replay_location()')
+        if self.checkVersion('9.0'):
+            cols = ["pg_is_in_recovery()",
+                    "CASE WHEN pg_is_in_recovery() THEN NULL "
+                    "ELSE %s::text END" % funcs[0],
+                    "CASE WHEN pg_is_in_recovery() THEN NULL "
+                    "ELSE %s::text END" % funcs[1],
+                    "CASE WHEN pg_is_in_recovery() THEN %s::text END" 
+                    % funcs[2],
+                    "CASE WHEN pg_is_in_recovery() THEN %s::text END" 
+                    % funcs[3]]
+        else:
+            cols = ["NULL", "%s::text" % funcs[0], "%s::text" % funcs[1],
+                    "NULL", "NULL"]
+        cols.insert(0, "current_setting('max_connections')::integer")
+        if self.checkVersion('8.3'):
+            (bgcols, source) = self._getBgWriterCols()
+            cols.append(bgcols)
+        else:
+            cols.extend(["NULL"] * len(bgwriterStatsCols))
+            source = "(SELECT 1) AS srv"
+        cols.append("d.datname")
+        cols.extend(["d.%s" % col for col in dbStatsCols])
+        if dbsize:
+            cols.append("pg_database_size(d.datname)")
+        query = ("SELECT %s FROM %s LEFT JOIN pg_stat_database AS d "
+                 "ON d.datname IS NOT NULL;" % (", ".join(cols), source))
+        self._snapshotQueries[dbsize] = query
+        return query
+    
+    def getStatsSnapshot(self, dbsize=True):
+        """Returns connection, database, background writer and transaction
+        logging stats retrieved with a single query.
+        
+        @param dbsize: Include disk usage of databases if True. The size of 
+                       each database is calculated by walking its files on 
+                       disk.
+        @return:       Nested dictionary of stats with the keys 
+                       max_connections, databases, totals, bgwriter and xlog.
+        
+        """
+        cur = self._conn.cursor()
+        cur.execute(self._getSnapshotQuery(dbsize))
+        rows = cur.fetchall()
+        headers = ('datname',) + dbStatsCols
+        if dbsize:
+            headers += ('disk_size',)
+        nsrv = 2 + len(xlogStatusCols) + len(bgwriterStatsCols)
+        info_dict = {'max_connections': None, 'databases': {}, 
+                     'totals': {}, 'bgwriter': {}, 'xlog': {}}
+        if not rows:
+            return info_dict
+        srv = rows[0][:nsrv]
+        info_dict['max_connections'] = srv[0]
+        xlog = dict([(key, val) for (key, val) 
+                     in zip(xlogStatusCols, srv[2:2 + len(xlogStatusCols)]) 
+                     if val is not None])
+        if srv[1] is not None:
+            xlog['in_recovery'] = srv[1]
+        info_dict['xlog'] = xlog
+        if self.checkVersion('8.3'):
+            info_dict['bgwriter'] = dict(zip(bgwriterStatsCols, 
+                                             srv[2 + len(xlogStatusCols):]))
+        dbrows = [row[nsrv:] for row in rows if row[nsrv] is not None]
+        if dbrows:
+            info_dict['databases'] = self._createStatsDict(headers, dbrows)
+            info_dict['totals'] = self._createTotalsDict(headers, dbrows)
+        return info_dict
+    
+    def getDatabaseSizes(self, databases, cache=None, ttl=dbSizeTTL, 
+                         maxdbs=dbSizeMaxQueries):
+        """Returns disk usage of databases, using cached values where 
+        possible.
+        
+        pg_database_size walks every file of the database on disk, so the 
+        sizes are cached and only the entries older than ttl are refreshed. 
+        The refresh is limited to maxdbs databases per call, starting with 
+        the least recently updated ones, so the cost of each call is bounded 
+        and the databases are refreshed in round-robin.
+        
+        @param databases: List of database names.
+        @param cache:     Dictionary of cached sizes returned by previous 
+                          call.
+        @param ttl:       Time in seconds before cached size is refreshed.
+        @param maxdbs:    Maximum number of databases queried per call.
+        @return:          Dictionary mapping database name to the tuple of 
+                          size in bytes and update time. Databases that have
+                          not been measured yet are omitted.
+        
+        """
+        now = time.time()
+        if cache is None:
+            cache = {}
+        sizes = dict([(db, cache[db]) for db in databases 
+                      if cache.has_key(db)])
+        expired = sorted([(sizes[db][1] if sizes.has_key(db) else 0, db)
+                          for db in databases 
+                          if not sizes.has_key(db) 
+                          or now - sizes[db][1] >= ttl])
+        refresh = [db for (ts, db) in expired[:maxdbs]]
+        if refresh:
+            cur = self._conn.cursor()
+            cur.execute("SELECT datname, pg_database_size(datname) "
+                        "FROM pg_database WHERE datname = ANY(%s);", 
+                        (refresh,))
+            for (db, size) in cur.fetchall():
+                sizes[db] = (size, now)
+        return sizes
+    
+    def _getTopRelStatsQuery(self, kind):
+        """Returns query for top-N per-table or per-index stats.
+        
+        The activity counters of the previous snapshot are passed as arrays
+        and joined with the current counters on the server, so the ranking 
+        by delta and the totals are calculated without transferring the 
+        stats of every relation. The counters are returned only for the 
+        relations whose activity changed since the previous snapshot, along 
+        with the ids of the relations that were dropped.
+        
+        @param kind: tables or indexes.
+        @return:     Query string.
+        
+        """
+        (idcol, namecol, activity, source, cols) = relStatsDefs[kind]
+        curcols = ", ".join(["COALESCE(%s.%s, 0) AS %s" % (alias, col, col)
+                             for (alias, col) in cols])
+        names = [col for (alias, col) in cols]
+        return ("WITH cur AS (SELECT %s::bigint AS id, %s AS name, %s, "
+                "COALESCE(%s, 0) AS activity FROM %s), "
+                "prev AS (SELECT unnest(%%(ids)s::bigint[]) AS id, "
+                "unnest(%%(activity)s::bigint[]) AS activity), "
+                "d AS (SELECT cur.*, CASE WHEN prev.activity IS NULL "
+                "OR cur.activity < prev.activity THEN cur.activity "
+                "ELSE cur.activity - prev.activity END AS delta, "
+                "prev.activity IS DISTINCT FROM cur.activity AS changed "
+                "FROM cur LEFT JOIN prev ON prev.id = cur.id), "
+                "top AS ((SELECT * FROM d ORDER BY delta DESC, name "
+                "LIMIT %%(limit)s) UNION "
+                "SELECT * FROM d WHERE name = ANY(%%(names)s::text[])), "
+                "chg AS (SELECT array_agg(id ORDER BY id) AS ids, "
+                "array_agg(activity ORDER BY id) AS activity "
+                "FROM d WHERE changed), "
+                "gone AS (SELECT array_agg(prev.id) AS ids FROM prev "
+                "LEFT JOIN cur ON cur.id = prev.id WHERE cur.id IS NULL) "
+                "SELECT name, %s, activity, delta, "
+                "NULL::bigint[], NULL::bigint[], NULL::bigint[] FROM top "
+                "UNION ALL "
+                "SELECT NULL, %s, SUM(activity)::bigint, SUM(delta)::bigint, "
+                "(SELECT ids FROM chg), (SELECT activity FROM chg), "
+                "(SELECT ids FROM gone) FROM d;"
+                % (idcol, namecol, curcols, activity, source, 
+                   ", ".join(names), 
+                   ", ".join(["SUM(%s)::bigint" % col for col in names])))
+    
+    def _getTopRelStats(self, kind, prev, limit, names=None):
+        """Returns stats for the relations with highest activity since the 
+        previous snapshot and the totals for all relations.
+        
+        @param kind:  tables or indexes.
+        @param prev:  Snapshot returned by previous call or None.
+        @param limit: Number of relations to return.
+        @param names: Names of relations returned in addition to the top
+                      relations, e.g. the relations graphed in the previous
+                      run.
+        @return:      Dictionary with the keys top (list of stats 
+                      dictionaries ordered by activity), totals and 
+                      snapshot (compact activity counters for next call).
+        
+        """
+        if not self.checkVersion('9.1'):
+            return {}
+        if prev is None:
+            counters = {}
+        else:
+            counters = dict(zip(prev['ids'], prev['activity']))
+        params = {'ids': [long(val) for val in counters.keys()],
+                  'activity': [long(val) for val in counters.values()],
+                  'limit': limit, 'names': list(names or [])}
+        cur = self._conn.cursor()
+        cur.execute(self._getTopRelStatsQuery(kind), params)
+        rows = cur.fetchall()
+        headers = (('name',) + tuple([col for (alias, col) 
+                                      in relStatsDefs[kind][4]]) 
+                   + ('activity', 'delta'))
+        top = []
+        totals = {}
+        for row in rows:
+            stats = dict(zip(headers, row[:len(headers)]))
+            for (key, hit, read) in relHitRatios:
+                if stats.get(hit) is not None and stats.get(read) is not None:
+                    if stats[hit] + stats[read] > 0:
+                        stats[key] = (100.0 * stats[hit] 
+                                      / (stats[hit] + stats[read]))
+                    else:
+                        stats[key] = None
+            if row[0] is not None:
+                top.append(stats)
+            else:
+                del stats['name']
+                totals = stats
+                if row[-3] is not None:
+                    counters.update(zip([float(val) for val in row[-3]], 
+                                        [float(val) for val in row[-2]]))
+                if row[-1] is not None:
+                    for val in row[-1]:
+                        counters.pop(float(val), None)
+        top.sort(key=lambda stats: (-stats['delta'], stats['name']))
+        ids = sorted(counters.keys())
+        snapshot = {'ids': array.array('d', ids), 
+                    'activity': array.array('d', [counters[val] 
+                                                  for val in ids])}
+        return {'top': top, 'totals': totals, 'snapshot': snapshot}
+    
+    def getTableStats(self, prev=None, limit=10, names=None):
+        """Returns scan, tuple, maintenance and block I/O stats for the user 
+        tables of the current database with the highest activity (tuples 
+        read and written) since the previous snapshot.
+        
+        @param prev:  Snapshot returned by previous call or None.
+        @param limit: Number of tables to return.
+        @param names: Names of tables returned in addition to the top tables.
+        @return:      Dictionary with the keys top, totals and snapshot.
+        
+        """
+        return self._getTopRelStats('tables', prev, limit, names)
+    
+    def getIndexStats(self, prev=None, limit=10, names=None):
+        """Returns scan and block I/O stats for the user indexes of the 
+        current database with the most index scans since the previous 
+        snapshot.
+        
+        @param prev:  Snapshot returned by previous call or None.
+        @param limit: Number of indexes to return.
+        @param names: Names of indexes returned in addition to the top 
+                      indexes.
+        @return:      Dictionary with the keys top, totals and snapshot.
+        
+        """
+        return self._getTopRelStats('indexes', prev, limit, names)
+    
+    def getStatementStats(self, prev=None, limit=10, queryids=None):
+        """Returns the statements from pg_stat_statements with the highest 
+        total execution time, number of calls and mean latency since the 
+        previous snapshot.
+        
+        The counters are aggregated by query id and kept in columnar arrays;
+        the deltas are calculated for all statements, but only the top-N 
+        statements for each ranking are returned as dictionaries. Without a 
+        previous snapshot the statements are ranked by the cumulative 
+        counters.
+        
+        @param prev:     Snapshot returned by previous call or None.
+        @param limit:    Number of statements to return for each ranking.
+        @param queryids: Query ids of statements returned in addition to 
+                         the top statements, e.g. the statements graphed in
+                         the previous run.
+        @return:         Dictionary with the keys top (dictionary of lists 
+                         of statement stats keyed by total_time, calls and 
+                         mean_time), selected (statement stats keyed by the
+                         query ids in queryids that are still tracked), 
+                         totals and snapshot, or None if the 
+                         pg_stat_statements view is not available. Times 
+                         are in milliseconds.
+        
+        """
+        if not self.checkVersion('9.4'):
+            return None
+        if self.checkVersion('13'):
+            timecol = 'total_exec_time'
+        else:
+            timecol = 'total_time'
+        cols = ["SUM(%s)::float8" % col for col in stmtStatsCols]
+        cols[1] = "SUM(%s)::float8" % timecol
+        cur = self._conn.cursor()
+        try:
+            cur.execute("SELECT queryid, %s FROM pg_stat_statements "
+                        "WHERE queryid IS NOT NULL GROUP BY queryid;" 
+                        % ", ".join(cols))
+        except psycopg2.Error:
+            self._conn.rollback()
+            return None
+        rows = cur.fetchall()
+        if rows:
+            columns = zip(*rows)
+        else:
+            columns = [()] * (len(stmtStatsCols) + 1)
+        if stmtIdTypecode is not None:
+            ids = array.array(stmtIdTypecode, columns[0])
+        else:
+            ids = list(columns[0])
+        snapshot = {'ids': ids}
+        for (idx, col) in enumerate(stmtStatsCols):
+            snapshot[col] = array.array('d', columns[idx + 1])
+        
+        num = len(ids)
+        prevpos = [None] * num
+        if prev is not None:
+            previdx = dict([(queryid, pos) 
+                            for (pos, queryid) in enumerate(prev['ids'])])
+            prevcalls = prev['calls']
+            curcalls = snapshot['calls']
+            for idx in xrange(num):
+                pos = previdx.get(ids[idx])
+                if pos is not None and curcalls[idx] >= prevcalls[pos]:
+                    prevpos[idx] = pos
+        deltas = {}
+        for col in stmtStatsCols:
+            curvals = snapshot[col]
+            if prev is None:
+                deltas[col] = curvals
+                continue
+            prevvals = prev[col]
+            deltas[col] = [val if pos is None else val - prevvals[pos]
+                           for (val, pos) in zip(curvals, prevpos)]
+        dcalls = deltas['calls']
+        dtime = deltas['total_time']
+        
+        def stmt_dict(idx):
+            stats = {'queryid': ids[idx], 'label': statement_label(ids[idx])}
+            for col in stmtStatsCols:
+                stats[col] = deltas[col][idx]
+            if dcalls[idx] > 0:
+                stats['mean_time'] = dtime[idx] / dcalls[idx]
+            else:
+                stats['mean_time'] = None
+            return stats
+        
+        active = [idx for idx in xrange(num) if dcalls[idx] > 0]
+        top = {}
+        for key in stmtRankKeys:
+            if key == 'mean_time':
+                ranked = heapq.nlargest(limit, active, 
+                    key=lambda idx: dtime[idx] / dcalls[idx])
+            else:
+                vals = deltas[key]
+                ranked = heapq.nlargest(limit, 
+                    [idx for idx in active if vals[idx] > 0],
+                    key=vals.__getitem__)
+            top[key] = [stmt_dict(idx) for idx in ranked]
+        selected = {}
+        if queryids:
+            queryids = set(queryids)
+            for idx in xrange(num):
+                if ids[idx] in queryids:
+                    selected[ids[idx]] = stmt_dict(idx)
+        totals = dict([(col, sum(deltas[col])) for col in stmtStatsCols])
+        if totals['calls'] > 0:
+            totals['mean_time'] = totals['total_time'] / totals['calls']
+        else:
+            totals['mean_time'] = None
+        return {'top': top, 'selected': selected, 'totals': totals, 
+                'snapshot': snapshot}
+    
+    def getStatementText(self, queryids):
+        """Returns normalized query text for pg_stat_statements query ids.
+        
+        @param queryids: List of query ids.
+        @return:         Dictionary mapping query id to query text truncated
+                         to stmtTextLen characters, with whitespace and 
+                         line breaks collapsed.
+        
+        """
+        if not queryids:
+            return {}
+        cur = self._conn.cursor()
+        cur.execute("SELECT DISTINCT ON (queryid) queryid, left(query, %s) "
+                    "FROM pg_stat_statements WHERE queryid = ANY(%s);",
+                    (stmtTextLen, [long(queryid) for queryid in queryids]))
+        return dict([(queryid, " ".join(text.split())) 
+                     for (queryid, text) in cur.fetchall()])
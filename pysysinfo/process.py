@@ -2,8 +2,10 @@
 
 """
 
+import os
 import subprocess
 import re
+import time
 from util import TableFilter
 
 __author__ = "Ali Onur Uyar"
@@ -18,6 +20,8 @@ __status__ = "Development"
 
 # Defaults
 psCmd = '/bin/ps'
+procDir = '/proc'
+sockProcMapTTL = 900
 
 
 # Maps
@@ -243,3 +247,140 @@ class ProcessInfo:
                 'prio': prio, 
                 'locked_in_mem': locked_in_mem, 
                 'total': total}
+
+
+class SockProcMap:
+    """Class for maintaining an index of socket inodes to the PID and program 
+    name of the process owning the socket.
+    
+    Building the index requires walking the /proc/<pid>/fd symlinks of every
+    process, so the index is refreshed incrementally; the descriptor links 
+    are only read again for new processes, processes whose descriptor 
+    listing has changed and processes scanned more than ttl seconds ago.
+    Listing the descriptor directory is much cheaper than reading every 
+    link; a socket that reuses the number of a descriptor closed since the 
+    last scan is picked up when the ttl expires. Entries for dead processes
+    are dropped. 
+    
+    Instances can be pickled to keep the index across plugin runs.
+    
+    """
+    
+    def __init__(self, ttl=sockProcMapTTL):
+        """Initialize empty index.
+        
+        @param ttl: Maximum age in seconds of the descriptor scan for a 
+                    process.
+        
+        """
+        self._ttl = ttl
+        self._procs = {}
+        self._inodeMap = {}
+    
+    def _readProcStat(self, pid):
+        """Return program name and start time of process from 
+        /proc/<pid>/stat.
+        
+        @param pid: Process ID.
+        @return:    Tuple of program name and start time in ticks or None if 
+                    the process is gone.
+        
+        """
+        try:
+            fp = open(os.path.join(procDir, str(pid), 'stat'), 'r')
+            data = fp.read()
+            fp.close()
+        except (IOError, OSError):
+            return None
+        idx = data.rfind(')')
+        fields = data[idx + 2:].split()
+        return (data[data.find('(') + 1:idx], fields[19])
+    
+    def _scanProcFds(self, pid, fds):
+        """Return list of socket inodes for file descriptors of process.
+        
+        @param pid: Process ID.
+        @param fds: List of descriptor numbers as strings.
+        @return:    List of socket inodes as strings.
+        
+        """
+        inodes = []
+        fddir = os.path.join(procDir, str(pid), 'fd')
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fddir, fd))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                inodes.append(target[8:-1])
+        return inodes
+    
+    def _dropProc(self, pid):
+        """Remove process and its socket inodes from index.
+        
+        @param pid: Process ID.
+        
+        """
+        entry = self._procs.pop(pid, None)
+        if entry is not None:
+            for inode in entry[4]:
+                if self._inodeMap.get(inode) == pid:
+                    del self._inodeMap[inode]
+    
+    def refresh(self):
+        """Refresh the index incrementally.
+        
+        @return: Number of processes whose descriptors were rescanned.
+        
+        """
+        now = time.time()
+        live = set()
+        num_scans = 0
+        for name in os.listdir(procDir):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            procstat = self._readProcStat(pid)
+            if procstat is None:
+                continue
+            (prog, starttime) = procstat
+            try:
+                fds = os.listdir(os.path.join(procDir, name, 'fd'))
+            except OSError:
+                fds = []
+            fdsig = (len(fds), hash(tuple(fds)))
+            live.add(pid)
+            entry = self._procs.get(pid)
+            if (entry is not None and entry[0] == starttime 
+                and entry[1] == fdsig and now - entry[2] < self._ttl):
+                continue
+            self._dropProc(pid)
+            inodes = self._scanProcFds(pid, fds)
+            for inode in inodes:
+                self._inodeMap[inode] = pid
+            self._procs[pid] = (starttime, fdsig, now, prog, inodes)
+            num_scans += 1
+        for pid in [pid for pid in self._procs if pid not in live]:
+            self._dropProc(pid)
+        return num_scans
+    
+    def lookup(self, inode):
+        """Return owner process for socket inode.
+        
+        @param inode: Socket inode number.
+        @return:      Tuple of PID and program name as strings or None.
+        
+        """
+        pid = self._inodeMap.get(str(inode))
+        if pid is not None:
+            return (str(pid), self._procs[pid][3])
+        return None
+    
+    def getInodeMap(self):
+        """Return mapping of socket inodes to owner processes.
+        
+        @return: Dictionary mapping socket inodes to (pid, prog) tuples.
+        
+        """
+        return dict([(inode, (str(pid), self._procs[pid][3])) 
+                     for (inode, pid) in self._inodeMap.iteritems()])
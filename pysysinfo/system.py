@@ -2,9 +2,14 @@
 
 """
 
-import re
 import os
+import math
+import array
 import platform
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -23,12 +28,82 @@ cpustatFile = '/proc/stat'
 meminfoFile = '/proc/meminfo'
 swapsFile = '/proc/swaps'
 vmstatFile = '/proc/vmstat'
-
+interruptsFile = '/proc/interrupts'
+softirqsFile = '/proc/softirqs'
+pressureDir = '/proc/pressure'
+cpuStatHeaders = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 
+                  'softirq', 'steal', 'guest', 'guest_nice')
+cpuStatBusyCols = (0, 1, 2, 5, 6, 7)
+cpuStatIdleCols = (3, 4)
+snapshotFiles = (cpustatFile, meminfoFile, vmstatFile, loadavgFile, 
+                 uptimeFile)
 
 
 class SystemInfo:
     """Class to retrieve stats for system resources."""
     
+    def __init__(self, snapshot=False):
+        """Initialize stats retrieval.
+        
+        @param snapshot: If True, read the stats files once on instantiation 
+                         and serve all requests from the snapshot.
+        
+        """
+        self._snapshot = None
+        self._parsed = None
+        if snapshot:
+            self.takeSnapshot()
+    
+    def takeSnapshot(self):
+        """Read the /proc/stat, /proc/meminfo, /proc/vmstat, /proc/loadavg 
+        and /proc/uptime files once and serve all subsequent requests from 
+        memory, for consistent point-in-time values.
+        
+        """
+        self._snapshot = {}
+        self._parsed = {}
+        for filename in snapshotFiles:
+            self._snapshot[filename] = self._readFile(filename)
+    
+    def releaseSnapshot(self):
+        """Discard the snapshot; subsequent requests read the stats files."""
+        self._snapshot = None
+        self._parsed = None
+    
+    def _readFile(self, filename):
+        """Return contents of stats file, from snapshot if available.
+        
+        @param filename: Path of stats file.
+        @return:         File contents.
+        
+        """
+        if self._snapshot is not None and self._snapshot.has_key(filename):
+            return self._snapshot[filename]
+        try:
+            fp = open(filename, 'r')
+            data = fp.read()
+            fp.close()
+        except:
+            raise IOError('Failed reading stats from file: %s' % filename)
+        return data
+    
+    def _getCpuStatLines(self):
+        """Return lines of /proc/stat split into columns.
+        
+        @return: Dictionary mapping first column to list of remaining columns.
+        
+        """
+        if self._parsed is not None and self._parsed.has_key(cpustatFile):
+            return self._parsed[cpustatFile]
+        stat_lines = {}
+        for line in self._readFile(cpustatFile).splitlines():
+            arr = line.split()
+            if len(arr) > 1:
+                stat_lines[arr[0]] = arr[1:]
+        if self._parsed is not None:
+            self._parsed[cpustatFile] = stat_lines
+        return stat_lines
+    
     def getPlatformInfo(self):
         """Get platform info.
         
@@ -49,13 +124,7 @@ class SystemInfo:
         @return: Float that represents uptime in seconds.
         
         """
-        try:
-            fp = open(uptimeFile, 'r')
-            line = fp.readline()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % uptimeFile)
-        return float(line.split()[0])
+        return float(self._readFile(uptimeFile).split()[0])
     
     def getLoadAvg(self):
         """Return system Load Average.
@@ -63,13 +132,7 @@ class SystemInfo:
         @return: List of 1 min, 5 min and 15 min Load Average figures.
         
         """
-        try:
-            fp = open(loadavgFile, 'r')
-            line = fp.readline()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % loadavgFile)
-        arr = line.split()
+        arr = self._readFile(loadavgFile).split()
         if len(arr) >= 3:
             return [float(col) for col in arr[:3]]
         else:
@@ -82,17 +145,131 @@ class SystemInfo:
         
         """
         hz = os.sysconf('SC_CLK_TCK')
-        info_dict = {}
-        try:
-            fp = open(cpustatFile, 'r')
-            line = fp.readline()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % cpustatFile)
         headers = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal', 'guest']
-        arr = line.split()
-        if len(arr) > 1 and arr[0] == 'cpu':
-            return dict(zip(headers[0:len(arr)], [(float(t) / hz) for t in arr[1:]]))
+        arr = self._getCpuStatLines().get('cpu')
+        if arr:
+            return dict(zip(headers[0:len(arr)], [(float(t) / hz) for t in arr]))
+        return {}
+    
+    def getPerCPUuse(self):
+        """Return cpu time utilization in jiffies for each CPU as a 2D array 
+        with one row per CPU and one column per state in cpuStatHeaders.
+        
+        The matrix is a NumPy array if NumPy is available, otherwise the 
+        rows are concatenated in a flat array.array of doubles.
+        
+        @return: Tuple of list of CPU ids and matrix.
+        
+        """
+        ncols = len(cpuStatHeaders)
+        rows = []
+        for (key, arr) in self._getCpuStatLines().iteritems():
+            if key.startswith('cpu') and key[3:].isdigit():
+                row = [float(t) for t in arr[:ncols]]
+                row.extend([0.0] * (ncols - len(row)))
+                rows.append((int(key[3:]), row))
+        rows.sort()
+        cpus = [cpu for (cpu, row) in rows]
+        if numpy is not None:
+            matrix = numpy.array([row for (cpu, row) in rows], dtype=float)
+            matrix.shape = (len(cpus), ncols)
+        else:
+            matrix = array.array('d')
+            for (cpu, row) in rows:
+                matrix.extend(row)
+        return (cpus, matrix)
+    
+    def _parseIrqMatrix(self, filename):
+        """Parse /proc/interrupts or /proc/softirqs format file into matrix 
+        with one row per interrupt source and one column per CPU.
+        
+        Rows that do not have a counter for each CPU (ERR, MIS) are skipped.
+        
+        @param filename: Path of stats file.
+        @return:         Dictionary with list of CPU ids (cpus), list of row 
+                         names (rows), dictionary of row descriptions (desc) 
+                         and matrix; NumPy array if NumPy is available, flat 
+                         array.array of doubles otherwise.
+        
+        """
+        lines = self._readFile(filename).splitlines()
+        if not lines:
+            return None
+        cpus = [int(col[3:]) for col in lines[0].split()]
+        ncpus = len(cpus)
+        rows = []
+        desc = {}
+        matrix = array.array('d')
+        for line in lines[1:]:
+            (key, sep, rest) = line.partition(':')
+            if not sep:
+                continue
+            cols = rest.split(None, ncpus)
+            if len(cols) < ncpus:
+                continue
+            try:
+                matrix.extend([float(col) for col in cols[:ncpus]])
+            except ValueError:
+                continue
+            key = key.strip()
+            rows.append(key)
+            if len(cols) > ncpus:
+                desc[key] = cols[ncpus].strip()
+        if numpy is not None:
+            matrix = numpy.frombuffer(matrix, dtype=float).reshape(len(rows), 
+                                                                  ncpus)
+        return {'cpus': cpus, 'rows': rows, 'desc': desc, 'matrix': matrix}
+    
+    def getInterrupts(self):
+        """Return hardware interrupt counters for each interrupt source and 
+        CPU from /proc/interrupts.
+        
+        @return: Dictionary with list of CPU ids (cpus), list of IRQs (rows),
+                 dictionary of IRQ descriptions (desc) and IRQ x CPU matrix.
+        
+        """
+        return self._parseIrqMatrix(interruptsFile)
+    
+    def getSoftirqs(self):
+        """Return software interrupt counters for each softirq type and CPU 
+        from /proc/softirqs.
+        
+        @return: Dictionary with list of CPU ids (cpus), list of softirq 
+                 types (rows) and softirq x CPU matrix.
+        
+        """
+        return self._parseIrqMatrix(softirqsFile)
+    
+    def getPressureStats(self):
+        """Return Pressure Stall Information (PSI) for cpu, memory and io from 
+        /proc/pressure.
+        
+        The avg10, avg60 and avg300 values are stall time percentages and 
+        total is the cumulative stall time in microseconds. Resources that 
+        are not available (kernels without PSI support) are omitted.
+        
+        @return: Nested dictionary of stats keyed by resource (cpu, memory, 
+                 io) and line type (some, full).
+        
+        """
+        info_dict = {}
+        for resource in ('cpu', 'memory', 'io'):
+            filename = os.path.join(pressureDir, resource)
+            if not os.path.exists(filename):
+                continue
+            stats = {}
+            for line in self._readFile(filename).splitlines():
+                cols = line.split()
+                if len(cols) > 1:
+                    line_stats = {}
+                    for col in cols[1:]:
+                        (key, sep, val) = col.partition('=')
+                        if key == 'total':
+                            line_stats[key] = long(val)
+                        else:
+                            line_stats[key] = float(val)
+                    stats[cols[0]] = line_stats
+            info_dict[resource] = stats
         return info_dict
     
     def getProcessStats(self):
@@ -103,18 +280,12 @@ class SystemInfo:
         
         """
         info_dict = {}
-        try:
-            fp = open(cpustatFile, 'r')
-            data = fp.read()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % cpustatFile)
-        for line in data.splitlines():
-            arr = line.split()
-            if len(arr) > 1 and arr[0] in ('ctxt', 'intr', 'softirq',
-                                           'processes', 'procs_running', 
-                                           'procs_blocked'):
-                info_dict[arr[0]] = arr[1]
+        stat_lines = self._getCpuStatLines()
+        for key in ('ctxt', 'intr', 'softirq', 'processes', 'procs_running', 
+                    'procs_blocked'):
+            arr = stat_lines.get(key)
+            if arr:
+                info_dict[key] = arr[0]
         return info_dict
         
     def getMemoryUse(self):
@@ -124,20 +295,14 @@ class SystemInfo:
         
         """
         info_dict = {}
-        try:
-            fp = open(meminfoFile, 'r')
-            data = fp.read()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % meminfoFile)
-        for line in data.splitlines():
-            mobj = re.match('^(.+):\s*(\d+)\s*(\w+|)\s*$', line)
-            if mobj:
-                if mobj.group(3).lower() == 'kb':
-                    mult = 1024
+        for line in self._readFile(meminfoFile).splitlines():
+            (key, sep, val) = line.partition(':')
+            cols = val.split()
+            if sep and cols and cols[0].isdigit():
+                if len(cols) > 1 and cols[1].lower() == 'kb':
+                    info_dict[key] = int(cols[0]) * 1024
                 else:
-                    mult = 1
-                info_dict[mobj.group(1)] = int(mobj.group(2)) * mult
+                    info_dict[key] = int(cols[0])
         return info_dict
     
     def getSwapStats(self):
@@ -147,13 +312,7 @@ class SystemInfo:
             
         """
         info_dict = {}
-        try:
-            fp = open(swapsFile, 'r')
-            data = fp.read()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % swapsFile)
-        lines = data.splitlines()
+        lines = self._readFile(swapsFile).splitlines()
         if len(lines) > 1:
             colnames = [name.lower() for name in lines[0].split()]
             for line in lines[1:]:
@@ -168,14 +327,134 @@ class SystemInfo:
         
         """
         info_dict = {}
-        try:
-            fp = open(vmstatFile, 'r')
-            data = fp.read()
-            fp.close()
-        except:
-            raise IOError('Failed reading stats from file: %s' % vmstatFile)
-        for line in data.splitlines():
+        for line in self._readFile(vmstatFile).splitlines():
             cols = line.split()
             if len(cols) == 2:
                 info_dict[cols[0]] = cols[1]
         return info_dict
+
+
+def cpu_busy_percent(prev, cur):
+    """Return percentage of busy time for each CPU in the interval between 
+    two matrices returned by SystemInfo.getPerCPUuse.
+    
+    Guest time is already accounted in user and nice time, and idle and 
+    iowait time are counted as not busy.
+    
+    @param prev: Matrix from previous run.
+    @param cur:  Matrix from current run.
+    @return:     List of busy percentages, one per CPU.
+    
+    """
+    ncols = len(cpuStatHeaders)
+    if numpy is not None:
+        delta = (numpy.asarray(cur, dtype=float).reshape(-1, ncols)
+                 - numpy.asarray(prev, dtype=float).reshape(-1, ncols))
+        busy = delta[:, cpuStatBusyCols].sum(axis=1)
+        total = busy + delta[:, cpuStatIdleCols].sum(axis=1)
+        return (100.0 * busy / numpy.maximum(total, 1)).tolist()
+    else:
+        delta = array.array('d', map(float.__sub__, cur, prev))
+        result = []
+        for offset in xrange(0, len(delta), ncols):
+            busy = sum([delta[offset + i] for i in cpuStatBusyCols])
+            total = busy + sum([delta[offset + i] for i in cpuStatIdleCols])
+            result.append(100.0 * busy / max(total, 1))
+        return result
+
+
+def cpu_imbalance(busy):
+    """Return summary of imbalance of utilization between CPUs.
+    
+    @param busy: List of busy percentages, one per CPU.
+    @return:     Dictionary of max, min, avg and stddev percentages.
+    
+    """
+    if not busy:
+        return {}
+    if numpy is not None:
+        vals = numpy.asarray(busy)
+        return {'max': float(vals.max()), 'min': float(vals.min()),
+                'avg': float(vals.mean()), 'stddev': float(vals.std())}
+    avg = sum(busy) / len(busy)
+    variance = sum([(val - avg) ** 2 for val in busy]) / len(busy)
+    return {'max': max(busy), 'min': min(busy), 
+            'avg': avg, 'stddev': math.sqrt(variance)}
+
+
+def irq_row_totals(stats):
+    """Return totals over all CPUs for each row of interrupt matrix returned
+    by SystemInfo.getInterrupts or SystemInfo.getSoftirqs.
+    
+    @param stats: Interrupt stats.
+    @return:      List of row totals.
+    
+    """
+    if numpy is not None:
+        return numpy.asarray(stats['matrix']).sum(axis=1).tolist()
+    ncpus = len(stats['cpus'])
+    matrix = stats['matrix']
+    return [sum(matrix[offset:offset + ncpus]) 
+            for offset in xrange(0, len(matrix), ncpus)]
+
+
+def irq_deltas(prev, cur):
+    """Return deltas between two interrupt matrices returned by 
+    SystemInfo.getInterrupts or SystemInfo.getSoftirqs.
+    
+    Rows are matched by name; rows that are not in the previous matrix get 
+    zero deltas. Negative deltas (counter resets) are clipped to zero.
+    
+    @param prev: Interrupt stats from previous run.
+    @param cur:  Interrupt stats from current run.
+    @return:     Dictionary with list of row names (rows), per row totals 
+                 (rowtotals), per CPU totals (cputotals) and the delta 
+                 matrix (matrix) as list of rows, or None if the set of CPUs 
+                 changed.
+    
+    """
+    if prev is None or cur is None or prev['cpus'] != cur['cpus']:
+        return None
+    ncpus = len(cur['cpus'])
+    rows = cur['rows']
+    if numpy is not None:
+        cur_matrix = numpy.asarray(cur['matrix'], dtype=float).reshape(-1, 
+                                                                       ncpus)
+        prev_matrix = numpy.asarray(prev['matrix'], 
+                                    dtype=float).reshape(-1, ncpus)
+        if prev['rows'] == rows:
+            delta = cur_matrix - prev_matrix
+        else:
+            prev_idx = dict([(row, idx) 
+                             for (idx, row) in enumerate(prev['rows'])])
+            aligned = numpy.array([prev_idx.get(row, -1) for row in rows])
+            delta = cur_matrix - prev_matrix[aligned.clip(0)]
+            delta[aligned < 0] = 0
+        delta = delta.clip(0)
+        return {'rows': rows, 
+                'rowtotals': delta.sum(axis=1).tolist(),
+                'cputotals': delta.sum(axis=0).tolist(),
+                'matrix': delta.tolist()}
+    else:
+        prev_offsets = dict([(row, idx * ncpus) 
+                             for (idx, row) in enumerate(prev['rows'])])
+        cur_matrix = cur['matrix']
+        prev_matrix = prev['matrix']
+        delta = []
+        cputotals = [0.0] * ncpus
+        for (idx, row) in enumerate(rows):
+            offset = idx * ncpus
+            prev_offset = prev_offsets.get(row)
+            if prev_offset is None:
+                row_delta = [0.0] * ncpus
+            else:
+                row_delta = [max(val, 0.0) for val in 
+                             map(float.__sub__, 
+                                 cur_matrix[offset:offset + ncpus],
+                                 prev_matrix[prev_offset:prev_offset + ncpus])]
+                cputotals = map(float.__add__, cputotals, row_delta)
+            delta.append(row_delta)
+        return {'rows': rows, 
+                'rowtotals': [sum(row_delta) for row_delta in delta],
+                'cputotals': cputotals,
+                'matrix': delta}
@@ -232,6 +232,54 @@ class TableFilter:
                 ignore_case = False
             self.registerFilter(col, patterns, is_regex, ignore_case)
             
+    def getFilterColumns(self):
+        """Returns list of columns with registered filters.
+        
+        @return: List of column names.
+        
+        """
+        return self._filters.keys()
+    
+    def _checkValue(self, col_val, patterns, is_regex, ignore_case):
+        """Check column value against filter patterns.
+        
+        @param col_val:     Column value.
+        @param patterns:    List of patterns.
+        @param is_regex:    Patterns are compiled regexes if True.
+        @param ignore_case: Case insensitive matching will be used if True.
+        @return:            True if the value matches any pattern.
+        
+        """
+        if is_regex:
+            if col_val is None:
+                return False
+            for pattern in patterns:
+                if pattern.search(col_val):
+                    return True
+            return False
+        else:
+            if ignore_case and col_val is not None:
+                col_val = col_val.lower()
+            return col_val in patterns
+    
+    def checkRecord(self, record):
+        """Check if record passes all registered filters.
+        
+        Permits filtering rows one at a time as they are parsed, without 
+        building the complete table in memory.
+        
+        @param record: Dictionary mapping column names to values.
+        @return:       True if the record matches all registered filters.
+        
+        """
+        for (column, (patterns, 
+                      is_regex, 
+                      ignore_case)) in self._filters.items():
+            if not self._checkValue(record.get(column), 
+                                    patterns, is_regex, ignore_case):
+                return False
+        return True
+    
     def applyFilters(self, headers, table):
         """Apply filter on ps command result.
         
@@ -252,21 +300,9 @@ class TableFilter:
             for (column, (patterns, 
                           is_regex, 
                           ignore_case)) in self._filters.items():
-                col_idx = column_idxs[column]
-                col_val = row[col_idx]
-                if is_regex:
-                    for pattern in patterns:
-                        if pattern.search(col_val):
-                            break
-                    else:
-                        break
-                else:
-                    if ignore_case:
-                        col_val = col_val.lower()
-                    if col_val in patterns:
-                        pass
-                    else:
-                        break
+                if not self._checkValue(row[column_idxs[column]], 
+                                        patterns, is_regex, ignore_case):
+                    break
             else:
                 result.append(row)
         return result